@@ -0,0 +1,157 @@
+"""
+Connections per second the mysql module handles from greeting to denial.
+
+The MySQL factory runs in a child process, the clients in this one, so the
+CPU time the child reports is the honeypot's cost alone. Each client reads
+the greeting, sends a login, reads the access denied error and
+disconnects. --segment splits the login into writes of that many bytes.
+Like honeypotd, it needs a honeypot.conf in the working directory or in
+/etc/honeypotd.
+
+    python benchmarks/mysql_handshake.py --count 5000 --concurrency 50
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from struct import pack
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+BANNER = b"5.5.43-0ubuntu0.14.04.1"
+
+
+class NullService(object):
+    banner = BANNER
+
+    def log(self, *args, **kwargs):
+        pass
+
+
+def serve(conn):
+    from honeypot.modules import mysql
+    from twisted.internet import reactor
+
+    factory = mysql.SQLFactory(BANNER)
+    factory.canaryservice = NullService()
+    port = reactor.listenTCP(0, factory, interface="127.0.0.1", backlog=1024)
+
+    def done():
+        conn.send(time.process_time())
+
+    reactor.addSystemEventTrigger("before", "shutdown", done)
+    conn.send((port.getHost().port, time.process_time()))
+    reactor.run()
+
+
+def login():
+    """A HandshakeResponse packet for root with a 20 byte scramble"""
+    payload = (
+        pack("<IIB", 0x000FA685, 0x01000000, 0x21)
+        + b"\x00" * 23
+        + b"root\x00"
+        + b"\x14"
+        + os.urandom(20)
+        + b"mysql_native_password\x00"
+    )
+    return pack("<I", len(payload))[:3] + b"\x01" + payload
+
+
+def handshake(port, count, concurrency, segment):
+    from twisted.internet import defer, protocol, reactor
+
+    result = {"done": 0, "failed": 0}
+    finished = defer.Deferred()
+    state = {"started": 0, "running": 0}
+    packet = login()
+
+    class Client(protocol.Protocol):
+        received = b""
+        denied = False
+
+        def dataReceived(self, data):
+            self.received += data
+            if len(self.received) < 4:
+                return
+            length = int.from_bytes(self.received[:3], "little")
+            if len(self.received) < 4 + length:
+                return
+            if self.received[3] == 0:
+                # the greeting, log in
+                self.received = self.received[4 + length :]
+                size = segment or len(packet)
+                for i in range(0, len(packet), size):
+                    self.transport.write(packet[i : i + size])
+            elif self.received[4:5] == b"\xff":
+                self.denied = True
+                self.transport.loseConnection()
+
+        def connectionLost(self, reason):
+            result["done" if self.denied else "failed"] += 1
+            state["running"] -= 1
+            more()
+
+    factory = protocol.ClientFactory()
+    factory.protocol = Client
+
+    def more():
+        while state["started"] < count and state["running"] < concurrency:
+            state["started"] += 1
+            state["running"] += 1
+            reactor.connectTCP("127.0.0.1", port, factory)
+        if state["running"] == 0 and not finished.called:
+            finished.callback(result)
+
+    reactor.callWhenRunning(more)
+    return finished
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--segment", type=int, default=0)
+    args = parser.parse_args()
+
+    parent, child = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=serve, args=(child,))
+    proc.start()
+    port, cpuStart = parent.recv()
+
+    # only after the fork, so the child gets a reactor of its own
+    from twisted.internet import reactor
+
+    started = time.monotonic()
+    d = handshake(port, args.count, args.concurrency, args.segment)
+    report = {}
+
+    def stop(result):
+        report.update(result)
+        report["elapsed"] = time.monotonic() - started
+        reactor.stop()
+
+    d.addCallback(stop)
+    reactor.run()
+
+    os.kill(proc.pid, signal.SIGTERM)
+    cpuEnd = parent.recv()
+    proc.join()
+
+    done = max(report["done"], 1)
+    print("%6s %6s %10s %12s" % ("ok", "failed", "conn/sec", "cpu-us/conn"))
+    print(
+        "%6d %6d %10.1f %12.1f"
+        % (
+            report["done"],
+            report["failed"],
+            report["done"] / report["elapsed"],
+            (cpuEnd - cpuStart) * 1e6 / done,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
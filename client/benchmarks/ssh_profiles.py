@@ -0,0 +1,181 @@
+"""
+Handshake throughput and server CPU cost of each ssh.profile.
+
+The SSH factory runs in a child process, the clients in this one, so the
+CPU time the child reports is the honeypot's cost alone. Each client
+completes the key exchange and disconnects.
+
+    python benchmarks/ssh_profiles.py --count 200 --concurrency 10
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import warnings
+
+# cryptography warns about DSA and finite field DH on every use
+warnings.simplefilter("ignore")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+class NullLogger(object):
+    LOG_SSH_NEW_CONNECTION = 4000
+    LOG_SSH_REMOTE_VERSION_SENT = 4001
+    LOG_SSH_LOGIN_ATTEMPT = 4002
+
+    def log(self, data):
+        pass
+
+
+class NullService(object):
+    logger = NullLogger()
+
+    def log(self, *args, **kwargs):
+        pass
+
+
+def serve(profile, conn):
+    from honeypot.modules import ssh
+    from twisted.cred import portal
+    from twisted.internet import reactor
+
+    factory = ssh.HoneyPotSSHFactory(
+        logger=NullLogger(),
+        version=b"SSH-2.0-OpenSSH_5.1p1 Debian-5",
+        profile=profile,
+    )
+    factory.canaryservice = NullService()
+    factory.portal = portal.Portal(ssh.HoneyPotRealm())
+    factory.publicKeys, factory.privateKeys = ssh.loadHostKeys()
+    port = reactor.listenTCP(0, factory, interface="127.0.0.1")
+
+    def done():
+        conn.send(time.process_time())
+
+    reactor.addSystemEventTrigger("before", "shutdown", done)
+    conn.send((port.getHost().port, time.process_time()))
+    reactor.run()
+
+
+def handshake(port, count, concurrency):
+    from twisted.conch.ssh import transport
+    from twisted.internet import defer, protocol, reactor
+
+    result = {"done": 0, "failed": 0, "kex": set(), "hostkey": set()}
+    finished = defer.Deferred()
+    state = {"started": 0, "running": 0}
+
+    class Client(transport.SSHClientTransport):
+        def verifyHostKey(self, hostKey, fingerprint):
+            return defer.succeed(True)
+
+        def connectionSecure(self):
+            result["done"] += 1
+            result["kex"].add(self.kexAlg.decode())
+            result["hostkey"].add(self.keyAlg.decode())
+            self.secure = True
+            self.transport.loseConnection()
+
+        def connectionLost(self, reason):
+            transport.SSHClientTransport.connectionLost(self, reason)
+            if not getattr(self, "secure", False):
+                result["failed"] += 1
+            state["running"] -= 1
+            more()
+
+    factory = protocol.ClientFactory()
+    factory.protocol = Client
+
+    def more():
+        while state["started"] < count and state["running"] < concurrency:
+            state["started"] += 1
+            state["running"] += 1
+            reactor.connectTCP("127.0.0.1", port, factory)
+        if state["running"] == 0 and not finished.called:
+            finished.callback(result)
+
+    reactor.callWhenRunning(more)
+    return finished
+
+
+def bench(profile, count, concurrency):
+    parent, child = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=serve, args=(profile, child))
+    proc.start()
+    port, cpuStart = parent.recv()
+
+    # only after the fork, so the child gets a reactor of its own
+    from twisted.internet import reactor
+
+    started = time.monotonic()
+    d = handshake(port, count, concurrency)
+    report = {}
+
+    def stop(result):
+        report.update(result)
+        report["elapsed"] = time.monotonic() - started
+        reactor.stop()
+
+    d.addCallback(stop)
+    reactor.run()
+
+    os.kill(proc.pid, signal.SIGTERM)
+    cpuEnd = parent.recv()
+    proc.join()
+    report["cpu"] = cpuEnd - cpuStart
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--profiles", default="cheap,default,legacy-faithful")
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--profile", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.profile:
+        # one profile per process, the reactor cannot be restarted
+        r = bench(args.profile, args.count, args.concurrency)
+        done = max(r["done"], 1)
+        print(
+            "%-16s %6d %6d %10.1f %12.2f  %s / %s"
+            % (
+                args.profile,
+                r["done"],
+                r["failed"],
+                r["done"] / r["elapsed"],
+                r["cpu"] * 1000 / done,
+                ",".join(sorted(r["kex"])),
+                ",".join(sorted(r["hostkey"])),
+            )
+        )
+        return
+
+    print(
+        "%-16s %6s %6s %10s %12s  %s"
+        % ("profile", "ok", "failed", "hs/sec", "cpu-ms/hs", "kex / host key")
+    )
+    sys.stdout.flush()
+    for profile in args.profiles.split(","):
+        os.spawnv(
+            os.P_WAIT,
+            sys.executable,
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--profile",
+                profile,
+                "--count",
+                str(args.count),
+                "--concurrency",
+                str(args.concurrency),
+            ],
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Folding of repeated events into periodic summaries.
+
+Brute-force and scan tools produce thousands of near identical events from
+a single source. The first event for a `(src_host, dst_port, logtype)` key is
+always passed through untouched so alerting is not delayed; further events
+for that key are counted until the key's window closes, and then reported
+as one summary event with the count, the first and last timestamps and a
+capped sample of the credentials that were tried.
+"""
+
+from collections import OrderedDict
+from time import monotonic
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+
+class _Window(object):
+    __slots__ = (
+        "opened",
+        "event",
+        "count",
+        "first_seen",
+        "last_seen",
+        "usernames",
+        "passwords",
+    )
+
+    def __init__(self, opened):
+        self.opened = opened
+        self.event = None
+        self.count = 0
+        self.first_seen = None
+        self.last_seen = None
+        self.usernames = []
+        self.passwords = []
+
+
+class EventAggregator(object):
+    """
+    Merge events sharing a `(src_host, dst_port, logtype)` key.
+
+    `add` returns True when the caller should emit the event as usual and
+    False when it was folded into a window. Closed windows that folded at
+    least one event are handed to `emit` as a summary event. Only logtypes
+    listed in `logtypes` are aggregated, and at most `max_keys` windows are
+    kept open; the oldest are closed early when that limit is reached.
+    """
+
+    def __init__(self, emit, window=60, sample_size=10, logtypes=(), max_keys=10000):
+        self.emit = emit
+        self.window = float(window)
+        self.sample_size = int(sample_size)
+        self.logtypes = frozenset(int(t) for t in logtypes)
+        self.max_keys = int(max_keys)
+
+        # windows are all the same length, so insertion order is expiry order
+        self.windows = OrderedDict()
+
+        self.closer = LoopingCall(self.expire)
+        reactor.callWhenRunning(self.closer.start, min(self.window, 1.0), False)
+        reactor.addSystemEventTrigger("before", "shutdown", self.close)
+
+    def add(self, logdata):
+        if logdata.get("honeycred") or logdata.get("logtype") not in self.logtypes:
+            return True
+
+        key = (logdata.get("src_host"), logdata.get("dst_port"), logdata["logtype"])
+        window = self.windows.get(key)
+        if window is None:
+            if len(self.windows) >= self.max_keys:
+                self._close(*self.windows.popitem(last=False))
+            self.windows[key] = _Window(monotonic())
+            return True
+
+        window.count += 1
+        window.last_seen = logdata.get("utc_time")
+        if window.event is None:
+            window.event = logdata
+            window.first_seen = window.last_seen
+
+        fields = logdata.get("logdata") or {}
+        self._sample(window.usernames, fields.get("USERNAME"))
+        self._sample(window.passwords, fields.get("PASSWORD"))
+        return False
+
+    def _sample(self, samples, value):
+        if value is None or len(samples) >= self.sample_size or value in samples:
+            return
+        samples.append(value)
+
+    def expire(self):
+        """Close every window older than the aggregation window"""
+        deadline = monotonic() - self.window
+        while self.windows:
+            key, window = next(iter(self.windows.items()))
+            if window.opened > deadline:
+                break
+            del self.windows[key]
+            self._close(key, window)
+
+    def close(self):
+        """Report all open windows, used at shutdown"""
+        if self.closer.running:
+            self.closer.stop()
+        while self.windows:
+            self._close(*self.windows.popitem(last=False))
+
+    def _close(self, key, window):
+        if not window.count:
+            return
+        event = window.event
+        summary = {
+            "src_host": event.get("src_host"),
+            "src_port": event.get("src_port"),
+            "dst_host": event.get("dst_host"),
+            "dst_port": event.get("dst_port"),
+            "logtype": event.get("logtype"),
+            "logdata": {
+                "AGGREGATED": True,
+                "COUNT": window.count,
+                "FIRST_SEEN": window.first_seen,
+                "LAST_SEEN": window.last_seen,
+                "USERNAMES": window.usernames,
+                "PASSWORDS": window.passwords,
+                "DATA": "%d similar events between %s and %s"
+                % (window.count, window.first_seen, window.last_seen),
+            },
+        }
+        self.emit(summary)
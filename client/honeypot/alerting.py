@@ -0,0 +1,131 @@
+"""
+Background delivery of alerts to chat webhooks.
+
+Logging handlers only hand events to a `WebhookDispatcher`; the HTTP
+requests run on the reactor thread pool. Every destination has its own
+bounded queue and token bucket. Events beyond the rate limit are not sent
+one by one but folded into a per-source digest that goes out once per
+digest window, and failed deliveries are retried with exponential backoff.
+"""
+
+from __future__ import print_function
+
+from collections import OrderedDict, deque
+from sys import stderr
+
+from requests import post
+from twisted.internet import reactor, threads
+from twisted.internet.task import LoopingCall
+
+from honeypot.ratelimit import TokenBucket
+
+
+class WebhookError(Exception):
+    def __init__(self, code, text):
+        self.code = code
+        self.text = text
+
+    def __str__(self):
+        return "%s %s" % (self.code, self.text)
+
+
+class WebhookDispatcher(object):
+    """
+    Rate-limited, retrying sender for one webhook URL
+
+    `render(data)` builds the payload for one event and `renderDigest(counts,
+    window)` the payload summarising events that were rate limited, where
+    `counts` maps a source address to its number of events.
+    """
+
+    def __init__(
+        self,
+        url,
+        render,
+        renderDigest,
+        name="webhook",
+        headers=None,
+        rate=0.2,
+        burst=5,
+        digest_window=60,
+        max_queue=1000,
+        max_retries=5,
+        backoff=2.0,
+    ):
+        self.url = url
+        self.render = render
+        self.renderDigest = renderDigest
+        self.name = name
+        self.headers = headers or {}
+        self.bucket = TokenBucket(rate, burst)
+        self.digest_window = digest_window
+        self.max_queue = int(max_queue)
+        self.max_retries = int(max_retries)
+        self.backoff = float(backoff)
+
+        self.queue = deque()
+        self.digest = OrderedDict()
+        self.sending = False
+        self.dropped = 0
+
+        self.digester = LoopingCall(self.flushDigest)
+        reactor.callWhenRunning(self.digester.start, digest_window, False)
+
+    def submit(self, data):
+        """Queue an alert, must be called from the reactor thread"""
+        if self.bucket.consume():
+            self._enqueue(self.render(data))
+        else:
+            src = data.get("src_host") or "unknown"
+            self.digest[src] = self.digest.get(src, 0) + 1
+
+    def flushDigest(self):
+        if not self.digest:
+            return
+        counts, self.digest = self.digest, OrderedDict()
+        self._enqueue(self.renderDigest(counts, self.digest_window))
+
+    def _enqueue(self, payload):
+        if len(self.queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        self.queue.append((payload, 0))
+        self._sendNext()
+
+    def _sendNext(self):
+        if self.sending or not self.queue:
+            return
+        self.sending = True
+        payload, attempt = self.queue.popleft()
+        d = threads.deferToThread(self._post, payload)
+        d.addCallbacks(self._cbSent, self._ebSent, errbackArgs=(payload, attempt))
+
+    def _post(self, payload):
+        response = post(self.url, headers=self.headers, json=payload, timeout=10)
+        if response.status_code != 200:
+            raise WebhookError(response.status_code, response.text)
+
+    def _cbSent(self, result):
+        self.sending = False
+        self._sendNext()
+
+    def _ebSent(self, failure, payload, attempt):
+        self.sending = False
+        if attempt + 1 >= self.max_retries:
+            print(
+                "Error sending %s message, giving up after %d attempts: %s"
+                % (self.name, attempt + 1, failure.getErrorMessage()),
+                file=stderr,
+            )
+            self._sendNext()
+            return
+
+        # hold the queue back until the retry is due, keeping alerts in order
+        self.sending = True
+
+        def retry():
+            self.sending = False
+            self.queue.appendleft((payload, attempt + 1))
+            self._sendNext()
+
+        reactor.callLater(self.backoff * 2**attempt, retry)
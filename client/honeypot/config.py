@@ -10,6 +10,8 @@ from sys import exit
 from pkg_resources import resource_filename
 from six import iteritems
 
+from honeypot.iphelper import IPMatcher
+
 SAMPLE_SETTINGS = resource_filename(__name__, "data/settings.json")
 SETTINGS = "honeypot.conf"
 PY3 = True
@@ -19,6 +21,7 @@ class Config:
     def __init__(self, configfile=SETTINGS):
         self.__config = None
         self.__configfile = configfile
+        self.__loadedfile = None
 
         files = [f"/etc/honeypotd/{configfile}", configfile]
         print("** I hope you enjoy using the honeypot designed by 20175415-何万有. **")
@@ -27,7 +30,8 @@ class Config:
                 with open(fname, "r") as f:
                     print("[-] Using config file: %s" % fname)
                     self.__config = json.load(f)
-                return
+                self.__loadedfile = fname
+                break
             except IOError as e:
                 print("[-] Failed to open %s for reading (%s)" % (fname, e))
             except ValueError as e:
@@ -40,6 +44,41 @@ class Config:
             )
             exit(1)
 
+        # Compiled once here, every logged event is checked against it
+        self.ignorelist = IPMatcher(self.getVal("ip.ignorelist", default=[]))
+
+    def reload(self):
+        """
+        Re-read and validate the config file, then swap it in together with
+        everything compiled from it. Return the set of keys whose value
+        changed; on any error raise ConfigException and keep the old config.
+        """
+        try:
+            with open(self.__loadedfile, "r") as f:
+                newconfig = json.load(f)
+        except (IOError, ValueError) as e:
+            raise ConfigException("config", "%s" % e)
+        if not isinstance(newconfig, dict):
+            raise ConfigException("config", "Settings must be a JSON object")
+
+        errors = []
+        for key, value in iteritems(newconfig):
+            try:
+                self.valid(key, value)
+            except ConfigException as e:
+                errors.append(e)
+        errors.extend(self.portConflicts(newconfig))
+        if errors:
+            raise errors[0]
+
+        ignorelist = IPMatcher(newconfig.get("ip.ignorelist", []))
+
+        old = self.__config
+        self.__config, self.ignorelist = newconfig, ignorelist
+        return set(
+            k for k in set(old) | set(newconfig) if old.get(k) != newconfig.get(k)
+        )
+
     def moduleEnabled(self, module_name):
         k = "%s.enabled" % module_name.lower()
         if k in self.__config:
@@ -98,19 +137,9 @@ class Config:
                 errors.append(e)
 
         # Test that no ports overlap
-        ports = {k: v for k, v in iteritems(self.__config) if k.endswith(".port")}
-        newports = {k: v for k, v in iteritems(params) if k.endswith(".port")}
-        ports.update(newports)
-        ports = [(port, setting) for setting, port in iteritems(ports)]
-        ports.sort()
-
-        for port, settings in groupby(ports, lambda x: x[0]):
-            settings = list(settings)
-            if len(settings) > 1:
-                services = ", ".join([s[1].split(".")[0] for s in settings])
-                errmsg = "More than one service uses this port (%s)" % services
-                for (port, setting) in settings:
-                    errors.append(ConfigException(setting, errmsg))
+        merged = dict(self.__config)
+        merged.update(params)
+        errors.extend(self.portConflicts(merged))
 
         # Delete invalid settings for which an error is reported
         for err in errors:
@@ -119,6 +148,34 @@ class Config:
 
         # Update current settings
         self.__config.update(params)
+        if "ip.ignorelist" in params:
+            self.ignorelist = IPMatcher(params["ip.ignorelist"])
+        return errors
+
+    @staticmethod
+    def portConflicts(settings):
+        """Return an error for every port setting shared by several services"""
+        errors = []
+        ports = [
+            (v, k)
+            for k, v in iteritems(settings)
+            if k.endswith(".port") and isinstance(v, int)
+        ]
+        # extra ports the http virtual hosts listen on
+        vhostPorts = set()
+        for vhost in settings.get("http.vhosts", None) or []:
+            vhostPorts.update(p for p in vhost.get("ports", []) if isinstance(p, int))
+        vhostPorts.discard(settings.get("http.port", None))
+        ports.extend((p, "http.vhosts") for p in vhostPorts)
+        ports.sort()
+
+        for port, group in groupby(ports, lambda x: x[0]):
+            group = list(group)
+            if len(group) > 1:
+                services = ", ".join([s[1].split(".")[0] for s in group])
+                errmsg = "More than one service uses this port (%s)" % services
+                for (port, setting) in group:
+                    errors.append(ConfigException(setting, errmsg))
         return errors
 
     def setVal(self, key, val):
@@ -151,6 +208,14 @@ class Config:
             if (not isinstance(val, int)) or val < 1 or val > 65535:
                 raise ConfigException(key, "Invalid port number (%s)" % val)
 
+        if key == "http.vhosts":
+            if not isinstance(val, list) or not all(isinstance(v, dict) for v in val):
+                raise ConfigException(key, "Virtual hosts must be a list of objects")
+            for vhost in val:
+                for port in vhost.get("ports", []):
+                    if (not isinstance(port, int)) or port < 1 or port > 65535:
+                        raise ConfigException(key, "Invalid port number (%s)" % port)
+
         # Max length of SSH version string is 255 chars including trailing CR and LF
         # https://tools.ietf.org/html/rfc4253
         if key == "ssh.version" and len(val) > 253:
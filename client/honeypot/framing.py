@@ -0,0 +1,50 @@
+"""
+Receive buffering for length-prefixed binary protocols.
+
+Received data is appended to one bytearray and read through an offset, so
+consuming a packet neither slices nor copies what is left behind it.
+Packets are handed out as memoryviews into the buffer.
+"""
+
+
+class PacketBuffer(object):
+    """
+    Received data and how far it has been read.
+
+    Views returned by `take` point into the buffer and must be released
+    (or used as a context manager) before the next `feed`, which may move
+    the data.
+    """
+
+    __slots__ = ("data", "offset")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offset = 0
+
+    def __len__(self):
+        return len(self.data) - self.offset
+
+    def feed(self, data):
+        if self.offset:
+            # dropping the read prefix of a bytearray is cheap, it is not moved
+            del self.data[: self.offset]
+            self.offset = 0
+        self.data += data
+
+    def unpack(self, struct):
+        """Unpack `struct` at the read position without consuming it, or None"""
+        if len(self) < struct.size:
+            return None
+        return struct.unpack_from(self.data, self.offset)
+
+    def skip(self, size):
+        self.offset += size
+
+    def take(self, size):
+        """Consume `size` bytes and return them as a memoryview, or None"""
+        if len(self) < size:
+            return None
+        view = memoryview(self.data)[self.offset : self.offset + size]
+        self.offset += size
+        return view
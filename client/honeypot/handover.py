@@ -0,0 +1,242 @@
+"""
+Listening sockets that survive a restart.
+
+`TCPServer` and `UDPServer` are drop-in replacements for the services of
+the same name in twisted.application.internet. When honeypotd was started
+with listening sockets already open, either by systemd socket activation
+(LISTEN_FDS/LISTEN_PID) or by a previous honeypotd handing over its own
+(HONEYPOT_LISTEN_FDS), a service adopts the matching socket instead of
+binding a new one.
+
+A handover is started with SIGUSR2: the running process spawns a new
+twistd that inherits every listening socket, so the ports never close.
+Once its services are up the new process sends SIGTERM to the old one,
+waits for it to exit and takes over the pidfile. Whatever cannot be shared
+with the old process, such as the event spool or the offset of a tailed
+log, is started with `afterHandover`.
+"""
+
+import os
+import signal
+import socket
+import sys
+import time
+
+from twisted.application import internet
+from twisted.internet import reactor
+from twisted.internet.protocol import ProcessProtocol
+from twisted.internet.task import LoopingCall
+
+SD_LISTEN_FDS_START = 3
+
+# listening services started in this process, offered to the next one
+_listening = set()
+# (socket type, host, port) -> socket, filled on first use
+_inherited = None
+# calls waiting for the old process to exit, None once there is none
+_afterHandover = [] if os.environ.get("HONEYPOT_HANDOVER_PID") else None
+
+
+def _key(socktype, host, port):
+    return socktype, host or "0.0.0.0", int(port)
+
+
+def inheritedSockets():
+    """Listening sockets passed in by systemd or a previous honeypotd"""
+    global _inherited
+    if _inherited is not None:
+        return _inherited
+    _inherited = {}
+
+    fds = []
+    if os.environ.get("LISTEN_PID") == str(os.getpid()):
+        count = int(os.environ.get("LISTEN_FDS", "0"))
+        fds.extend(range(SD_LISTEN_FDS_START, SD_LISTEN_FDS_START + count))
+    if os.environ.get("HONEYPOT_LISTEN_FDS"):
+        fds.extend(int(fd) for fd in os.environ["HONEYPOT_LISTEN_FDS"].split(","))
+    for name in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES", "HONEYPOT_LISTEN_FDS"):
+        os.environ.pop(name, None)
+
+    for fd in fds:
+        try:
+            sock = socket.socket(fileno=fd)
+        except OSError:
+            continue
+        host, port = sock.getsockname()[:2]
+        _inherited[_key(sock.type, host, port)] = sock
+    return _inherited
+
+
+class _InheritingServer(object):
+    socktype = None
+
+    def _getPort(self):
+        port, target = self.args[:2]
+        interface = self.kwargs.get("interface", "")
+        sock = inheritedSockets().pop(_key(self.socktype, interface, port), None)
+        if sock is None:
+            listening = super(_InheritingServer, self)._getPort()
+        else:
+            # the reactor works on a duplicate of the descriptor
+            listening = self._adoptPort(sock.fileno(), sock.family, target)
+            sock.close()
+        _listening.add(self)
+        return listening
+
+    def stopService(self):
+        _listening.discard(self)
+        return super(_InheritingServer, self).stopService()
+
+
+class TCPServer(_InheritingServer, internet.TCPServer):
+    socktype = socket.SOCK_STREAM
+
+    def _adoptPort(self, fd, family, factory):
+        return reactor.adoptStreamPort(fd, family, factory)
+
+
+class UDPServer(_InheritingServer, internet.UDPServer):
+    socktype = socket.SOCK_DGRAM
+
+    def _adoptPort(self, fd, family, protocol):
+        maxPacketSize = self.kwargs.get("maxPacketSize", 8192)
+        return reactor.adoptDatagramPort(fd, family, protocol, maxPacketSize)
+
+
+def _pidfile(argv):
+    """Return the index of the --pidfile value in argv and the value"""
+    for i, arg in enumerate(argv):
+        if arg == "--pidfile" and i + 1 < len(argv):
+            return i + 1, argv[i + 1]
+        if arg.startswith("--pidfile="):
+            return i, arg[len("--pidfile=") :]
+    return None, "twistd.pid"
+
+
+def handover(log):
+    """Spawn a new honeypotd that inherits the listening sockets"""
+    services = [s for s in _listening if s._port is not None]
+    childFDs = {0: 0, 1: 1, 2: 2}
+    for fd, s in enumerate(services, SD_LISTEN_FDS_START):
+        childFDs[fd] = s._port.fileno()
+        # shutdown() on exit would stop the shared socket in the new process too
+        s._port._shouldShutdown = False
+
+    argv = list(sys.argv)
+    index, pidfile = _pidfile(argv)
+    pidfile = os.environ.get("HONEYPOT_PIDFILE", pidfile)
+    # twistd refuses to start while the main pidfile names a live process
+    newpidfile = "%s.%d" % (pidfile, os.getpid())
+    if index is None:
+        argv[1:1] = ["--pidfile", newpidfile]
+    elif argv[index].startswith("--pidfile="):
+        argv[index] = "--pidfile=" + newpidfile
+    else:
+        argv[index] = newpidfile
+
+    env = dict(os.environ)
+    env["HONEYPOT_PIDFILE"] = os.path.abspath(pidfile)
+    env["HONEYPOT_LISTEN_FDS"] = ",".join(
+        str(fd) for fd in sorted(childFDs) if fd >= SD_LISTEN_FDS_START
+    )
+    env["HONEYPOT_HANDOVER_PID"] = str(os.getpid())
+    env["HONEYPOT_HANDOVER_START"] = repr(time.time())
+
+    log("Handing over %d listening sockets to a new process" % len(services))
+    reactor.spawnProcess(
+        ProcessProtocol(),
+        sys.executable,
+        [sys.executable] + argv,
+        env=env,
+        path=os.getcwd(),
+        childFDs=childFDs,
+    )
+
+
+def afterHandover(f, *args, **kwargs):
+    """
+    Call f now, or during a handover once the old process exited (or was
+    given up on), for resources only one process may hold at a time.
+    """
+    if _afterHandover is None:
+        f(*args, **kwargs)
+    else:
+        _afterHandover.append((f, args, kwargs))
+
+
+def _runAfterHandover(log):
+    global _afterHandover
+    calls, _afterHandover = _afterHandover or [], None
+    for f, args, kwargs in calls:
+        try:
+            f(*args, **kwargs)
+        except Exception as e:
+            log("Handover: %r failed: %s" % (f, e))
+
+
+def completeHandover(log, timeout=60):
+    """
+    In the new process, once its services are up: stop the old process,
+    wait for it to exit and take over the pidfile.
+    """
+    oldpid = os.environ.pop("HONEYPOT_HANDOVER_PID", None)
+    started = os.environ.pop("HONEYPOT_HANDOVER_START", None)
+    if oldpid is None:
+        return
+    oldpid = int(oldpid)
+    started = float(started or time.time())
+    accepting = (time.time() - started) * 1000
+    pidfile = os.environ.get("HONEYPOT_PIDFILE")
+
+    try:
+        os.kill(oldpid, signal.SIGTERM)
+    except OSError:
+        pass
+
+    def checkTimeout():
+        if time.time() - started > timeout:
+            log("Handover: old process %d did not exit" % oldpid)
+            waiter.stop()
+            _runAfterHandover(log)
+
+    def poll():
+        try:
+            os.kill(oldpid, 0)
+        except ProcessLookupError:
+            pass
+        except OSError:
+            # still there, just not ours to signal
+            return checkTimeout()
+        else:
+            return checkTimeout()
+
+        waiter.stop()
+        _runAfterHandover(log)
+        if pidfile:
+            with open(pidfile, "w") as f:
+                f.write("%d\n" % os.getpid())
+            reactor.addSystemEventTrigger("after", "shutdown", _removePidfile, pidfile)
+        log(
+            "Handover complete: accepting after %.1f ms, old process gone after %.1f ms"
+            % (accepting, (time.time() - started) * 1000)
+        )
+
+    waiter = LoopingCall(poll)
+    waiter.start(0.02)
+
+
+def _removePidfile(pidfile):
+    try:
+        with open(pidfile) as f:
+            if int(f.read().strip()) != os.getpid():
+                return
+        os.remove(pidfile)
+    except (IOError, OSError, ValueError):
+        pass
+
+
+def installSignalHandler(log):
+    def onSignal(signum, frame):
+        reactor.callFromThread(handover, log)
+
+    signal.signal(signal.SIGUSR2, onSignal)
@@ -1,7 +1,10 @@
-from functools import partial
+from collections import OrderedDict
+
 from passlib.context import CryptContext
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
 
-__all__ = ["buildHoneyCredHook", "cryptcontext"]
+__all__ = ["buildHoneyCredHook", "cryptcontext", "HoneyCredEngine"]
 
 cryptcontext = CryptContext(
     schemes=["pbkdf2_sha512", "bcrypt", "sha512_crypt", "plaintext"]
@@ -9,7 +12,7 @@ cryptcontext = CryptContext(
 
 
 def buildHoneyCredHook(creds):
-    return partial(testManyCreds, creds)
+    return HoneyCredEngine(creds).check
 
 
 def testCred(cred, username=None, password=None):
@@ -39,3 +42,136 @@ def testManyCreds(creds, username=None, password=None):
         if testCred(c, username, password):
             return True
     return False
+
+
+class HashVerifier(object):
+    """
+    A thread pool of its own for hash verification, so a brute-force flood
+    cannot starve the reactor pool used by alerting and the spool. At most
+    `maxQueued` jobs wait or run at a time; `run` refuses more.
+    """
+
+    def __init__(self, workers=2, maxQueued=100):
+        self.workers = workers
+        self.maxQueued = maxQueued
+        self.queued = 0
+        self.pool = None
+
+    def start(self):
+        self.pool = ThreadPool(0, self.workers, name="honeycred")
+        self.pool.start()
+        reactor.addSystemEventTrigger("during", "shutdown", self.stop)
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+
+    def run(self, f, *args):
+        """Return a Deferred firing with f(*args), or None when full"""
+        if self.queued >= self.maxQueued:
+            return None
+        if self.pool is None:
+            self.start()
+        self.queued += 1
+        d = threads.deferToThreadPool(reactor, self.pool, f, *args)
+        d.addBoth(self._done)
+        return d
+
+    def _done(self, result):
+        self.queued -= 1
+        return result
+
+
+# shared by every engine, engines are rebuilt on config reload
+verifier = HashVerifier()
+
+
+class HoneyCredEngine(object):
+    """
+    Check login attempts against the honeycreds without stalling the reactor
+
+    Creds are indexed by username, so an attempt is only verified against
+    the creds for its username and those without one. Plaintext creds are
+    compared inline; hashes such as pbkdf2_sha512 take milliseconds each and
+    are verified on `verifier`. The outcome of the last
+    `cacheSize` (username, password) pairs is remembered, brute-force tools
+    repeat themselves a lot.
+    """
+
+    def __init__(self, creds, cacheSize=10000, verifier=verifier):
+        # username -> [(password or hash, is plaintext)], None for any username
+        self.index = {}
+        for cred in creds:
+            password = cred.get("password", None)
+            plain = password is None or cryptcontext.identify(password) == "plaintext"
+            self.index.setdefault(cred.get("username", None), []).append(
+                (password, plain)
+            )
+        self.cacheSize = cacheSize
+        self.verifier = verifier
+        self.cache = OrderedDict()
+        # attempts being verified -> Deferreds waiting for the same outcome
+        self.pending = {}
+
+    def check(self, username=None, password=None):
+        """
+        Return whether the attempt matches, a Deferred firing with it, or
+        None when the verifier is too busy to tell.
+        """
+        key = (username, password)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        if key in self.pending:
+            d = defer.Deferred()
+            self.pending[key].append(d)
+            return d
+
+        hashes = []
+        candidates = self.index.get(None, [])
+        if username is not None:
+            candidates = self.index.get(username, []) + candidates
+        for cred_password, plain in candidates:
+            if cred_password is None:
+                return self.remember(key, True)
+            if password is None:
+                continue
+            if not plain:
+                hashes.append(cred_password)
+            elif cryptcontext.verify(password, cred_password):
+                return self.remember(key, True)
+
+        if not hashes:
+            return self.remember(key, False)
+
+        d = self.verifier.run(self.verifyHashes, password, hashes)
+        if d is None:
+            return None
+        self.pending[key] = []
+        d.addBoth(self.verified, key)
+        return d
+
+    @staticmethod
+    def verifyHashes(password, hashes):
+        for h in hashes:
+            if cryptcontext.verify(password, h):
+                return True
+        return False
+
+    def verified(self, result, key):
+        waiting = self.pending.pop(key, [])
+        if isinstance(result, bool):
+            self.remember(key, result)
+        for d in waiting:
+            if isinstance(result, bool):
+                d.callback(result)
+            else:
+                d.errback(result)
+        return result
+
+    def remember(self, key, result):
+        self.cache[key] = result
+        if len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+        return result
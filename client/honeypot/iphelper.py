@@ -1,6 +1,9 @@
+from ipaddress import ip_address, ip_network
 from struct import unpack
 from socket import inet_aton
 
+__all__ = ["ip2int", "check_ip", "IPMatcher"]
+
 
 def ip2int(addr):
     """
@@ -33,3 +36,66 @@ def check_ip(ip, network_range):
         result = False
 
     return result
+
+
+class IPMatcher(object):
+    """
+    Compiled set of networks in CIDR notation, IPv4 and IPv6
+
+    Networks are stored in a binary prefix trie per address family, so a
+    lookup walks at most as many bits as the longest stored prefix no
+    matter how many networks there are. IPv4-mapped IPv6 addresses are
+    matched against the IPv4 networks.
+    """
+
+    def __init__(self, networks=()):
+        # node layout: [child for bit 0, child for bit 1, network ends here]
+        self.tries = {4: [None, None, False], 6: [None, None, False]}
+        self.depth = {4: 0, 6: 0}
+        self.networks = []
+        for network in networks:
+            self.add(network)
+
+    def add(self, network):
+        """Add a network, an address without a mask is a single host"""
+        try:
+            net = ip_network(str(network).strip(), strict=False)
+        except ValueError:
+            print("Ignoring invalid network in ip.ignorelist: %r" % (network,))
+            return
+
+        node = self.tries[net.version]
+        address = int(net.network_address)
+        for i in range(net.prefixlen):
+            bit = (address >> (net.max_prefixlen - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, False]
+            node = node[bit]
+        node[2] = True
+        self.depth[net.version] = max(self.depth[net.version], net.prefixlen)
+        self.networks.append(net)
+
+    def __contains__(self, ip):
+        try:
+            addr = ip_address(ip)
+        except ValueError:
+            return False
+        if addr.version == 6 and addr.ipv4_mapped is not None:
+            addr = addr.ipv4_mapped
+
+        node = self.tries[addr.version]
+        address = int(addr)
+        maxbits = addr.max_prefixlen
+        for i in range(self.depth[addr.version]):
+            if node[2]:
+                return True
+            node = node[(address >> (maxbits - 1 - i)) & 1]
+            if node is None:
+                return False
+        return node[2]
+
+    def __len__(self):
+        return len(self.networks)
+
+    def __bool__(self):
+        return bool(self.networks)
@@ -0,0 +1,143 @@
+"""
+Starting, stopping and reloading honeypot modules inside a running twistd.
+
+`ModuleManager` remembers the services every module added to the
+application, so a config reload (SIGHUP, see honeypot.tac) can stop the
+modules that were disabled, start the ones that were enabled and restart
+only the modules whose own settings changed. Everything else keeps its
+listening ports and connections.
+"""
+
+from traceback import format_exc
+
+from twisted.internet import defer
+
+from honeypot import metrics
+from honeypot.config import ConfigException
+
+# settings shared by all modules, changing them restarts every module
+SHARED_KEYS = ("device.listen_addr",)
+
+
+class ModuleManager(object):
+    def __init__(self, application, config, logger, modules):
+        self.application = application
+        self.config = config
+        self.logger = logger
+        self.modules = modules
+        # module name -> (module instance, services added to the application)
+        self.running = {}
+        self.reloading = False
+
+    def logMsg(self, msg):
+        self.logger.log({"logdata": {"msg": msg}})
+
+    def start(self, klass):
+        """Start a module, fires once its services were added"""
+        try:
+            obj = klass(config=self.config, logger=self.logger)
+        except Exception:
+            err = f"Failed to instantiate instance of class {klass.__name__} in {klass.__module__}. {format_exc()}."
+            self.logMsg({"logdata": err})
+            return defer.succeed(None)
+
+        if hasattr(obj, "startYourEngines"):
+            try:
+                obj.startYourEngines()
+                self.running[klass.NAME] = (obj, None)
+                msg = f"Ran startYourEngines on class {klass.__name__} in {klass.__module__}"
+                self.logMsg({"logdata": msg})
+            except Exception:
+                err = f"Failed to run startYourEngines on {klass.__name__} in {klass.__module__}. {format_exc()}."
+                self.logMsg({"logdata": err})
+        elif hasattr(obj, "getService"):
+            # prepare() may wait on something slow, like the sshtel container
+            d = defer.maybeDeferred(obj.prepare)
+            d.addCallback(lambda _: self.addServices(klass, obj))
+            d.addErrback(self.failedToAdd, klass)
+            return d
+        else:
+            err = "The class %s in %s does not have any required starting method." % (
+                klass.__name__,
+                klass.__module__,
+            )
+            self.logMsg({"logdata": err})
+        return defer.succeed(None)
+
+    def addServices(self, klass, obj):
+        services = obj.getService()
+        if not isinstance(services, list):
+            services = [services]
+        for s in services:
+            if self.config.moduleEnabled("metrics"):
+                metrics.instrument(klass.NAME, s)
+            s.setServiceParent(self.application)
+        self.running[klass.NAME] = (obj, services)
+        msg = (
+            f"Added service from class {klass.__name__} in {klass.__module__} to fake."
+        )
+        self.logMsg({"logdata": msg})
+
+    def failedToAdd(self, failure, klass):
+        err = "Failed to add service from class %s in %s. %s." % (
+            klass.__name__,
+            klass.__module__,
+            failure.getTraceback(),
+        )
+        self.logMsg({"logdata": err})
+
+    def stop(self, name):
+        """Remove a module's services, fires once its ports are closed"""
+        obj, services = self.running.pop(name)
+        if services is None:
+            # started with startYourEngines, there is nothing to stop it with
+            self.running[name] = (obj, services)
+            self.logMsg({"logdata": "Module %s cannot be stopped" % name})
+            return defer.succeed(None)
+        return defer.DeferredList(
+            [defer.maybeDeferred(s.disownServiceParent) for s in services]
+        )
+
+    def restart(self, klass):
+        d = self.stop(klass.NAME)
+        d.addCallback(lambda _: self.start(klass))
+        return d
+
+    @defer.inlineCallbacks
+    def reload(self):
+        """Reload the config file and apply it to the running modules"""
+        if self.reloading:
+            return
+        self.reloading = True
+        try:
+            try:
+                changed = self.config.reload()
+            except ConfigException as e:
+                self.logMsg(
+                    {"logdata": "Config reload failed, keeping the old one. %s" % e}
+                )
+                return
+
+            shared = any(k in changed for k in SHARED_KEYS)
+            for klass in self.modules:
+                name = klass.NAME
+                enabled = self.config.moduleEnabled(name)
+                prefix = name + "."
+                own = set(k for k in changed if k.startswith(prefix))
+
+                if name in self.running and not enabled:
+                    yield self.stop(name)
+                    self.logMsg({"logdata": "Stopped module %s" % name})
+                elif name not in self.running and enabled:
+                    yield self.start(klass)
+                elif name in self.running and (shared or own - {prefix + "honeycreds"}):
+                    yield self.restart(klass)
+                    self.logMsg({"logdata": "Restarted module %s" % name})
+                elif name in self.running and own:
+                    self.running[name][0].loadHoneyCreds()
+
+            self.logMsg(
+                {"logdata": "Config reloaded, %d settings changed" % len(changed)}
+            )
+        finally:
+            self.reloading = False
@@ -1,18 +1,21 @@
 from __future__ import print_function
 
 import logging.config
-import socket
+from collections import deque
 from datetime import datetime
-from logging.handlers import SocketHandler
 from sys import stderr
 
-from apscheduler.schedulers.twisted import TwistedScheduler
 from hpfeeds import new
-from requests import post
 from simplejson import dumps, loads
 from twisted.internet import reactor
+from twisted.internet.protocol import Protocol, ReconnectingClientFactory
 
-from honeypot.iphelper import *
+from honeypot import handover, metrics
+from honeypot.aggregate import EventAggregator
+from honeypot.alerting import WebhookDispatcher
+from honeypot.ratelimit import LoadShedder
+from honeypot.shipper import EventShipper
+from honeypot.spool import EventSpool
 
 
 class Singleton(type):
@@ -157,85 +160,204 @@ class PyLogger(LoggerBase):
             print(e)
             exit(1)
 
-        # Check if ignorelist is populated
-        self.ignorelist = config.getVal("ip.ignorelist", default="")
+        # The compiled ignorelist lives on the config, see Config.ignorelist
+        self.config = config
         self.logger = logging.getLogger(self.node_id)
 
+        # Events are batched and posted from the reactor, see honeypot.shipper
+        self.shipper = EventShipper(
+            self.serverip,
+            logger=self.logger,
+            queue_size=config.getVal("shipper.queue_size", default=10000),
+            batch_size=config.getVal("shipper.batch_size", default=100),
+            flush_interval=config.getVal("shipper.flush_interval", default=1.0),
+            max_connections=config.getVal("shipper.max_connections", default=2),
+            replay_rate=config.getVal("spool.replay_rate", default=200),
+            bulk=config.getVal("shipper.bulk", default=True),
+            compression=config.getVal("shipper.compression", default="gzip"),
+            format=config.getVal("shipper.format", default="json"),
+        )
+        metrics.SHIPPER_QUEUE.setFunction(lambda: len(self.shipper.queue))
+        metrics.SHIPPER_INFLIGHT.setFunction(lambda: self.shipper.inflight)
+        metrics.SHIPPER_DROPPED.setFunction(lambda: self.shipper.dropped)
+
+        # Events that cannot be posted are kept on disk, see honeypot.spool.
+        # The spool is locked by its process, after a handover it is only
+        # free once the old process exited.
+        if config.getVal("spool.enabled", default=False):
+            handover.afterHandover(self.openSpool, config)
+
+        # Repeated events from one source are folded, see honeypot.aggregate
+        self.aggregator = None
+        if config.getVal("aggregate.enabled", default=False):
+            self.aggregator = EventAggregator(
+                self.emitSummary,
+                window=config.getVal("aggregate.window", default=60),
+                sample_size=config.getVal("aggregate.sample_size", default=10),
+                logtypes=config.getVal("aggregate.logtypes", default=[]),
+                max_keys=config.getVal("aggregate.max_keys", default=10000),
+            )
+
+        # Modules drop events over budget, see CanaryService.log
+        self.shedder = None
+        if config.getVal("ratelimit.enabled", default=False):
+            self.shedder = LoadShedder(
+                self.log,
+                source_rate=config.getVal("ratelimit.source_rate", default=20),
+                source_burst=config.getVal("ratelimit.source_burst", default=100),
+                module_rate=config.getVal("ratelimit.module_rate", default=200),
+                module_burst=config.getVal("ratelimit.module_burst", default=1000),
+                global_rate=config.getVal("ratelimit.global_rate", default=500),
+                global_burst=config.getVal("ratelimit.global_burst", default=2000),
+                max_sources=config.getVal("ratelimit.max_sources", default=10000),
+                report_interval=config.getVal("ratelimit.report_interval", default=60),
+            )
+
+    def openSpool(self, config):
+        try:
+            spool = EventSpool(
+                config.getVal("spool.dir", default="/var/tmp/honeypot-spool"),
+                segment_bytes=config.getVal("spool.segment_bytes", default=4194304),
+                max_bytes=config.getVal("spool.max_bytes", default=268435456),
+                fsync_interval=config.getVal("spool.fsync_interval", default=1.0),
+                logger=self.logger,
+            )
+        except (IOError, OSError) as e:
+            print("Failed to open event spool, events may be lost", file=stderr)
+            print(e, file=stderr)
+            return
+        self.shipper.attachSpool(spool)
+        metrics.SPOOL_BYTES.setFunction(spool.size)
+
     def error(self, data):
         data["local_time"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
         msg = "[ERR] %r" % dumps(data, sort_keys=True)
         print(msg, file=stderr)
         self.logger.warn(msg)
 
-    def post2server(self, jsondata):
-        try:
-            url = "http://" + self.serverip + "/log/"
-            res = post(url, json=jsondata, headers={"Content-Type": "application/json"})
-            # self.logger.warn(res.text)
-        except:
-            self.logger.error("logger.py post2server error!!")
-
-    def log(self, logdata, m_i=False):
+    def log(self, logdata):
         logdata = self.sanitizeLog(logdata)
+        # ignored sources are never shipped, so keep them out of summaries too
+        if (
+            self.aggregator is None
+            or logdata["src_host"] in self.config.ignorelist
+            or self.aggregator.add(logdata)
+        ):
+            self._emit(logdata)
+
+    def emitSummary(self, logdata):
+        self._emit(self.sanitizeLog(logdata))
+
+    def _emit(self, logdata):
         jsondata = dumps(logdata, sort_keys=True)
         # Log only if not in ignorelist
-        notify = True
-        if "src_host" in logdata:
-            for ip in self.ignorelist:
-                if check_ip(logdata["src_host"], ip) == True:
-                    notify = False
-                    break
+        notify = logdata["src_host"] not in self.config.ignorelist
         if notify == True:
-            if m_i:
-                self.post2server(jsondata)
-            else:
-                from uuid import uuid1
-
-                scheduler = TwistedScheduler()
-                scheduler.add_job(self.post2server, args=[jsondata], id=str(uuid1()))
-                scheduler.start()
+            self.shipper.enqueue(logdata, jsondata)
         self.logger.warn(jsondata)
 
 
-class SocketJSONHandler(SocketHandler):
-    """Emits JSON messages over TCP delimited by newlines ('\n')"""
+class _JSONLinesProtocol(Protocol):
+    """Writes buffered records whenever the peer can take them"""
 
-    def makeSocket(self, timeout=1):
-        s = SocketHandler.makeSocket(self, timeout)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-        return s
+    def connectionMade(self):
+        self.paused = False
+        self.transport.setTcpKeepAlive(1)
+        self.transport.registerProducer(self, True)
+        self.factory.resetDelay()
+        self.factory.handler.connected(self)
 
-    def __init__(self, *args, **kwargs):
-        SocketHandler.__init__(self, *args, **kwargs)
-        self.retryStart = 0
-        self.retryMax = 0
-        self.retryFactor = 0
+    def connectionLost(self, reason):
+        self.factory.handler.disconnected(self)
 
-    def send(self, s, attempt=0):
-        if attempt >= 10:
-            print("Dropping log message due to too many failed sends")
-            return
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.factory.handler.drain()
 
-        if self.sock is None:
-            self.createSocket()
+    def stopProducing(self):
+        self.paused = True
 
-        if self.sock:
-            try:
-                # TODO: Weirdly, one the other ends drops the
-                # connection for the next msg, sendall still reports
-                # successful write on a disconnected socket but then
-                # on subsequent writes it fails correctly.
-                self.sock.sendall(s.encode("utf-8"))
-                return
-            except socket.error:
-                self.sock.close()
-                self.sock = None
 
-        # Here, we've failed to send s so retry
-        reactor.callLater(1.5, lambda x: self.send(s, attempt + 1), None)
+class _JSONLinesFactory(ReconnectingClientFactory):
+    protocol = _JSONLinesProtocol
 
-    def makePickle(self, record):
-        return record.getMessage() + "\n"
+    def __init__(self, handler, maxDelay):
+        self.handler = handler
+        self.maxDelay = maxDelay
+
+
+class SocketJSONHandler(logging.Handler):
+    """
+    Emits JSON messages over TCP delimited by newlines ('\n')
+
+    Records are kept in a ring buffer of `buffer_size` lines and written in
+    batches over one persistent, reactor-driven connection. Lost connections
+    are re-established with exponential backoff up to `max_delay` seconds.
+    While the peer is away or slow, the oldest records are dropped once the
+    buffer is full and counted in `dropped`.
+    """
+
+    def __init__(self, host, port, buffer_size=10000, max_delay=60, batch_bytes=65536):
+        logging.Handler.__init__(self)
+        self.host = host
+        self.port = int(port)
+        self.buffer = deque(maxlen=int(buffer_size))
+        self.batch_bytes = int(batch_bytes)
+        self.dropped = 0
+        self.reported = 0
+        self.protocol = None
+        self._drainScheduled = False
+
+        self.factory = _JSONLinesFactory(self, max_delay)
+        reactor.callWhenRunning(reactor.connectTCP, self.host, self.port, self.factory)
+
+    def emit(self, record):
+        reactor.callFromThread(self._append, record.getMessage() + "\n")
+
+    def _append(self, line):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(line.encode("utf-8"))
+        if self.protocol is not None and not self._drainScheduled:
+            # coalesce everything logged in this reactor iteration
+            self._drainScheduled = True
+            reactor.callLater(0, self.drain)
+
+    def connected(self, protocol):
+        self.protocol = protocol
+        if self.dropped > self.reported:
+            print(
+                "SocketJSONHandler dropped %d log messages while %s:%s was away"
+                % (self.dropped - self.reported, self.host, self.port),
+                file=stderr,
+            )
+            self.reported = self.dropped
+        self.drain()
+
+    def disconnected(self, protocol):
+        if self.protocol is protocol:
+            self.protocol = None
+
+    def drain(self):
+        """Write buffered lines, many per write, while the peer keeps up"""
+        self._drainScheduled = False
+        protocol = self.protocol
+        while self.buffer and protocol is not None and not protocol.paused:
+            chunk, size = [], 0
+            while self.buffer and size < self.batch_bytes:
+                line = self.buffer.popleft()
+                chunk.append(line)
+                size += len(line)
+            protocol.transport.write(b"".join(chunk))
+
+    def close(self):
+        self.factory.stopTrying()
+        if self.protocol is not None:
+            self.protocol.transport.loseConnection()
+        logging.Handler.close(self)
 
 
 class HpfeedsHandler(logging.Handler):
@@ -258,15 +380,52 @@ class HpfeedsHandler(logging.Handler):
             print("Error on publishing to server")
 
 
+def recordData(record):
+    """The event a log record carries, or its plain message"""
+    try:
+        data = loads(record.msg)
+    except (TypeError, ValueError):
+        data = None
+    if not isinstance(data, dict):
+        data = {"msg": record.getMessage()}
+    return data
+
+
 class SlackHandler(logging.Handler):
-    def __init__(self, webhook_url):
+    """
+    Post alerts to a Slack webhook without blocking the reactor
+
+    Delivery is handled by a `WebhookDispatcher`; events beyond `rate` per
+    second (bursts of up to `burst`) are summarised in one digest message
+    per `digest_window` seconds.
+    """
+
+    def __init__(
+        self,
+        webhook_url,
+        rate=0.2,
+        burst=5,
+        digest_window=60,
+        max_queue=1000,
+        max_retries=5,
+    ):
         logging.Handler.__init__(self)
         self.webhook_url = webhook_url
-
-    def generate_msg(self, alert):
+        self.dispatcher = WebhookDispatcher(
+            webhook_url,
+            self.generate_msg,
+            self.generate_digest,
+            name="Slack",
+            rate=rate,
+            burst=burst,
+            digest_window=digest_window,
+            max_queue=max_queue,
+            max_retries=max_retries,
+        )
+
+    def generate_msg(self, data):
         msg = {}
         msg["pretext"] = "Honeypot Alert"
-        data = loads(alert.msg)
         msg["fields"] = []
         for k, v in data.items():
             msg["fields"].append(
@@ -274,20 +433,52 @@ class SlackHandler(logging.Handler):
             )
         return {"attachments": [msg]}
 
+    def generate_digest(self, counts, window):
+        msg = {}
+        msg["pretext"] = "Honeypot Alert Digest"
+        msg["fields"] = [
+            {
+                "title": src,
+                "value": "%d events from %s in the last %ds" % (n, src, window),
+            }
+            for src, n in counts.items()
+        ]
+        return {"attachments": [msg]}
+
     def emit(self, record):
-        data = self.generate_msg(record)
-        response = post(self.webhook_url, json=data)
-        if response.status_code != 200:
-            print(
-                "Error %s sending Slack message, the response was:\n%s"
-                % (response.status_code, response.text)
-            )
+        reactor.callFromThread(self.dispatcher.submit, recordData(record))
 
 
 class TeamsHandler(logging.Handler):
-    def __init__(self, webhook_url):
+    """
+    Post alerts to a Microsoft Teams webhook without blocking the reactor
+
+    Takes the same rate limiting arguments as `SlackHandler`.
+    """
+
+    def __init__(
+        self,
+        webhook_url,
+        rate=0.2,
+        burst=5,
+        digest_window=60,
+        max_queue=1000,
+        max_retries=5,
+    ):
         logging.Handler.__init__(self)
         self.webhook_url = webhook_url
+        self.dispatcher = WebhookDispatcher(
+            webhook_url,
+            self.message,
+            self.digest,
+            name="Teams",
+            headers={"Content-Type": "application/json"},
+            rate=rate,
+            burst=burst,
+            digest_window=digest_window,
+            max_queue=max_queue,
+            max_retries=max_retries,
+        )
 
     def message(self, data):
         message = {
@@ -300,6 +491,24 @@ class TeamsHandler(logging.Handler):
         }
         return message
 
+    def digest(self, counts, window):
+        facts = [
+            {
+                "name": src,
+                "value": "%d events from %s in the last %ds" % (n, src, window),
+            }
+            for src, n in counts.items()
+        ]
+        message = {
+            "@type": "MessageCard",
+            "@context": "http://schema.org/extensions",
+            "themeColor": "49c176",
+            "summary": "Honeypot Notification",
+            "title": "Honeypot Alert Digest",
+            "sections": [{"facts": facts}],
+        }
+        return message
+
     def facts(self, data, prefix=None):
         facts = []
         for k, v in data.items():
@@ -312,12 +521,4 @@ class TeamsHandler(logging.Handler):
         return facts
 
     def emit(self, record):
-        data = loads(record.msg)
-        payload = self.message(data)
-        headers = {"Content-Type": "application/json"}
-        response = post(self.webhook_url, headers=headers, json=payload)
-        if response.status_code != 200:
-            print(
-                "Error %s sending Teams message, the response was:\n%s"
-                % (response.status_code, response.text)
-            )
+        reactor.callFromThread(self.dispatcher.submit, recordData(record))
@@ -0,0 +1,258 @@
+"""
+In-process metrics for the event pipeline.
+
+A small registry of counters, gauges and histograms rendered in the
+Prometheus text exposition format by honeypot.modules.prometheus. Updating a
+metric is a dict operation on the reactor thread, so the instruments below
+are always live and cost next to nothing when nothing scrapes them.
+"""
+
+from bisect import bisect_left
+from time import monotonic
+
+from twisted.application import internet, service
+from twisted.internet import reactor
+from twisted.protocols.policies import WrappingFactory
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, _escape(v)) for k, v in pairs)
+
+
+class Metric(object):
+    kind = "untyped"
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def render(self):
+        lines = [
+            "# HELP %s %s" % (self.name, self.doc),
+            "# TYPE %s %s" % (self.name, self.kind),
+        ]
+        lines.extend(self.samples())
+        return lines
+
+    def samples(self):
+        for labels, value in sorted(self.values.items(), key=lambda i: str(i[0])):
+            yield "%s%s %s" % (self.name, _labels(self.labelnames, labels), value)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, **kwargs):
+        amount = kwargs.get("amount", 1)
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, doc, labelnames=()):
+        super(Gauge, self).__init__(name, doc, labelnames)
+        self.functions = {}
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def inc(self, *labels, **kwargs):
+        amount = kwargs.get("amount", 1)
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, **kwargs):
+        self.inc(*labels, amount=-kwargs.get("amount", 1))
+
+    def setFunction(self, function, *labels):
+        """Read the value from `function` whenever metrics are collected"""
+        self.functions[labels] = function
+
+    def samples(self):
+        for labels, function in self.functions.items():
+            self.values[labels] = function()
+        return super(Gauge, self).samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, buckets, labelnames=()):
+        super(Histogram, self).__init__(name, doc, labelnames)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            # one slot per bucket plus +Inf, then the sum
+            series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for labels, series in sorted(self.values.items(), key=lambda i: str(i[0])):
+            count = 0
+            bounds = [repr(float(b)) for b in self.buckets] + ["+Inf"]
+            for bound, n in zip(bounds, series):
+                count += n
+                yield "%s_bucket%s %d" % (
+                    self.name,
+                    _labels(self.labelnames, labels, [("le", bound)]),
+                    count,
+                )
+            yield "%s_sum%s %s" % (
+                self.name,
+                _labels(self.labelnames, labels),
+                series[-1],
+            )
+            yield "%s_count%s %d" % (self.name, _labels(self.labelnames, labels), count)
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+REGISTRY = Registry()
+
+EVENTS = REGISTRY.register(
+    Counter(
+        "honeypot_events_total",
+        "Events logged by honeypot modules",
+        ["module", "logtype"],
+    )
+)
+IGNORED = REGISTRY.register(
+    Counter(
+        "honeypot_events_ignored_total",
+        "Events dropped because the source is in ip.ignorelist",
+        ["module"],
+    )
+)
+SHED = REGISTRY.register(
+    Counter(
+        "honeypot_events_shed_total",
+        "Events only counted because a rate limit was exceeded",
+        ["module"],
+    )
+)
+SHIPPER_QUEUE = REGISTRY.register(
+    Gauge("honeypot_shipper_queue_depth", "Events waiting to be shipped")
+)
+SHIPPER_INFLIGHT = REGISTRY.register(
+    Gauge("honeypot_shipper_inflight", "Batches being posted to the webserver")
+)
+SHIPPER_DROPPED = REGISTRY.register(
+    Gauge("honeypot_shipper_dropped", "Events dropped by the shipper since start")
+)
+SPOOL_BYTES = REGISTRY.register(
+    Gauge("honeypot_spool_bytes", "Bytes of events held in the on-disk spool")
+)
+BATCH_SIZE = REGISTRY.register(
+    Histogram(
+        "honeypot_shipper_batch_size",
+        "Events per batch taken off the shipper queue",
+        [1, 5, 10, 25, 50, 100, 250, 500, 1000],
+    )
+)
+POST_LATENCY = REGISTRY.register(
+    Histogram(
+        "honeypot_shipper_post_seconds",
+        "Latency of posts to the webserver",
+        [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+        ["result"],
+    )
+)
+CONNECTIONS = REGISTRY.register(
+    Counter(
+        "honeypot_connections_total",
+        "TCP connections accepted per service",
+        ["service"],
+    )
+)
+OPEN_CONNECTIONS = REGISTRY.register(
+    Gauge("honeypot_connections_open", "Open TCP connections per service", ["service"])
+)
+REACTOR_LAG = REGISTRY.register(
+    Gauge("honeypot_reactor_lag_seconds", "Delay of the last reactor lag probe")
+)
+REACTOR_LAG_HISTOGRAM = REGISTRY.register(
+    Histogram(
+        "honeypot_reactor_lag_probe_seconds",
+        "Delay of reactor lag probes in seconds",
+        [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5],
+    )
+)
+
+
+class ConnectionCountingFactory(WrappingFactory):
+    """Count connections of the wrapped factory under `name`"""
+
+    def __init__(self, name, wrappedFactory):
+        WrappingFactory.__init__(self, wrappedFactory)
+        self.name = name
+
+    def registerProtocol(self, p):
+        WrappingFactory.registerProtocol(self, p)
+        CONNECTIONS.inc(self.name)
+        OPEN_CONNECTIONS.inc(self.name)
+
+    def unregisterProtocol(self, p):
+        WrappingFactory.unregisterProtocol(self, p)
+        OPEN_CONNECTIONS.dec(self.name)
+
+
+def instrument(name, svc):
+    """Count the connections of a TCP service returned by a module"""
+    if isinstance(svc, internet.TCPServer):
+        port, factory = svc.args[:2]
+        svc.args = (port, ConnectionCountingFactory(name, factory)) + svc.args[2:]
+    return svc
+
+
+class ReactorLagProbe(service.Service):
+    """Measure how late a timer fires, a direct read of reactor load"""
+
+    def __init__(self, interval=1.0):
+        self.interval = float(interval)
+        self.expected = None
+        self.call = None
+
+    def startService(self):
+        service.Service.startService(self)
+        self.schedule()
+
+    def stopService(self):
+        service.Service.stopService(self)
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+
+    def schedule(self):
+        self.expected = monotonic() + self.interval
+        self.call = reactor.callLater(self.interval, self.probe)
+
+    def probe(self):
+        lag = max(0.0, monotonic() - self.expected)
+        REACTOR_LAG.set(lag)
+        REACTOR_LAG_HISTOGRAM.observe(lag)
+        self.schedule()
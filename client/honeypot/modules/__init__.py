@@ -2,13 +2,15 @@ import os.path
 from sys import platform
 from warnings import warn
 
+from honeypot import metrics
+from honeypot.handover import TCPServer, UDPServer
 from honeypot.honeycred import *
 from honeypot.iphelper import *
 from pkg_resources import resource_filename
-from twisted.application import internet
 
 # Monkey-patch-replace Twisted Protocol with CanaryProtocol class
 from twisted.internet import protocol
+from twisted.internet.defer import Deferred
 from twisted.internet.protocol import DatagramProtocol, Factory
 
 
@@ -39,12 +41,13 @@ class CanaryService(object):
         self.logger = logger
         self.logtype = None
 
+        self.loadHoneyCreds()
+
+    def loadHoneyCreds(self):
+        """(Re)build the honeycred hook, also called on config reload"""
         # if config contains honeycreds, create basic honeycreds class
-        self.creds = config.getVal("%s.honeycreds" % self.NAME, [])
-        if self.creds:
-            self.honeyCredHook = buildHoneyCredHook(self.creds)
-        # Check if ignorelist is populated
-        self.ignorelist = config.getVal("ip.ignorelist", default="")
+        self.creds = self.config.getVal("%s.honeycreds" % self.NAME, [])
+        self.honeyCredHook = buildHoneyCredHook(self.creds) if self.creds else None
 
     @classmethod
     def resource_dir(klass):
@@ -84,25 +87,47 @@ class CanaryService(object):
         # otherwise the module can include IPs and ports as kwargs
         data.update(kwargs)
 
+        # Log only if not in ignorelist, checked before any costly hook
+        if data.get("src_host") in self.config.ignorelist:
+            metrics.IGNORED.inc(self.NAME)
+            return
+
+        # Shed load before hashing and encoding, see honeypot.ratelimit
+        shedder = getattr(self.logger, "shedder", None)
+        if shedder is not None and not shedder.admit(self.NAME, data.get("src_host")):
+            metrics.SHED.inc(self.NAME)
+            return
+
+        metrics.EVENTS.inc(self.NAME, data["logtype"])
+
         # run pre-log hooks
         if getattr(self, "honeyCredHook", None):
             username = logdata.get("USERNAME", None)
             password = logdata.get("PASSWORD", None)
             if username or password:
-                data["honeycred"] = self.honeyCredHook(username, password)
-
-        # Log only if not in ignorelist
-        notify = True
-        for ip in self.ignorelist:
-            if not "src_host" in data:
-                break
-
-            if check_ip(data["src_host"], ip) == True:
-                notify = False
-                break
-
-        if notify == True:
-            self.logger.log(data)
+                result = self.honeyCredHook(username, password)
+                if isinstance(result, Deferred):
+                    # hashes are verified off the reactor, log once known
+                    result.addErrback(lambda failure: False)
+                    result.addCallback(self._logHoneyCred, data)
+                    return
+                # None when too many hashes are being verified already
+                if result is not None:
+                    data["honeycred"] = result
+
+        self.logger.log(data)
+
+    def _logHoneyCred(self, result, data):
+        data["honeycred"] = result
+        self.logger.log(data)
+
+    def prepare(self):
+        """Work done before getService, may return a Deferred
+
+        Runs on the reactor thread, anything that blocks belongs in a
+        thread (see threads.deferToThread).
+        """
+        return None
 
     def getService(self):
         """Return service to be run
@@ -112,9 +137,9 @@ class CanaryService(object):
         this if more intricracy is needed.
         """
         if isinstance(self, Factory):
-            return internet.TCPServer(self.port, self)
+            return TCPServer(self.port, self)
         elif isinstance(self, DatagramProtocol):
-            return internet.UDPServer(self.port, self)
+            return UDPServer(self.port, self)
 
         err = (
             "The class %s does not inherit from either Factory or DatagramProtocol."
@@ -132,22 +157,44 @@ if platform.startswith("linux"):
     from twisted.python._inotify import INotifyError
 
     class FileSystemWatcher(object):
+        """
+        Follow a growing file, handing complete lines to `handleLines`
+
+        The file is read READ_SIZE bytes at a time and an incomplete last
+        line is carried over to the next read, so memory stays bounded no
+        matter how fast the file grows. Lines are passed on in batches of at
+        most BATCH_LINES; a line longer than MAX_LINE is dropped.
+        """
+
+        READ_SIZE = 64 * 1024
+        BATCH_LINES = 1000
+        MAX_LINE = 1024 * 1024
+
         def __init__(self, fileName=None):
             self.path = fileName
             self.log_dir = os.path.dirname(os.path.realpath(self.path))
             self.f = None
+            self.partial = b""
+            # skipping the rest of a line longer than MAX_LINE
+            self.discarding = False
 
         def reopenFiles(self, skipToEnd=True):
             if self.f:
                 self.f.close()
+            self.partial = b""
+            self.discarding = False
 
             try:
-                self.f = open(self.path)
+                self.f = open(self.path, "rb")
                 if skipToEnd:
                     self.f.seek(0, 2)
             except IOError as e:
                 self.f = None
 
+            self.watch()
+
+        def watch(self):
+            """Watch the file, or its directory until the file shows up"""
             self.notifier.startReading()
             try:
                 self.notifier.ignore(filepath.FilePath(self.path))
@@ -172,15 +219,50 @@ if platform.startswith("linux"):
         def handleLines(self, lines=None):
             pass
 
+        def readLines(self):
+            """Yield the complete lines written since the last read"""
+            if os.fstat(self.f.fileno()).st_size < self.f.tell():
+                # truncated, start over
+                self.f.seek(0)
+                self.partial = b""
+                self.discarding = False
+
+            while True:
+                chunk = self.f.read(self.READ_SIZE)
+                if not chunk:
+                    return
+                if self.discarding:
+                    end = chunk.find(b"\n")
+                    if end < 0:
+                        continue
+                    self.discarding = False
+                    chunk = chunk[end + 1 :]
+                data = self.partial + chunk
+                end = data.rfind(b"\n")
+                self.partial = data[end + 1 :]
+                if len(self.partial) > self.MAX_LINE:
+                    # drop it up to its newline, wherever that is
+                    self.partial = b""
+                    self.discarding = True
+                for line in data[: max(end, 0)].split(b"\n"):
+                    line = line.rstrip(b"\r")
+                    if line and len(line) <= self.MAX_LINE:
+                        yield line.decode("utf-8", "replace")
+
         def processAuditLines(
             self,
         ):
             if not self.f:
                 return
 
-            lines = self.f.read().strip().split("\n")
-
-            self.handleLines(lines=lines)
+            batch = []
+            for line in self.readLines():
+                batch.append(line)
+                if len(batch) >= self.BATCH_LINES:
+                    self.handleLines(lines=batch)
+                    batch = []
+            if batch:
+                self.handleLines(lines=batch)
 
         def onChange(self, watch, path, mask):
             # print path, 'changed', mask # or do something else!
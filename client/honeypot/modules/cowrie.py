@@ -0,0 +1,324 @@
+"""
+Ingest the Cowrie JSON log of the sshtel container. The SSH and telnet
+modules hand authenticated attackers over to Cowrie; its log is tailed
+here and every shell session is logged as one event.
+"""
+
+import json
+import os
+from collections import OrderedDict
+from json import loads
+from sys import stderr
+from time import monotonic
+
+from honeypot import handover
+from honeypot.modules import CanaryService, FileSystemWatcher
+from twisted.application import service
+from twisted.internet.task import LoopingCall
+from twisted.python._inotify import INotifyError
+
+LOG_PATH = r"/var/log/cowrie/cowrie.json"
+OFFSET_FILE = r"/var/tmp/honeypot-cowrie.offset"
+
+
+class CowrieLogTailer(FileSystemWatcher):
+    """
+    Incremental, inotify driven reader of the Cowrie JSON log
+
+    The inode and the offset of the last complete line are saved to
+    `offsetFile` so a restart resumes where it stopped. After a rotation the
+    rest of the old file is read before switching to the new one.
+    """
+
+    def __init__(
+        self, handleEvent, fileName=LOG_PATH, offsetFile=OFFSET_FILE, saveInterval=1.0
+    ):
+        FileSystemWatcher.__init__(self, fileName=fileName)
+        self.handleEvent = handleEvent
+        self.offsetFile = offsetFile
+        self.saveInterval = saveInterval
+        self.inode, self.offset = None, 0
+        self.dirty = False
+        self.saver = LoopingCall(self.saveOffset)
+
+    def loadOffset(self):
+        try:
+            with open(self.offsetFile) as f:
+                state = json.load(f)
+            # saved in the middle of a line too long to read
+            self.discarding = bool(state.get("discarding", False))
+            return int(state["inode"]), int(state["offset"])
+        except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None, 0
+
+    def saveOffset(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        tmp = self.offsetFile + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(
+                {
+                    "inode": self.inode,
+                    "offset": self.offset,
+                    "discarding": self.discarding,
+                },
+                f,
+            )
+        os.replace(tmp, self.offsetFile)
+
+    def start(self):
+        # loaded only now, a previous process may have been tailing until now
+        self.inode, self.offset = self.loadOffset()
+        FileSystemWatcher.start(self)
+        self.processAuditLines()
+        self.saver.start(self.saveInterval, now=False)
+
+    def stop(self):
+        if self.saver.running:
+            self.saver.stop()
+        self.saveOffset()
+        if self.f:
+            self.f.close()
+            self.f = None
+        if getattr(self, "notifier", None) is not None:
+            self.notifier.loseConnection()
+            self.notifier = None
+
+    def reopenFiles(self, skipToEnd=False):
+        # the old file may have been rotated away, finish reading it first
+        if self.f:
+            self.processAuditLines()
+
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            inode = None
+
+        if not (self.f and inode == self.inode):
+            if self.f:
+                self.f.close()
+                self.f = None
+            if inode is not None:
+                self.openFile(inode)
+
+        self.watch()
+
+    def openFile(self, inode):
+        try:
+            self.f = open(self.path, "rb")
+        except IOError:
+            return
+        size = os.fstat(self.f.fileno()).st_size
+        if inode == self.inode and self.offset <= size:
+            # same file, resume after the last line handled
+            self.f.seek(self.offset)
+        else:
+            self.offset = 0
+            self.discarding = False
+        self.inode = inode
+        self.partial = b""
+        self.dirty = True
+
+    def processAuditLines(self):
+        FileSystemWatcher.processAuditLines(self)
+        if self.f:
+            self.offset = self.f.tell() - len(self.partial)
+            self.dirty = True
+
+    def handleLines(self, lines=None):
+        for line in lines:
+            jsondata = line.strip()
+            if not jsondata:
+                continue
+            try:
+                jsonline = loads(jsondata)
+            except ValueError:
+                print("Invalid cowrie log line: %r" % jsondata[:200], file=stderr)
+                continue
+            self.handleEvent(jsonline)
+
+
+class CowrieSession(object):
+    __slots__ = ("log", "cmds", "dropped", "protocol", "remoteVer", "seen")
+
+    def __init__(self, jsonline):
+        self.protocol = jsonline.get("protocol")
+        self.log = {
+            "dst_host": jsonline.get("dst_ip"),
+            "dst_port": jsonline.get("dst_port"),
+            "src_host": jsonline.get("src_ip"),
+            "src_port": jsonline.get("src_port"),
+            "logtype": f"{self.protocol} shell interaction",
+        }
+        self.cmds = []
+        self.dropped = 0
+        self.remoteVer = None
+        self.seen = monotonic()
+
+
+class CowrieSessions(object):
+    """
+    Reassemble concurrent Cowrie sessions keyed by their session id
+
+    Every session is handed to `emit` as one event when it closes. At most
+    `maxSessions` sessions are tracked, the least recently active one is
+    finished early to make room; sessions idle for `timeout` seconds are
+    finished as well, and at most `maxCommands` commands are kept each.
+    """
+
+    def __init__(
+        self, emit, localVersion=None, maxSessions=1000, timeout=3600, maxCommands=1000
+    ):
+        self.emit = emit
+        self.localVersion = localVersion
+        self.maxSessions = int(maxSessions)
+        self.timeout = float(timeout)
+        self.maxCommands = int(maxCommands)
+        # least recently active first
+        self.sessions = OrderedDict()
+        self.expirer = LoopingCall(self.expire)
+
+    def start(self):
+        self.expirer.start(min(self.timeout, 60.0), now=False)
+
+    def stop(self):
+        if self.expirer.running:
+            self.expirer.stop()
+        while self.sessions:
+            self.finish(self.sessions.popitem(last=False)[1])
+
+    def handleEvent(self, jsonline):
+        event = jsonline.get("eventid", "")
+        sid = jsonline.get("session")
+        if sid is None:
+            return
+
+        if event.endswith("session.connect"):
+            if len(self.sessions) >= self.maxSessions:
+                self.finish(self.sessions.popitem(last=False)[1])
+            self.sessions[sid] = CowrieSession(jsonline)
+            return
+
+        session = self.sessions.get(sid)
+        if session is None:
+            return
+        session.seen = monotonic()
+        self.sessions.move_to_end(sid)
+
+        if event.endswith("client.version"):
+            session.remoteVer = jsonline.get("version", "").replace("'", "")[1:]
+        elif event.endswith("login.success"):
+            logdata = {
+                "USERNAME": jsonline.get("username"),
+                "PASSWORD": jsonline.get("password"),
+                "SESSION": sid,
+            }
+            if session.protocol == "ssh":
+                logdata["LOCALVERSION"] = self.localVersion
+                logdata["REMOTEVERSION"] = session.remoteVer
+            session.log["logdata"] = logdata
+        elif event.endswith("command.input"):
+            if len(session.cmds) < self.maxCommands:
+                session.cmds.append(jsonline.get("input", ""))
+            else:
+                session.dropped += 1
+        elif event.endswith("session.closed"):
+            del self.sessions[sid]
+            if "duration" in jsonline:
+                session.log.setdefault("logdata", {})["DURATION"] = jsonline["duration"]
+            self.finish(session)
+
+    def expire(self):
+        deadline = monotonic() - self.timeout
+        while self.sessions:
+            sid, session = next(iter(self.sessions.items()))
+            if session.seen > deadline:
+                break
+            del self.sessions[sid]
+            self.finish(session)
+
+    def finish(self, session):
+        # only sessions that logged in are of interest
+        logdata = session.log.get("logdata")
+        if logdata is None or "USERNAME" not in logdata:
+            return
+        logdata["INPUT"] = ";  ".join(session.cmds)
+        if session.dropped:
+            logdata["COMMANDS_DROPPED"] = session.dropped
+        try:
+            self.emit(session.log)
+        except Exception as e:
+            print("Failed to log cowrie session: %s" % e, file=stderr)
+
+
+class CowrieIngest(service.Service):
+    """
+    Tails the log once no other honeypotd does, after a handover both
+    processes would ingest the same sessions and save the same offset.
+    """
+
+    ingesting = False
+
+    def __init__(self, tailer, sessions, logMsg):
+        self.tailer = tailer
+        self.sessions = sessions
+        self.logMsg = logMsg
+
+    def startService(self):
+        service.Service.startService(self)
+        handover.afterHandover(self.startIngest)
+
+    def startIngest(self):
+        if not self.running or self.ingesting:
+            return
+        try:
+            self.tailer.start()
+        except INotifyError as e:
+            # no log directory to watch, the sshtel container is not set up
+            self.tailer.stop()
+            self.logMsg("Not ingesting %s: %s" % (self.tailer.path, e))
+            return
+        self.ingesting = True
+        self.sessions.start()
+
+    def stopService(self):
+        service.Service.stopService(self)
+        if self.ingesting:
+            self.ingesting = False
+            self.tailer.stop()
+            self.sessions.stop()
+
+
+class CanaryCowrie(CanaryService):
+    NAME = "cowrie"
+
+    def __init__(self, config=None, logger=None):
+        CanaryService.__init__(self, config=config, logger=logger)
+        self.log_path = config.getVal("cowrie.log_path", default=LOG_PATH)
+        self.offset_file = config.getVal("cowrie.offset_file", default=OFFSET_FILE)
+        self.max_sessions = config.getVal("cowrie.max_sessions", default=1000)
+        self.session_timeout = config.getVal("cowrie.session_timeout", default=3600)
+        self.max_commands = config.getVal("cowrie.max_commands", default=1000)
+        self.local_version = config.getVal(
+            "ssh.version", default="SSH-2.0-OpenSSH_5.1p1 Debian-5"
+        )
+
+    def logMsg(self, msg):
+        self.logger.log({"logdata": {"msg": msg}})
+
+    def logSession(self, log):
+        # through CanaryService.log, for the ignorelist, load shedding and metrics
+        kwargs = dict(log)
+        self.log(kwargs.pop("logdata"), **kwargs)
+
+    def getService(self):
+        sessions = CowrieSessions(
+            self.logSession,
+            localVersion=self.local_version,
+            maxSessions=self.max_sessions,
+            timeout=self.session_timeout,
+            maxCommands=self.max_commands,
+        )
+        tailer = CowrieLogTailer(sessions.handleEvent, self.log_path, self.offset_file)
+        return CowrieIngest(tailer, sessions, self.logMsg)
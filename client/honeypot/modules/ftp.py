@@ -1,6 +1,6 @@
+from honeypot.handover import TCPServer
 from honeypot.modules import CanaryService
 
-from twisted.application import internet
 from twisted.protocols.ftp import (
     FTPFactory,
     FTPRealm,
@@ -86,4 +86,4 @@ class CanaryFTP(CanaryService):
         f.protocol = LoggingFTP
         f.welcomeMessage = self.banner.decode()
         f.canaryservice = self
-        return internet.TCPServer(self.port, f, interface=self.listen_addr)
+        return TCPServer(self.port, f, interface=self.listen_addr)
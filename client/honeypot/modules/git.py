@@ -1,8 +1,8 @@
+from honeypot.handover import TCPServer
 from honeypot.modules import CanaryService
 
 from twisted.internet.protocol import Protocol
 from twisted.internet.protocol import Factory
-from twisted.application import internet
 
 
 class ProtocolError(Exception):
@@ -64,4 +64,4 @@ class CanaryGit(Factory, CanaryService):
         self.logtype = logger.LOG_GIT_CLONE_REQUEST
 
     def getService(self):
-        return internet.TCPServer(self.port, self)
+        return TCPServer(self.port, self)
@@ -1,39 +1,39 @@
-import re
+from fnmatch import fnmatch
 from os.path import isdir, join
 
+from honeypot.handover import TCPServer
 from honeypot.modules import CanaryService
-from twisted.application import internet
-from twisted.web import static
-from twisted.web.resource import EncodingResourceWrapper, Resource
-from twisted.web.server import GzipEncoderFactory, Site
+from honeypot.ratelimit import ConnectionAdmission
+from honeypot.skin import getSkin
+from twisted.web.http import HTTPChannel
+from twisted.web.resource import Resource
+from twisted.web.server import Site
 from twisted.web.util import Redirect
 
 
+def sendAsset(request, asset):
+    """Write the best precompressed encoding of a compiled asset"""
+    body, encoding, etag = asset.variant(request.getHeader(b"accept-encoding"))
+    request.setHeader(b"Vary", b"Accept-Encoding")
+    if encoding is not None:
+        request.setHeader(b"Content-Encoding", encoding)
+    return body
+
+
 class Error(Resource):
     isLeaf = True
 
-    def __init__(self, factory, error_code="404"):
+    def __init__(self, factory, error_code="404", skin=None):
         self.factory = factory
-        self.skin = self.factory.skin
-        self.skindir = self.factory.skindir
+        self.skin = skin or self.factory.compiled
         self.error_code = error_code
-
-        if not isdir(self.skindir):
-            raise Exception(
-                "Directory %s for http skin, %s, does not exist."
-                % (self.skindir, self.skin)
-            )
-
-        with open(join(self.skindir, error_code + ".html")) as f:
-            self.error_contents = f.read()
-
+        # the page before and after each [[URL]]
+        self.parts = self.skin.errorParts(error_code, self.factory.banner)
         Resource.__init__(self)
 
     def err_page(self, request):
         path = request.path.replace(b"<", b"&lt;").replace(b">", b"&gt;")
-        return self.error_contents.replace("[[URL]]", path.decode("utf-8")).replace(
-            "[[BANNER]]", self.factory.banner.decode("utf-8")
-        )
+        return path.join(self.parts)
 
     def render(self, request):
         request.setHeader(b"Server", self.factory.banner)
@@ -41,32 +41,19 @@ class Error(Resource):
         return Resource.render(self, request)
 
     def render_GET(self, request):
-        return self.err_page(request).encode()
+        return self.err_page(request)
 
     def render_POST(self, request):
-        return self.err_page(request).encode()
+        return self.err_page(request)
 
 
 class BasicLogin(Resource):
     isLeaf = True
 
-    def __init__(self, factory):
+    def __init__(self, factory, skin=None):
         self.factory = factory
-        self.skin = self.factory.skin
-        self.skindir = self.factory.skindir
-
-        if not isdir(self.skindir):
-            raise Exception(
-                "Directory %s for http skin, %s, does not exist."
-                % (self.skindir, self.skin)
-            )
-
-        with open(join(self.skindir, "index.html")) as f:
-            text = f.read()
-
-        p = re.compile(r"<!--STARTERR-->.*<!--ENDERR-->", re.DOTALL)
-        self.login = re.sub(p, "", text)
-        self.err = re.sub(r"<!--STARTERR-->|<!--ENDERR-->", "", text)
+        self.compiled = skin or self.factory.compiled
+        self.skin = self.compiled.name
         Resource.__init__(self)
 
     def render(self, request):
@@ -91,7 +78,7 @@ class BasicLogin(Resource):
             logtype = self.factory.logger.LOG_HTTP_GET
             self.factory.log(logdata, transport=request.transport, logtype=logtype)
 
-        return self.login.encode()
+        return sendAsset(request, self.compiled.login)
 
     def render_POST(self, request):
         try:
@@ -117,7 +104,7 @@ class BasicLogin(Resource):
         logtype = self.factory.logger.LOG_HTTP_POST_LOGIN_ATTEMPT
         self.factory.log(logdata, transport=request.transport, logtype=logtype)
 
-        return self.err.encode()
+        return sendAsset(request, self.compiled.loginFailed)
 
 
 class RedirectCustomHeaders(Redirect):
@@ -130,29 +117,283 @@ class RedirectCustomHeaders(Redirect):
         return Redirect.render(self, request)
 
 
-class StaticNoDirListing(static.File):
-    """Web resource that serves static directory tree.
+class AssetPage(Resource):
+    """A static file of a compiled skin, answered from memory"""
+
+    isLeaf = True
+
+    def __init__(self, asset, banner):
+        self.asset = asset
+        self.banner = banner
+        Resource.__init__(self)
+
+    def render_GET(self, request):
+        asset = self.asset
+        request.setHeader(b"Server", self.banner)
+        request.setHeader(b"Content-Type", asset.contentType)
+        if asset.lastModified:
+            request.setHeader(b"Last-Modified", asset.lastModified)
+        body, encoding, etag = asset.variant(request.getHeader(b"accept-encoding"))
+        request.setHeader(b"ETag", etag)
+        request.setHeader(b"Vary", b"Accept-Encoding")
+        if asset.notModified(request.getHeader(b"if-none-match")):
+            request.setResponseCode(304)
+            return b""
+        if encoding is not None:
+            request.setHeader(b"Content-Encoding", encoding)
+        return body
+
+
+class SkinRoot(Resource):
+    """
+    Serves the static tree of a compiled skin.
 
     Directory listing is not allowed, and custom headers are set.
+    """
+
+    def __init__(self, factory, skin=None):
+        Resource.__init__(self)
+        self.factory = factory
+        self.skin = skin or factory.compiled
+        self.notFound = Error(factory, error_code="404", skin=self.skin)
+        self.forbidden = Error(factory, error_code="403", skin=self.skin)
+        self.pages = dict(
+            (path, AssetPage(asset, factory.banner))
+            for path, asset in self.skin.assets.items()
+        )
+
+    def getChild(self, name, request):
+        path = b"/".join([name] + request.postpath)
+        page = self.pages.get(path)
+        if page is not None:
+            return page
+        if path.rstrip(b"/") in self.skin.directories:
+            return self.forbidden
+        return self.notFound
+
 
+class VirtualHost(object):
     """
+    One skin served by CanaryHTTP, with its own banner and error pages.
 
-    # Banner is declared statically because Twisted creates several
-    # instances of this object, where we don't control the arguments
-    # for the initialisation.
-    BANNER = None
-    FORBIDDEN = None
+    Stands in for the service as the factory of the skin's resources, so
+    they log through the service but answer with this banner. Requests are
+    routed here when the Host header matches one of `hosts` (shell-style
+    patterns) and they arrived on one of `ports`; an empty list matches
+    anything.
+    """
 
-    def createErrorPages(self, factory):
-        self.childNotFound = Error(factory, error_code="404")
-        StaticNoDirListing.FORBIDDEN = Error(factory, error_code="403")
+    def __init__(self, service, compiled, banner, hosts=(), ports=()):
+        self.service = service
+        self.logger = service.logger
+        self.compiled = compiled
+        self.banner = banner
+        self.hosts = [h.lower() for h in hosts]
+        self.ports = set(int(p) for p in ports)
 
-    def directoryListing(self):
-        return StaticNoDirListing.FORBIDDEN
+        self.root = SkinRoot(self)
+        self.root.putChild(b"", RedirectCustomHeaders(b"/index.html", factory=self))
+        self.root.putChild(b"index.html", BasicLogin(factory=self))
+
+    def log(self, *args, **kwargs):
+        return self.service.log(*args, **kwargs)
+
+    def matches(self, host, port):
+        if self.ports and port not in self.ports:
+            return False
+        if self.hosts and not any(fnmatch(host, h) for h in self.hosts):
+            return False
+        return True
 
-    def getChild(self, name, request):
-        request.setHeader("Server", StaticNoDirListing.BANNER)
-        return static.File.getChild(self, name, request)
+
+def requestHost(request):
+    """The Host header of a request without the port, lower case"""
+    host = (request.getHeader(b"host") or b"").strip().lower()
+    if host.startswith(b"["):
+        host = host[: host.find(b"]") + 1]
+    else:
+        host = host.partition(b":")[0]
+    return host.decode("ascii", "replace")
+
+
+class VirtualHostRoot(Resource):
+    """Hands each request to the first virtual host it matches"""
+
+    def __init__(self, vhosts, default):
+        Resource.__init__(self)
+        self.vhosts = vhosts
+        self.default = default
+
+    def route(self, request):
+        host, port = requestHost(request), request.getHost().port
+        for vhost in self.vhosts:
+            if vhost.matches(host, port):
+                return vhost
+        return self.default
+
+    def getChildWithDefault(self, name, request):
+        return self.route(request).root.getChildWithDefault(name, request)
+
+
+# seconds a rejected client gets to read its response before it is cut off
+ABORT_TIMEOUT = 15
+
+REJECTIONS = {
+    "timeout": (408, b"Request Timeout"),
+    "header": (431, b"Request Header Fields Too Large"),
+    "body": (413, b"Payload Too Large"),
+    "source": (503, b"Service Unavailable"),
+    "total": (503, b"Service Unavailable"),
+}
+
+
+class GuardedChannel(HTTPChannel):
+    """
+    An HTTPChannel that turns away slow, oversized and excess requests.
+
+    Twisted's idle timeout is reset by every line, so a client dribbling
+    one header at a time keeps it open forever. Here each request has to
+    be read completely within the site's readTimeout. Requests with more
+    than maxHeaderSize bytes of request line and headers, or a body larger
+    than maxBodySize, are answered before their body is read. Every
+    rejection gets a canned response and is counted by the site's
+    ConnectionAdmission, which reports them in aggregate.
+
+    HTTPChannel enforces totalHeadersSize too, but with a plain 400 that
+    nobody counts, so the header size is tracked here and checked first.
+    """
+
+    deadline = None
+    aborter = None
+    admitted = False
+    rejected = False
+    headerSize = 0
+    bodyReceived = 0
+
+    def connectionMade(self):
+        HTTPChannel.connectionMade(self)
+        self.MAX_LENGTH = self.totalHeadersSize = self.site.maxHeaderSize
+        reason = self.site.admission.admit(self.transport.getPeer().host)
+        if reason is not None:
+            self.reject(reason)
+            return
+        self.admitted = True
+        self.startDeadline()
+
+    def startDeadline(self):
+        if self.deadline is None and self.site.readTimeout:
+            self.deadline = self.callLater(
+                self.site.readTimeout, self.reject, "timeout"
+            )
+
+    def cancelDeadline(self):
+        if self.deadline is not None:
+            if self.deadline.active():
+                self.deadline.cancel()
+            self.deadline = None
+
+    def dataReceived(self, data):
+        if self.rejected:
+            return
+        HTTPChannel.dataReceived(self, data)
+
+    def lineReceived(self, line):
+        self.startDeadline()
+        self.headerSize += len(line)
+        if self.headerSize > self.site.maxHeaderSize:
+            self.reject("header")
+            return
+        HTTPChannel.lineReceived(self, line)
+
+    def lineLengthExceeded(self, line):
+        self.reject("header")
+
+    def allHeadersReceived(self):
+        self.headerSize = 0
+        self.bodyReceived = 0
+        if self.length is not None and self.length > self.site.maxBodySize:
+            self.reject("body")
+            return
+        HTTPChannel.allHeadersReceived(self)
+
+    def rawDataReceived(self, data):
+        # chunked bodies have no length up front, count them with the framing
+        self.bodyReceived += len(data)
+        if self.length is None and self.bodyReceived > self.site.maxBodySize:
+            self.reject("body")
+            return
+        HTTPChannel.rawDataReceived(self, data)
+
+    def allContentReceived(self):
+        self.cancelDeadline()
+        HTTPChannel.allContentReceived(self)
+
+    def timeoutConnection(self):
+        if self.deadline is not None:
+            # a request is half read, beat the deadline to it
+            self.reject("timeout")
+        else:
+            HTTPChannel.timeoutConnection(self)
+
+    def reject(self, reason):
+        if self.rejected:
+            return
+        self.rejected = True
+        self.cancelDeadline()
+        self.setTimeout(None)
+        self.site.admission.reject(self.transport.getPeer().host, reason)
+        self.transport.write(self.site.responses[reason])
+        self.loseConnection()
+        # a client that does not read its response does not get to keep
+        # the connection open either
+        self.aborter = self.callLater(ABORT_TIMEOUT, self.transport.abortConnection)
+
+    def connectionLost(self, reason):
+        self.cancelDeadline()
+        if self.aborter is not None and self.aborter.active():
+            self.aborter.cancel()
+        if self.admitted:
+            self.admitted = False
+            self.site.admission.release(self.transport.getPeer().host)
+        HTTPChannel.connectionLost(self, reason)
+
+
+class GuardedSite(Site):
+    """A Site whose connections are GuardedChannels"""
+
+    protocol = GuardedChannel
+
+    def __init__(
+        self,
+        resource,
+        admission,
+        banner,
+        readTimeout=30,
+        maxHeaderSize=8192,
+        maxBodySize=65536,
+    ):
+        # the idle timeout only has to cover keep-alive connections now
+        Site.__init__(self, resource, timeout=readTimeout or None)
+        self.admission = admission
+        self.readTimeout = readTimeout
+        self.maxHeaderSize = maxHeaderSize
+        self.maxBodySize = maxBodySize
+        self.responses = dict(
+            (
+                reason,
+                b"HTTP/1.1 %d %s\r\nServer: %s\r\nContent-Length: 0\r\n"
+                b"Connection: close\r\n\r\n" % (code, message, banner),
+            )
+            for reason, (code, message) in REJECTIONS.items()
+        )
+
+    def startFactory(self):
+        Site.startFactory(self)
+        self.admission.start()
+
+    def stopFactory(self):
+        Site.stopFactory(self)
+        self.admission.stop()
 
 
 class CanaryHTTP(CanaryService):
@@ -164,19 +405,76 @@ class CanaryHTTP(CanaryService):
         self.skindir = config.getVal("http.skindir", default="")
         if not isdir(self.skindir):
             self.skindir = join(CanaryHTTP.resource_dir(), "skin", self.skin)
-        self.staticdir = join(self.skindir, "static")
+        self.bundle = config.getVal("http.skin_bundle", default="")
         self.port = int(config.getVal("http.port", default=80))
         ubanner = config.getVal("http.banner", default="Apache/2.2.22 (Ubuntu)")
         self.banner = ubanner.encode("utf8")
-        StaticNoDirListing.BANNER = self.banner
+        self.vhosts = config.getVal("http.vhosts", default=[])
+        self.read_timeout = float(config.getVal("http.read_timeout", default=30))
+        self.max_header_size = int(config.getVal("http.max_header_size", default=8192))
+        self.max_body_size = int(config.getVal("http.max_body_size", default=65536))
         self.listen_addr = config.getVal("device.listen_addr", default="")
 
+    def logRejected(self, src_host, count, reasons):
+        """Summary of the requests turned away by GuardedChannel"""
+        logdata = {
+            "msg": "rejected %d requests" % count,
+            "REJECTED": count,
+            "REASONS": reasons,
+        }
+        self.log(
+            logdata,
+            logtype=self.logger.LOG_HTTP_GET,
+            src_host=src_host or "",
+            dst_port=self.port,
+        )
+
+    def getAdmission(self):
+        return ConnectionAdmission(
+            self.logRejected,
+            max_per_source=self.config.getVal(
+                "http.max_connections_per_source", default=20
+            ),
+            max_total=self.config.getVal("http.max_connections", default=1000),
+            subnet_rate=0,
+            report_interval=self.config.getVal(
+                "http.reject_report_interval", default=60
+            ),
+        )
+
+    def getVirtualHost(self, vhost):
+        skin = vhost.get("skin", self.skin)
+        skindir = vhost.get("skindir", "")
+        if not isdir(skindir):
+            skindir = join(CanaryHTTP.resource_dir(), "skin", skin)
+        banner = vhost.get("banner", None)
+        return VirtualHost(
+            self,
+            # vhosts of the same skin share its compiled assets
+            getSkin(skindir, bundle=vhost.get("bundle", "")),
+            banner.encode("utf8") if banner is not None else self.banner,
+            hosts=vhost.get("hosts", []),
+            ports=vhost.get("ports", []),
+        )
+
     def getService(self):
-        page = BasicLogin(factory=self)
-        root = StaticNoDirListing(self.staticdir)
-        root.createErrorPages(self)
-        root.putChild(b"", RedirectCustomHeaders(b"/index.html", factory=self))
-        root.putChild(b"index.html", page)
-        wrapped = EncodingResourceWrapper(root, [GzipEncoderFactory()])
-        site = Site(wrapped)
-        return internet.TCPServer(self.port, site, interface=self.listen_addr)
+        # every asset is loaded and compressed once, see honeypot.skin
+        self.compiled = getSkin(self.skindir, bundle=self.bundle)
+        default = VirtualHost(self, self.compiled, self.banner)
+        vhosts = [self.getVirtualHost(v) for v in self.vhosts]
+        site = GuardedSite(
+            VirtualHostRoot(vhosts, default),
+            self.getAdmission(),
+            self.banner,
+            readTimeout=self.read_timeout,
+            maxHeaderSize=self.max_header_size,
+            maxBodySize=self.max_body_size,
+        )
+
+        ports = set([self.port])
+        for vhost in vhosts:
+            ports |= vhost.ports
+        services = [
+            TCPServer(port, site, interface=self.listen_addr) for port in sorted(ports)
+        ]
+        return services[0] if len(services) == 1 else services
@@ -1,15 +1,24 @@
+import re
+from os import urandom
 from random import randint
-from re import search
-from struct import pack, unpack
+from struct import Struct, pack, pack_into
 
-from honeypot.config import PY3, ConfigException
+from honeypot.config import ConfigException
+from honeypot.framing import PacketBuffer
+from honeypot.handover import TCPServer
 from honeypot.modules import CanaryService
-from twisted.application import internet
 from twisted.internet.protocol import Factory, Protocol
 from twisted.protocols.policies import TimeoutMixin
 
 UINT_MAX = 0xFFFFFFFF
 
+# 3 byte payload length as a short and a byte, then the sequence id
+HEADER = Struct("<HBB")
+NUL = re.compile(b"\x00")
+# scrambles are printable like the ones MySQL sends, without '$'
+SALT_CHARS = bytes(c for c in range(0x21, 0x7F) if c != 0x24)
+SALT_TABLE = bytes(SALT_CHARS[i % len(SALT_CHARS)] for i in range(256))
+
 
 class MySQL(Protocol, TimeoutMixin):
     HEADER_LEN = 4
@@ -17,13 +26,15 @@ class MySQL(Protocol, TimeoutMixin):
     ERR_CODE_PKT_ORDER = 1156
     SQL_STATE_ACCESS_DENIED = b"28000"
     SQL_STATE_PKT_ORDER = b"08S01"
+    SALT_LEN = 20
 
     # https://dev.mysql.com/doc/internals/en/connection-phase-packets.html#packet-Protocol::Handshake
     def __init__(self, factory):
         self._busyReceiving = False
-        self._buffer = b""
+        self._buffer = PacketBuffer()
         self.factory = factory
         self.threadid = factory.next_threadid()
+        self.salt = urandom(MySQL.SALT_LEN).translate(SALT_TABLE)
         self.setTimeout(10)
 
     @staticmethod
@@ -44,59 +55,79 @@ class MySQL(Protocol, TimeoutMixin):
     @staticmethod
     def parse_auth(data):
         # https://dev.mysql.com/doc/internals/en/connection-phase-packets.html#packet-Protocol::HandshakeResponse
+        # data may be a memoryview, which has no find()
         offset = 4 + 4 + 1 + 23
-        i = data.find(b"\x00", offset)
-        if i < 0:
+        match = NUL.search(data, offset)
+        if match is None:
             return None, None
 
-        username = data[offset:i]
+        i = match.start()
+        username = bytes(data[offset:i])
         i += 1
-        if PY3:
-            plen = data[i]
-        else:
-            plen = unpack("B", data[i])[0]
+        if i >= len(data):
+            return username, None
+        plen = data[i]
         i += 1
         if plen == 0:
             return username, None
 
-        if PY3:
-            password = "".join("{:02x}".format(c) for c in data[i : i + plen])
-        else:
-            password = "".join("{:02x}".format(ord(c)) for c in data[i : i + plen])
+        password = data[i : i + plen].hex()
 
         return username, password
 
     def consume_packet(self):
-        if len(self._buffer) < MySQL.HEADER_LEN:
+        """
+        Return the sequence id of the next packet and its payload as a
+        memoryview into the receive buffer, valid until the next
+        dataReceived, or None while it has not fully arrived.
+        """
+        header = self._buffer.unpack(HEADER)
+        if header is None:
             return None, None
-        length = unpack("<I", self._buffer[:3] + b"\x00")[0]
-        if PY3:
-            seq_id = self._buffer[3]
-        else:
-            seq_id = unpack("<B", self._buffer[3])[0]
+        low, high, seq_id = header
+        length = low | high << 16
 
         # enough buffer data to consume packet?
         if len(self._buffer) < MySQL.HEADER_LEN + length:
             return seq_id, None
 
-        payload = self._buffer[MySQL.HEADER_LEN : MySQL.HEADER_LEN + length]
-
-        self._buffer = self._buffer[MySQL.HEADER_LEN + length :]
-
-        return seq_id, payload
-
-    def server_greeting(self):
-        # pack returns a byte string for py2 and py3
-        _threadid = pack("<I", self.threadid)
-        # TODO: randomize salts embedded here
+        self._buffer.skip(MySQL.HEADER_LEN)
+        return seq_id, self._buffer.take(length)
+
+    @classmethod
+    def greeting_template(cls, banner):
+        """
+        The greeting packet for `banner` with a blank thread id and salt,
+        and where to patch them in: (packet, thread id, salt, salt part 2)
+        """
+        head = b"\x0a" + banner + b"\x00"
+        # filler, capabilities, charset, status, capabilities, salt length
+        # and 10 reserved bytes between the two parts of the salt
+        middle = b"\x00\xff\xf7\x08\x02\x00\x0f\x80\x15" + b"\x00" * 10
         data = (
-            b"\x0a"
-            + self.factory.canaryservice.banner
-            + b"\x00"
-            + _threadid
-            + b"\x25\x73\x36\x51\x74\x77\x75\x69\x00\xff\xf7\x08\x02\x00\x0f\x80\x15\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x2e\x47\x5c\x78\x67\x7a\x4f\x5b\x5c\x3e\x5c\x39\x00\x6d\x79\x73\x71\x6c\x5f\x6e\x61\x74\x69\x76\x65\x5f\x70\x61\x73\x73\x77\x6f\x72\x64\x00"
+            head
+            + b"\x00" * 4
+            + b"\x00" * 8
+            + middle
+            + b"\x00" * (cls.SALT_LEN - 8)
+            + b"\x00mysql_native_password\x00"
+        )
+        threadid_at = cls.HEADER_LEN + len(head)
+        salt_at = threadid_at + 4
+        return (
+            cls.build_packet(0x00, data),
+            threadid_at,
+            salt_at,
+            salt_at + 8 + len(middle),
         )
-        return self.build_packet(0x00, data)
+
+    def server_greeting(self):
+        template, threadid_at, salt_at, salt2_at = self.factory.greeting
+        packet = bytearray(template)
+        pack_into("<I", packet, threadid_at, self.threadid)
+        packet[salt_at : salt_at + 8] = self.salt[:8]
+        packet[salt2_at : salt2_at + MySQL.SALT_LEN - 8] = self.salt[8:]
+        return bytes(packet)
 
     def access_denied(self, seq_id, user, password=None):
         Y = b"YES" if password else b"NO"
@@ -123,7 +154,7 @@ class MySQL(Protocol, TimeoutMixin):
         self.transport.write(self.server_greeting())
 
     def dataReceived(self, data):
-        self._buffer += data
+        self._buffer.feed(data)
         self.resetTimeout()
 
         if self._busyReceiving:
@@ -136,12 +167,15 @@ class MySQL(Protocol, TimeoutMixin):
                 return
             elif seq_id != 1:
                 # error on wrong seq_id, even if payload hasn't arrived yet
+                if payload is not None:
+                    payload.release()
                 self.transport.write(self.unordered_pkt(0x01))
                 self.transport.loseConnection()
                 return
             elif payload is not None:
                 # seq_id == 1 and payload has arrived
-                username, password = self.parse_auth(payload)
+                with payload:
+                    username, password = self.parse_auth(payload)
                 if username:
                     logdata = {"USERNAME": username, "PASSWORD": password}
                     self.factory.canaryservice.log(logdata, transport=self.transport)
@@ -155,8 +189,10 @@ class MySQL(Protocol, TimeoutMixin):
 
 
 class SQLFactory(Factory):
-    def __init__(self):
+    def __init__(self, banner):
         self.threadid = randint(0, 0x0FFF)
+        # built once, each connection only patches in its thread id and salt
+        self.greeting = MySQL.greeting_template(banner)
 
     def next_threadid(self):
         self.threadid = (self.threadid + randint(1, 5)) & UINT_MAX
@@ -177,10 +213,10 @@ class CanaryMySQL(CanaryService):
         ).encode()
         self.logtype = logger.LOG_MYSQL_LOGIN_ATTEMPT
         self.listen_addr = config.getVal("device.listen_addr", default="")
-        if search("^[3456]\.[-_~.+\w]+$", self.banner.decode()) is None:
+        if re.search("^[3456]\.[-_~.+\w]+$", self.banner.decode()) is None:
             raise ConfigException("sql.banner", "Invalid MySQL Banner")
 
     def getService(self):
-        factory = SQLFactory()
+        factory = SQLFactory(self.banner)
         factory.canaryservice = self
-        return internet.TCPServer(self.port, factory, interface=self.listen_addr)
+        return TCPServer(self.port, factory, interface=self.listen_addr)
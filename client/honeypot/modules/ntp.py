@@ -1,5 +1,5 @@
+from honeypot.handover import UDPServer
 from honeypot.modules import CanaryService
-from twisted.application.internet import UDPServer
 from twisted.internet.address import IPv4Address
 from twisted.internet.protocol import DatagramProtocol
 
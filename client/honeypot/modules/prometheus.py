@@ -0,0 +1,43 @@
+from honeypot import metrics
+from honeypot.handover import TCPServer
+from honeypot.modules import CanaryService
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+"""
+    Prometheus text endpoint for the event pipeline counters, see
+    honeypot.metrics. It listens on loopback unless configured otherwise.
+"""
+
+
+class MetricsPage(Resource):
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader(b"Content-Type", b"text/plain; version=0.0.4; charset=utf-8")
+        return metrics.REGISTRY.render()
+
+
+class QuietSite(Site):
+    """Scrapes are not worth an access log line each"""
+
+    def log(self, request):
+        pass
+
+
+class CanaryMetrics(CanaryService):
+    NAME = "metrics"
+
+    def __init__(self, config=None, logger=None):
+        CanaryService.__init__(self, config=config, logger=logger)
+        self.port = int(config.getVal("metrics.port", default=9120))
+        self.listen_addr = config.getVal("metrics.listen_addr", default="127.0.0.1")
+        self.lag_interval = float(config.getVal("metrics.lag_interval", default=1.0))
+
+    def getService(self):
+        site = QuietSite(MetricsPage())
+        site.noisy = False
+        return [
+            TCPServer(self.port, site, interface=self.listen_addr),
+            metrics.ReactorLagProbe(self.lag_interval),
+        ]
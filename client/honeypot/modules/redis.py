@@ -1,7 +1,7 @@
 from shlex import split
 
+from honeypot.handover import TCPServer
 from honeypot.modules import CanaryService
-from twisted.application import internet
 from twisted.internet.protocol import Factory, Protocol
 
 
@@ -442,4 +442,4 @@ class CanaryRedis(Factory, CanaryService):
         self.logtype = logger.LOG_REDIS_COMMAND
 
     def getService(self):
-        return internet.TCPServer(self.port, self)
+        return TCPServer(self.port, self)
@@ -1,28 +1,108 @@
 from __future__ import print_function
 
+import json
 import os.path
+import random
 import time
 from base64 import b64encode
+from bisect import bisect_left
+from collections import deque
 from struct import unpack
 from subprocess import DEVNULL, run
 
 import twisted
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import dsa, rsa
+from cryptography.hazmat.primitives.asymmetric import dsa, ed25519, rsa
 from docker import from_env
+from honeypot.handover import TCPServer
 from honeypot.modules import CanaryService
-from twisted.application import internet
+from honeypot.ratelimit import ConnectionAdmission
 from twisted.conch import avatar, error
 from twisted.conch import interfaces as conchinterfaces
 from twisted.conch.openssh_compat import primes
-from twisted.conch.ssh import connection, factory, keys, session, transport, userauth
+from twisted.conch.ssh import (
+    connection,
+    factory,
+    keys,
+    session,
+    transport,
+    userauth,
+)
 from twisted.conch.ssh.common import MP
 from twisted.cred import checkers, credentials, error, portal
-from twisted.internet import defer
+from twisted.internet import defer, reactor, threads
+from twisted.internet.task import LoopingCall, deferLater
+from twisted.python import log as twistedlog
+from twisted.python.threadable import isInIOThread
+from twisted.python.threadpool import ThreadPool
 from zope.interface import implementer
 
 SSH_PATH = r"/var/tmp"
+MODULI_PATHS = "/etc/ssh/moduli", "/private/etc/moduli"
+ADMISSION_POLICIES = ("disconnect", "delay", "queue")
+# key exchanges that need the DH groups of the moduli file
+GROUP_EXCHANGE = b"diffie-hellman-group-exchange-"
+
+# Algorithms offered under each ssh.profile, most preferred first. Names
+# Twisted does not implement are left out when the factory starts, None
+# keeps Twisted's list (for host keys: every key the factory holds).
+PROFILES = {
+    "default": {"kex": None, "hostkeys": [b"ssh-rsa", b"ssh-dss"]},
+    # elliptic curve exchange and Ed25519 signatures cost a fraction of DH
+    # groups and RSA, at the price of looking like a recent server. The
+    # client picks from what is offered, so nothing dearer is offered.
+    "cheap": {
+        "kex": [
+            b"curve25519-sha256",
+            b"curve25519-sha256@libssh.org",
+            b"ecdh-sha2-nistp256",
+        ],
+        "hostkeys": [b"ssh-ed25519"],
+        "ciphers": [b"aes128-ctr", b"aes256-ctr"],
+        "macs": [b"hmac-sha2-256", b"hmac-sha1"],
+    },
+    # what OpenSSH 5.1, the default ssh.version, offers
+    "legacy-faithful": {
+        "kex": [
+            b"diffie-hellman-group-exchange-sha256",
+            b"diffie-hellman-group-exchange-sha1",
+            b"diffie-hellman-group14-sha1",
+            b"diffie-hellman-group1-sha1",
+        ],
+        "hostkeys": [b"ssh-rsa", b"ssh-dss"],
+        "ciphers": [
+            b"aes128-ctr",
+            b"aes192-ctr",
+            b"aes256-ctr",
+            b"arcfour256",
+            b"arcfour128",
+            b"aes128-cbc",
+            b"3des-cbc",
+            b"blowfish-cbc",
+            b"cast128-cbc",
+            b"aes192-cbc",
+            b"aes256-cbc",
+            b"arcfour",
+        ],
+        "macs": [
+            b"hmac-md5",
+            b"hmac-sha1",
+            b"umac-64@openssh.com",
+            b"hmac-ripemd160",
+            b"hmac-sha1-96",
+            b"hmac-md5-96",
+        ],
+    },
+}
+
+
+def _offer(wanted, supported):
+    """The names of `wanted` that are in `supported`, in wanted's order"""
+    if wanted is None:
+        return list(supported)
+    return [name for name in wanted if name in supported]
+
 
 # pulled from Kippo
 from twisted.conch.ssh.common import NS, getNS
@@ -138,6 +218,39 @@ class HoneyPotSSHUserAuthServer(userauth.SSHUserAuthServer):
         return userauth.SSHUserAuthServer.ssh_USERAUTH_REQUEST(self, packet)
 
 
+class KexWorkers(object):
+    """
+    Run the expensive key exchange steps (DH key generation, the shared
+    secret, the host key signature) on a thread pool.
+
+    cryptography releases the GIL inside OpenSSL, so the workers compute in
+    parallel while the reactor thread only does I/O. At most `inflight`
+    steps per worker are handed to the pool, later ones wait their turn.
+    """
+
+    def __init__(self, workers, inflight):
+        self.workers = workers
+        self.semaphore = defer.DeferredSemaphore(workers * inflight)
+        self.pool = None
+
+    def start(self):
+        self.pool = ThreadPool(0, self.workers, name="ssh-kex")
+        self.pool.start()
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+
+    def run(self, f, *args):
+        return self.semaphore.run(self._run, f, *args)
+
+    def _run(self, f, *args):
+        if self.pool is None:
+            return defer.fail(RuntimeError("key exchange workers are stopped"))
+        return threads.deferToThreadPool(reactor, self.pool, f, *args)
+
+
 # As implemented by Kojoney
 class HoneyPotSSHFactory(factory.SSHFactory):
     services = {
@@ -153,35 +266,166 @@ class HoneyPotSSHFactory(factory.SSHFactory):
         # for dblog in self.dbloggers:
         #    dblog.logDispatch(sessionid, msg)
 
-    def __init__(self, logger=None, version=None):
+    def __init__(
+        self,
+        logger=None,
+        version=None,
+        moduliCache=None,
+        kexWorkers=None,
+        admission=None,
+        admissionPolicy="disconnect",
+        admissionDelay=10,
+        admissionMaxDelayed=1000,
+        profile="default",
+    ):
         # protocol^Wwhatever instances are kept here for the interact feature
         self.sessions = {}
         self.logger = logger
         self.version = version
+        self.moduliCache = moduliCache
+        self.kexWorkers = kexWorkers
+        self.admission = admission
+        self.admissionPolicy = admissionPolicy
+        self.admissionDelay = admissionDelay
+        self.admissionMaxDelayed = admissionMaxDelayed
+        self.profile = PROFILES[profile]
+        # transports held open under the "delay" policy
+        self.delayed = 0
+        # transports waiting for a slot under the "queue" policy
+        self.waiting = deque()
+        self.drainer = LoopingCall(self.drainWaiting)
+
+    def startFactory(self):
+        factory.SSHFactory.startFactory(self)
+        if self.kexWorkers is not None:
+            self.kexWorkers.start()
+        if self.admission is not None:
+            self.admission.start()
+            if self.admissionPolicy == "queue":
+                self.drainer.start(1.0, now=False)
+        # sizes of the available DH groups, for the nearest-size lookup
+        self.primeSizes = sorted(self.primes or ())
+
+        # algorithm lists of the profile, computed once for all connections
+        profile = self.profile
+        self.supportedPublicKeys = _offer(
+            profile.get("hostkeys"), list(self.privateKeys.keys())
+        )
+        self.supportedKeyExchanges = _offer(
+            profile.get("kex"), HoneyPotTransport.supportedKeyExchanges
+        )
+        self.supportedCiphers = _offer(
+            profile.get("ciphers"), HoneyPotTransport.supportedCiphers
+        )
+        self.supportedMACs = _offer(
+            profile.get("macs"), HoneyPotTransport.supportedMACs
+        )
+        if not self.primes:
+            # without groups only the fixed-group and curve exchanges work
+            self.supportedKeyExchanges = [
+                kex
+                for kex in self.supportedKeyExchanges
+                if not kex.startswith(GROUP_EXCHANGE)
+            ]
+
+    def stopFactory(self):
+        factory.SSHFactory.stopFactory(self)
+        if self.kexWorkers is not None:
+            self.kexWorkers.stop()
+        if self.drainer.running:
+            self.drainer.stop()
+        if self.admission is not None:
+            self.admission.stop()
+
+    def admit(self, t):
+        """
+        Decide whether a new transport may start its handshake now. If not,
+        it is disconnected, held open until admissionDelay passes, or queued
+        until a slot frees up, as admissionPolicy says. At most
+        admissionMaxDelayed transports are held open, the rest are
+        disconnected right away.
+        """
+        if self.admission is None:
+            return True
+        peer = t.transport.getPeer().host
+        reason = self.admission.admit(peer)
+        if reason is None:
+            t.admitted = True
+            return True
+
+        if self.admissionPolicy == "queue":
+            if len(self.waiting) < (self.admission.max_total or 1000):
+                t.waitingSince = time.monotonic()
+                self.waiting.append(t)
+                return False
+            reason = "queue"
+        self.admission.reject(peer, reason)
+        if self.admissionPolicy == "delay" and self.delayed < self.admissionMaxDelayed:
+            # a tarpit: the scanner waits for a banner that never comes
+            self.delayed += 1
+            t.closer = reactor.callLater(
+                self.admissionDelay, t.transport.loseConnection
+            )
+        else:
+            t.transport.loseConnection()
+        return False
+
+    def release(self, t):
+        """Called once a transport authenticated or its connection is lost"""
+        if t.closer is not None:
+            t.closer = None
+            self.delayed -= 1
+        if t.admitted:
+            t.admitted = False
+            self.admission.release(t.transport.getPeer().host)
+            if self.waiting:
+                self.drainWaiting()
+
+    def drainWaiting(self):
+        """Start queued transports that fit now, drop the ones waited too long"""
+        now = time.monotonic()
+        waiting, self.waiting = self.waiting, deque()
+        for t in waiting:
+            if t.lost:
+                continue
+            peer = t.transport.getPeer().host
+            reason = self.admission.admit(peer)
+            if reason is None:
+                t.admitted = True
+                t.startHandshake()
+            elif now - t.waitingSince >= self.admissionDelay:
+                self.admission.reject(peer, reason)
+                t.transport.loseConnection()
+            else:
+                self.waiting.append(t)
+
+    def getPrimes(self):
+        """Called once at factory start, see loadPrimes"""
+        return loadPrimes(self.moduliCache)
+
+    def getDHPrime(self, bits):
+        """Return a (g, p) group of the size closest to bits"""
+        i = bisect_left(self.primeSizes, bits)
+        if i == len(self.primeSizes) or (
+            i > 0 and bits - self.primeSizes[i - 1] <= self.primeSizes[i] - bits
+        ):
+            i -= 1
+        return random.choice(self.primes[self.primeSizes[i]])
 
     def buildProtocol(self, addr):
         # FIXME: try to mimic something real 100%
         t = HoneyPotTransport()
-        _modulis = "/etc/ssh/moduli", "/private/etc/moduli"
 
         if self.version:
             t.ourVersionString = self.version
         else:
             t.ourVersionString = "empty"
 
-        t.supportedPublicKeys = self.privateKeys.keys()
-        for _moduli in _modulis:
-            try:
-                self.primes = primes.parseModuliFile(_moduli)
-                break
-            except IOError:
-                pass
-
-        if not self.primes:
-            ske = t.supportedKeyExchanges[:]
-            if "diffie-hellman-group-exchange-sha1" in ske:
-                ske.remove("diffie-hellman-group-exchange-sha1")
-            t.supportedKeyExchanges = ske
+        # computed once in startFactory, shared by every connection
+        t.supportedPublicKeys = self.supportedPublicKeys
+        t.supportedKeyExchanges = self.supportedKeyExchanges
+        t.supportedCiphers = self.supportedCiphers
+        t.supportedMACs = self.supportedMACs
 
         t.factory = self
         return t
@@ -202,8 +446,28 @@ class HoneyPotRealm:
 class HoneyPotTransport(transport.SSHServerTransport):
 
     hadVersion = False
+    # packets and key setup produced by a key exchange step on a worker,
+    # None while no step is running
+    kexOutput = None
+    # admission state, see HoneyPotSSHFactory.admit
+    admitted = False
+    started = False
+    lost = False
+    closer = None
+    pending = b""
 
     def connectionMade(self):
+        if self.factory.admit(self):
+            self.startHandshake()
+
+    def setService(self, service):
+        transport.SSHServerTransport.setService(self, service)
+        if service.name != b"ssh-userauth":
+            # authenticated, the admission slot only covers the handshake
+            self.factory.release(self)
+
+    def startHandshake(self):
+        self.started = True
         logdata = {"SESSION": str(self.transport.sessionno)}
         logtype = self.factory.canaryservice.logger.LOG_SSH_NEW_CONNECTION
         log = self.factory.canaryservice.log
@@ -213,6 +477,10 @@ class HoneyPotTransport(transport.SSHServerTransport):
         self.logintime = time.time()
         self.ttylog_open = False
         transport.SSHServerTransport.connectionMade(self)
+        if self.pending:
+            # the client's version string, sent while it was queued
+            pending, self.pending = self.pending, b""
+            self.dataReceived(pending)
 
     def sendKexInit(self):
         # Don't send key exchange prematurely
@@ -221,6 +489,10 @@ class HoneyPotTransport(transport.SSHServerTransport):
         transport.SSHServerTransport.sendKexInit(self)
 
     def dataReceived(self, data):
+        if not self.started:
+            if len(self.pending) < 4096:
+                self.pending += data
+            return
         transport.SSHServerTransport.dataReceived(self, data)
         # later versions seem to call sendKexInit again on their own
         isLibssh = data.find(b"libssh", data.find(b"SSH-")) != -1
@@ -229,6 +501,8 @@ class HoneyPotTransport(transport.SSHServerTransport):
             (twisted.version.major < 11 or isLibssh)
             and not self.hadVersion
             and self.gotVersion
+            # the client's KEXINIT may have come in the same read
+            and self._keyExchangeState == self._KEY_EXCHANGE_NONE
         ):
             self.sendKexInit()
             self.hadVersion = True
@@ -237,7 +511,76 @@ class HoneyPotTransport(transport.SSHServerTransport):
         # print('Remote SSH version: %s' % (self.otherVersionString,))
         return transport.SSHServerTransport.ssh_KEXINIT(self, packet)
 
+    def runKex(self, handler, packet):
+        """
+        Run a key exchange handler on the factory's workers, if any.
+
+        Reading is paused and later messages are queued until the step is
+        done; the packets it sends are collected and sent from the reactor.
+        """
+        workers = self.factory.kexWorkers
+        if workers is None:
+            return handler(packet)
+        self.kexOutput = []
+        self.kexQueued = []
+        self.transport.pauseProducing()
+        d = workers.run(handler, packet)
+        d.addCallbacks(self._kexDone, self._kexFailed)
+
+    def _kexDone(self, result):
+        output, self.kexOutput = self.kexOutput, None
+        if self.lost:
+            return
+        for f, args in output:
+            f(self, *args)
+        self.transport.resumeProducing()
+        while self.kexQueued and self.kexOutput is None:
+            self.dispatchMessage(*self.kexQueued.pop(0))
+
+    def _kexFailed(self, failure):
+        self.kexOutput = None
+        twistedlog.err(failure, "SSH key exchange failed")
+        self.transport.loseConnection()
+
+    def dispatchMessage(self, messageNum, payload):
+        if self.kexOutput is not None:
+            self.kexQueued.append((messageNum, payload))
+            return
+        transport.SSHServerTransport.dispatchMessage(self, messageNum, payload)
+
+    def sendPacket(self, messageType, payload):
+        if self.kexOutput is not None and not isInIOThread():
+            self.kexOutput.append(
+                (transport.SSHServerTransport.sendPacket, (messageType, payload))
+            )
+            return
+        transport.SSHServerTransport.sendPacket(self, messageType, payload)
+
+    def _keySetup(self, sharedSecret, exchangeHash):
+        if self.kexOutput is not None and not isInIOThread():
+            self.kexOutput.append(
+                (transport.SSHServerTransport._keySetup, (sharedSecret, exchangeHash))
+            )
+            return
+        transport.SSHServerTransport._keySetup(self, sharedSecret, exchangeHash)
+
+    def ssh_KEX_DH_GEX_REQUEST_OLD(self, packet):
+        # also carries KEXDH_INIT and KEX_ECDH_INIT
+        self.runKex(self.requestGroupOld, packet)
+
+    def requestGroupOld(self, packet):
+        return transport.SSHServerTransport.ssh_KEX_DH_GEX_REQUEST_OLD(self, packet)
+
+    def ssh_KEX_DH_GEX_INIT(self, packet):
+        self.runKex(self.gexInit, packet)
+
+    def gexInit(self, packet):
+        return transport.SSHServerTransport.ssh_KEX_DH_GEX_INIT(self, packet)
+
     def ssh_KEX_DH_GEX_REQUEST(self, packet):
+        self.runKex(self.requestGroup, packet)
+
+    def requestGroup(self, packet):
         MSG_KEX_DH_GEX_GROUP = 31
         # We have to override this method since the original will
         # pick the client's ideal DH group size. For some SSH clients, this is
@@ -249,6 +592,7 @@ class HoneyPotTransport(transport.SSHServerTransport):
         self.dhGexRequest = packet
         min, ideal, max = unpack(">3L", packet)
         self.g, self.p = self.factory.getDHPrime(min)
+        self._startEphemeralDH()
         self.sendPacket(MSG_KEX_DH_GEX_GROUP, MP(self.p) + MP(self.g))
 
     def lastlogExit(self):
@@ -261,6 +605,12 @@ class HoneyPotTransport(transport.SSHServerTransport):
 
     # this seems to be the only reliable place of catching lost connection
     def connectionLost(self, reason):
+        self.lost = True
+        if self.closer is not None and self.closer.active():
+            self.closer.cancel()
+        self.factory.release(self)
+        if not self.started:
+            return
         for i in self.interactors:
             i.sessionClosed()
         if self.transport.sessionno in self.factory.sessions:
@@ -391,6 +741,104 @@ def getDSAKeys():
     return public_key_string, private_key_string
 
 
+def getEd25519Keys():
+    """
+    Checks for existing Ed25519 Keys, if there are none, generates a key
+    pair, saves them to a temporary location and returns the keys formatted
+    as OpenSSH keys.
+    """
+    public_key = os.path.join(SSH_PATH, "id_ed25519.pub")
+    private_key = os.path.join(SSH_PATH, "id_ed25519")
+
+    if not (os.path.exists(public_key) and os.path.exists(private_key)):
+        ssh_key = ed25519.Ed25519PrivateKey.generate()
+        public_key_string = ssh_key.public_key().public_bytes(
+            serialization.Encoding.OpenSSH, serialization.PublicFormat.OpenSSH
+        )
+        private_key_string = ssh_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.OpenSSH,
+            serialization.NoEncryption(),
+        )
+        with open(public_key, "w+b") as key_file:
+            key_file.write(public_key_string)
+        with open(private_key, "w+b") as key_file:
+            key_file.write(private_key_string)
+    else:
+        with open(public_key) as key_file:
+            public_key_string = key_file.read()
+        with open(private_key) as key_file:
+            private_key_string = key_file.read()
+
+    return public_key_string, private_key_string
+
+
+def loadHostKeys():
+    """Return the public and private host keys, keyed by key type"""
+    publicKeys = {}
+    privateKeys = {}
+    for keyType, getKeys in (
+        (b"ssh-rsa", getRSAKeys),
+        (b"ssh-dss", getDSAKeys),
+        (b"ssh-ed25519", getEd25519Keys),
+    ):
+        pubKeyString, privKeyString = getKeys()
+        publicKeys[keyType] = keys.Key.fromString(data=pubKeyString)
+        privateKeys[keyType] = keys.Key.fromString(data=privKeyString)
+    return publicKeys, privateKeys
+
+
+def loadPrimes(cache=None):
+    """
+    Load the Diffie-Hellman groups, a dict of size in bits to (g, p) tuples.
+
+    Parsing the moduli file means a few hundred KB of big hex integers, so
+    the groups are loaded once per factory. With a cache path the parsed
+    groups are kept there and read back while the cache is newer than the
+    moduli file; the cache can also be copied to hosts without a moduli file.
+    """
+    moduli = None
+    for path in MODULI_PATHS:
+        if os.path.exists(path):
+            moduli = path
+            break
+
+    if cache and os.path.exists(cache):
+        if moduli is None or os.path.getmtime(cache) >= os.path.getmtime(moduli):
+            try:
+                with open(cache) as f:
+                    groups = json.load(f)
+                return dict(
+                    (int(size), [(int(g), int(p, 16)) for g, p in group])
+                    for size, group in groups.items()
+                )
+            except (IOError, OSError, ValueError, TypeError):
+                pass
+
+    if moduli is None:
+        return {}
+    try:
+        groups = primes.parseModuliFile(moduli)
+    except (IOError, OSError, ValueError):
+        return {}
+
+    if cache:
+        try:
+            tmp = cache + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(
+                    dict(
+                        (size, [(g, "%x" % p) for g, p in group])
+                        for size, group in groups.items()
+                    ),
+                    f,
+                )
+            os.replace(tmp, cache)
+        except (IOError, OSError):
+            pass
+    return groups
+
+
 @implementer(checkers.ICredentialsChecker)
 class HoneypotPasswordChecker:
 
@@ -427,6 +875,26 @@ class CanarySSH(CanaryService):
             "ssh.version", default="SSH-2.0-OpenSSH_5.1p1 Debian-5"
         ).encode("utf8")
         self.listen_addr = config.getVal("device.listen_addr", default="")
+        self.moduli_cache = config.getVal("ssh.moduli_cache", default="")
+        self.kex_workers = int(config.getVal("ssh.kex_workers", default=0))
+        self.kex_inflight = int(config.getVal("ssh.kex_inflight_per_worker", default=4))
+        self.admission = config.getVal("ssh.admission_enabled", default=False)
+        self.admission_policy = config.getVal(
+            "ssh.admission_policy", default="disconnect"
+        )
+        if self.admission_policy not in ADMISSION_POLICIES:
+            raise ValueError(
+                "ssh.admission_policy must be one of %s" % ", ".join(ADMISSION_POLICIES)
+            )
+        self.admission_delay = float(config.getVal("ssh.admission_delay", default=10))
+        self.admission_max_delayed = int(
+            config.getVal("ssh.admission_max_delayed", default=1000)
+        )
+        self.profile = config.getVal("ssh.profile", default="default")
+        if self.profile not in PROFILES:
+            raise ValueError(
+                "ssh.profile must be one of %s" % ", ".join(sorted(PROFILES))
+            )
 
     def dockerPs(self):
         client = from_env()
@@ -437,34 +905,63 @@ class CanarySSH(CanaryService):
         else:
             run(f"docker start {containerName}", shell=True, stdout=DEVNULL)
 
-    def supervisor(self):
-        try:
-            status = run(
-                r"supervisorctl status cowrielog", shell=True, capture_output=True
-            )
-            if "STOPPED" in status.stdout.decode("utf-8"):
-                run(r"supervisorctl start cowrielog", shell=True, stdout=DEVNULL)
-        except:
-            print("ssh.py supervisor error!!")
+    def prepare(self):
+        # docker calls block, give the container two seconds to come up
+        d = threads.deferToThread(self.dockerPs)
+        d.addCallback(lambda _: deferLater(reactor, 2, lambda: None))
+        return d
+
+    def logRejected(self, src_host, count, reasons):
+        """Summary of the connections turned away by admission control"""
+        logdata = {
+            "msg": "rejected %d connections" % count,
+            "REJECTED": count,
+            "REASONS": reasons,
+            "POLICY": self.admission_policy,
+        }
+        self.log(
+            logdata,
+            logtype=self.logger.LOG_SSH_NEW_CONNECTION,
+            src_host=src_host or "",
+            dst_port=self.port,
+        )
+
+    def getAdmission(self):
+        if not self.admission:
+            return None
+        return ConnectionAdmission(
+            self.logRejected,
+            max_per_source=self.config.getVal("ssh.max_preauth_per_source", default=10),
+            max_total=self.config.getVal("ssh.max_preauth_total", default=500),
+            subnet_rate=self.config.getVal("ssh.handshake_rate_per_subnet", default=20),
+            subnet_burst=self.config.getVal(
+                "ssh.handshake_burst_per_subnet", default=100
+            ),
+            report_interval=self.config.getVal(
+                "ssh.admission_report_interval", default=60
+            ),
+        )
 
     def getService(self):
-        self.dockerPs()
-        time.sleep(2)
-        self.supervisor()
-        factory = HoneyPotSSHFactory(version=self.version, logger=self.logger)
+        factory = HoneyPotSSHFactory(
+            version=self.version,
+            logger=self.logger,
+            moduliCache=self.moduli_cache or None,
+            kexWorkers=(
+                KexWorkers(self.kex_workers, self.kex_inflight)
+                if self.kex_workers > 0
+                else None
+            ),
+            admission=self.getAdmission(),
+            admissionPolicy=self.admission_policy,
+            admissionDelay=self.admission_delay,
+            admissionMaxDelayed=self.admission_max_delayed,
+            profile=self.profile,
+        )
         factory.canaryservice = self
         factory.portal = portal.Portal(HoneyPotRealm())
 
-        rsa_pubKeyString, rsa_privKeyString = getRSAKeys()
-        dsa_pubKeyString, dsa_privKeyString = getDSAKeys()
         factory.portal.registerChecker(HoneypotPasswordChecker(logger=factory.logger))
         factory.portal.registerChecker(CanaryPublicKeyChecker(logger=factory.logger))
-        factory.publicKeys = {
-            b"ssh-rsa": keys.Key.fromString(data=rsa_pubKeyString),
-            b"ssh-dss": keys.Key.fromString(data=dsa_pubKeyString),
-        }
-        factory.privateKeys = {
-            b"ssh-rsa": keys.Key.fromString(data=rsa_privKeyString),
-            b"ssh-dss": keys.Key.fromString(data=dsa_privKeyString),
-        }
-        return internet.TCPServer(self.port, factory, interface=self.listen_addr)
+        factory.publicKeys, factory.privateKeys = loadHostKeys()
+        return TCPServer(self.port, factory, interface=self.listen_addr)
@@ -1,9 +1,8 @@
 from subprocess import DEVNULL, run
-from time import sleep
 
 from docker import from_env
+from honeypot.handover import TCPServer
 from honeypot.modules import CanaryService
-from twisted.application.internet import TCPServer
 from twisted.conch.telnet import (
     ECHO,
     AuthenticatingTelnetProtocol,
@@ -11,7 +10,9 @@ from twisted.conch.telnet import (
     TelnetTransport,
 )
 from twisted.cred import credentials, portal
+from twisted.internet import reactor, threads
 from twisted.internet.protocol import ServerFactory
+from twisted.internet.task import deferLater
 from zope.interface import implementer
 
 
@@ -76,20 +77,13 @@ class Telnet(CanaryService):
         else:
             run(f"docker start {containerName}", shell=True, stdout=DEVNULL)
 
-    def supervisor(self):
-        try:
-            status = run(
-                r"supervisorctl status cowrielog", shell=True, capture_output=True
-            )
-            if "STOPPED" in status.stdout.decode("utf-8"):
-                run(r"supervisorctl start cowrielog", shell=True, stdout=DEVNULL)
-        except:
-            print("telnet.py supervisor error!!")
+    def prepare(self):
+        # the sshtel container also serves ssh, see SSH.prepare
+        d = threads.deferToThread(self.dockerPs)
+        d.addCallback(lambda _: deferLater(reactor, 2, lambda: None))
+        return d
 
     def getService(self):
-        self.dockerPs()
-        sleep(2)
-        self.supervisor()
         r = Realm()
         p = portal.Portal(r)
         f = ServerFactory()
@@ -0,0 +1,237 @@
+"""
+Rate limiting primitives shared by the alerting and logging paths.
+"""
+
+from collections import OrderedDict
+from time import monotonic
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+
+class TokenBucket(object):
+    """
+    Classic token bucket: `rate` tokens per second, holding at most `burst`.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.stamp = monotonic()
+
+    def consume(self, tokens=1):
+        """Take `tokens` if available and report whether that worked"""
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+
+class LoadShedder(object):
+    """
+    Admission control for module events.
+
+    Every event must fit in its source's bucket, its module's bucket and the
+    global budget. Events that do not are only counted, and the counts are
+    handed to `emit` as a "suppressed N events" record per module every
+    `report_interval` seconds. At most `max_sources` source buckets are kept,
+    the least recently seen is forgotten first.
+    """
+
+    def __init__(
+        self,
+        emit,
+        source_rate=20,
+        source_burst=100,
+        module_rate=200,
+        module_burst=1000,
+        global_rate=500,
+        global_burst=2000,
+        max_sources=10000,
+        report_interval=60,
+    ):
+        self.emit = emit
+        self.source_rate = source_rate
+        self.source_burst = source_burst
+        self.module_rate = module_rate
+        self.module_burst = module_burst
+        self.max_sources = int(max_sources)
+
+        self.sources = OrderedDict()
+        self.modules = {}
+        self.budget = TokenBucket(global_rate, global_burst)
+
+        # module name -> {src_host: suppressed events}
+        self.suppressed = {}
+
+        self.reporter = LoopingCall(self.report)
+        reactor.callWhenRunning(self.reporter.start, report_interval, False)
+
+    def admit(self, module, src_host):
+        """Return True if the event may be logged, otherwise count it"""
+        bucket = self.sources.get(src_host)
+        if bucket is None:
+            if len(self.sources) >= self.max_sources:
+                self.sources.popitem(last=False)
+            bucket = self.sources[src_host] = TokenBucket(
+                self.source_rate, self.source_burst
+            )
+        else:
+            self.sources.move_to_end(src_host)
+
+        modbucket = self.modules.get(module)
+        if modbucket is None:
+            modbucket = self.modules[module] = TokenBucket(
+                self.module_rate, self.module_burst
+            )
+
+        if bucket.consume() and modbucket.consume() and self.budget.consume():
+            return True
+
+        counts = self.suppressed.setdefault(module, {})
+        if src_host in counts or len(counts) < self.max_sources:
+            counts[src_host] = counts.get(src_host, 0) + 1
+        else:
+            counts[None] = counts.get(None, 0) + 1
+        return False
+
+    def report(self):
+        suppressed, self.suppressed = self.suppressed, {}
+        for module, counts in suppressed.items():
+            total = sum(counts.values())
+            top = sorted(
+                ((n, src) for src, n in counts.items() if src is not None),
+                reverse=True,
+            )[:10]
+            self.emit(
+                {
+                    "logdata": {
+                        "msg": "suppressed %d events" % total,
+                        "MODULE": module,
+                        "COUNT": total,
+                        "SOURCES": dict((src, n) for n, src in top),
+                    }
+                }
+            )
+
+
+def subnet(host):
+    """The /24 of an IPv4 address, the /64 of an IPv6 one"""
+    if ":" in host:
+        return ":".join(host.split(":")[:4])
+    return host.rsplit(".", 1)[0]
+
+
+class ConnectionAdmission(object):
+    """
+    Admission control for connections.
+
+    A source may hold at most `max_per_source` admitted connections and all
+    sources together `max_total`; 0 means no limit. New connections from one
+    subnet (see `subnet`) are admitted at `subnet_rate` per second with a
+    burst of `subnet_burst`, or without a rate limit when it is 0.
+    Rejections are counted per source and handed to
+    `emit(src_host, count, reasons)` every `report_interval` seconds, for at
+    most REPORT_SOURCES sources; the rest are reported with src_host None.
+    """
+
+    REPORT_SOURCES = 100
+
+    def __init__(
+        self,
+        emit,
+        max_per_source=10,
+        max_total=500,
+        subnet_rate=20,
+        subnet_burst=100,
+        max_subnets=10000,
+        report_interval=60,
+    ):
+        self.emit = emit
+        self.max_per_source = int(max_per_source)
+        self.max_total = int(max_total)
+        self.subnet_rate = subnet_rate
+        self.subnet_burst = subnet_burst
+        self.max_subnets = int(max_subnets)
+        self.report_interval = report_interval
+
+        self.active = {}
+        self.total = 0
+        self.subnets = OrderedDict()
+
+        # src_host -> {reason: rejected connections}
+        self.rejected = {}
+        self.reporter = LoopingCall(self.report)
+
+    def start(self):
+        if not self.reporter.running:
+            self.reporter.start(self.report_interval, now=False)
+
+    def stop(self):
+        if self.reporter.running:
+            self.reporter.stop()
+        self.report()
+
+    def admit(self, src_host):
+        """
+        Take a slot for a new connection from `src_host`. Returns None when
+        it was admitted, otherwise why not: "source", "total" or "rate".
+        """
+        if self.max_per_source and self.active.get(src_host, 0) >= self.max_per_source:
+            return "source"
+        if self.max_total and self.total >= self.max_total:
+            return "total"
+
+        if self.subnet_rate:
+            key = subnet(src_host)
+            bucket = self.subnets.get(key)
+            if bucket is None:
+                if len(self.subnets) >= self.max_subnets:
+                    self.subnets.popitem(last=False)
+                bucket = self.subnets[key] = TokenBucket(
+                    self.subnet_rate, self.subnet_burst
+                )
+            else:
+                self.subnets.move_to_end(key)
+            if not bucket.consume():
+                return "rate"
+
+        self.active[src_host] = self.active.get(src_host, 0) + 1
+        self.total += 1
+        return None
+
+    def release(self, src_host):
+        """Give back the slot of an admitted connection"""
+        count = self.active.get(src_host, 0) - 1
+        if count > 0:
+            self.active[src_host] = count
+        else:
+            self.active.pop(src_host, None)
+        self.total = max(0, self.total - 1)
+
+    def reject(self, src_host, reason):
+        """Count a connection that was turned away"""
+        if src_host not in self.rejected and len(self.rejected) >= self.max_subnets:
+            src_host = None
+        reasons = self.rejected.setdefault(src_host, {})
+        reasons[reason] = reasons.get(reason, 0) + 1
+
+    def report(self):
+        rejected, self.rejected = self.rejected, {}
+        others = rejected.pop(None, {})
+        ranked = sorted(
+            rejected.items(), key=lambda item: sum(item[1].values()), reverse=True
+        )
+        for src_host, reasons in ranked[: self.REPORT_SOURCES]:
+            self.emit(src_host, sum(reasons.values()), reasons)
+        for src_host, reasons in ranked[self.REPORT_SOURCES :]:
+            for reason, n in reasons.items():
+                others[reason] = others.get(reason, 0) + n
+        if others:
+            self.emit(None, sum(others.values()), others)
@@ -0,0 +1,380 @@
+"""
+Ship honeypot events to the log collection webserver.
+
+Events are queued in memory and flushed in batches, by size or on a timer,
+over a small pool of persistent HTTP connections driven by the reactor.
+Logging an event therefore never blocks a protocol and never opens a socket
+of its own. Events travel as JSON, or as MessagePack when `format` is
+"msgpack" (see honeypot.wire). Batches that cannot be delivered are handed
+to an optional `honeypot.spool.EventSpool` and replayed, rate-limited, once
+the webserver answers again.
+"""
+
+from __future__ import print_function
+
+from collections import deque
+from gzip import compress as gzip
+from io import BytesIO
+from sys import stderr
+from time import monotonic
+
+from simplejson import dumps, loads
+from twisted.internet import defer, reactor
+from twisted.internet.task import LoopingCall
+from twisted.python.failure import Failure
+from twisted.web.client import Agent, FileBodyProducer, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+
+from honeypot import metrics, wire
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class ShipperError(Exception):
+    """Raised when the webserver does not accept a request"""
+
+    def __init__(self, code, body=b""):
+        self.code = code
+        self.body = body
+
+    def __str__(self):
+        return "webserver replied %s" % self.code
+
+
+class BulkRetry(Exception):
+    """Raised when the webserver asked for some events of a bulk post again"""
+
+    def __str__(self):
+        return "webserver failed to store some events"
+
+
+class EventShipper(object):
+    """
+    Bounded event queue drained by a long-lived HTTP connection pool.
+
+    `queue_size` caps the number of events held in memory, `batch_size` is
+    the number of events taken per flush and `flush_interval` the number
+    of seconds between timed flushes. At most `max_connections` batches are
+    in flight at once, each reusing a keep-alive connection from the pool.
+
+    With a `spool`, events that overflow the queue or fail to post are
+    written to disk instead of being dropped, and up to `replay_rate`
+    spooled events per second are sent back to the webserver. Until the
+    spool is drained new events are spooled behind it, so they still reach
+    the webserver in order, and replay speeds up to keep pace with them.
+
+    With `bulk`, a whole batch goes out as one newline-delimited JSON
+    request to /log/bulk/, optionally compressed with `compression` ("gzip"
+    or "zstd"), and only the events the webserver failed to store are kept
+    for another attempt. Without it, or once the webserver turns out not to
+    know /log/bulk/, every event is a request of its own to /log/.
+    """
+
+    def __init__(
+        self,
+        serverip,
+        logger=None,
+        queue_size=10000,
+        batch_size=100,
+        flush_interval=1.0,
+        max_connections=2,
+        spool=None,
+        replay_rate=200,
+        bulk=True,
+        compression="gzip",
+        format="json",
+    ):
+        self.url = ("http://%s/log/" % serverip).encode("utf-8")
+        self.bulkurl = ("http://%s/log/bulk/" % serverip).encode("utf-8")
+        self.bulk = bool(bulk)
+        self.compression = compression
+        if self.compression == "zstd" and zstandard is None:
+            print("zstandard is not installed, compressing with gzip", file=stderr)
+            self.compression = "gzip"
+        self.binary = format == "msgpack"
+        if self.binary and not wire.available():
+            print("msgpack is not installed, shipping events as JSON", file=stderr)
+            self.binary = False
+        self.logger = logger
+        self.queue_size = int(queue_size)
+        self.batch_size = int(batch_size)
+        self.flush_interval = float(flush_interval)
+        self.max_connections = int(max_connections)
+        self.spool = spool
+        self.replay_rate = int(replay_rate)
+
+        self.queue = deque()
+        self.inflight = 0
+        # Deferreds of the posts under way, waited for on stop
+        self.requests = set()
+        # events spooled behind the backlog since the last replay
+        self.arrived = 0
+        self.dropped = 0
+        self.failing = False
+        self._flushScheduled = False
+        self._replaying = False
+
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = self.max_connections
+        self.agent = Agent(reactor, connectTimeout=10, pool=self.pool)
+        self.flusher = LoopingCall(self.flush)
+        self.replayer = LoopingCall(self.replay)
+
+        reactor.callWhenRunning(self.start)
+
+    def start(self):
+        if not self.flusher.running:
+            self.flusher.start(self.flush_interval, now=False)
+            if self.spool is not None:
+                self.replayer.start(1.0, now=False)
+            reactor.addSystemEventTrigger("before", "shutdown", self.stop)
+
+    def attachSpool(self, spool):
+        """Start spooling and replaying, for a spool opened after start"""
+        self.spool = spool
+        if self.flusher.running and not self.replayer.running:
+            self.replayer.start(1.0, now=False)
+
+    def stop(self):
+        for loop in (self.flusher, self.replayer):
+            if loop.running:
+                loop.stop()
+        if self.spool is None:
+            self.flush()
+        # failed posts are spooled, so the spool stays open until they finish
+        d = defer.DeferredList(list(self.requests))
+        d.addBoth(self._stopped)
+        return d
+
+    def _stopped(self, _):
+        if self.spool is not None:
+            # keep whatever is still queued for the next run
+            self.spool.append(self._asJSON(self.queue))
+            self.queue.clear()
+            self.spool.close()
+            self.spool = None
+        return self.pool.closeCachedConnections()
+
+    def _track(self, d):
+        self.requests.add(d)
+
+        def untrack(result):
+            self.requests.discard(d)
+            return result
+
+        return d.addBoth(untrack)
+
+    def enqueue(self, logdata, jsondata):
+        """Queue an event for delivery, return False if it had to be dropped"""
+        if self.spool is not None and (
+            self._backlog() or len(self.queue) >= self.queue_size
+        ):
+            # behind the spooled events, never ahead of them
+            self._spoolQueue()
+            self.spool.append([jsondata])
+            self.arrived += 1
+            return True
+        if len(self.queue) >= self.queue_size:
+            self.dropped += 1
+            return False
+
+        # keep whichever form goes on the wire, so it is encoded only once
+        self.queue.append(logdata if self.binary else jsondata)
+        if len(self.queue) >= self.batch_size and not self._flushScheduled:
+            self._flushScheduled = True
+            reactor.callLater(0, self.flush)
+        return True
+
+    def _backlog(self):
+        """
+        True while spooled events wait to be replayed. Live batches still
+        in flight may fail and be spooled too, so until they finished the
+        queue is kept.
+        """
+        return self.spool.pending() and not self.inflight
+
+    def _spoolQueue(self):
+        if self.queue:
+            self.arrived += len(self.queue)
+            self.spool.append(self._asJSON(self.queue))
+            self.queue.clear()
+
+    def flush(self):
+        """Send as many batches as there are free connections"""
+        self._flushScheduled = False
+        if self.spool is not None and self.spool.pending():
+            # replay sends the older spooled events first
+            if not self.inflight:
+                self._spoolQueue()
+            return defer.succeed([])
+        sent = []
+        while self.queue and self.inflight < self.max_connections:
+            batch = deque(
+                self.queue.popleft()
+                for _ in range(min(self.batch_size, len(self.queue)))
+            )
+            metrics.BATCH_SIZE.observe(len(batch))
+            self.inflight += 1
+            d = self.sendBatch(batch)
+            d.addCallbacks(self._cbSent, self._ebSent, errbackArgs=(batch,))
+            sent.append(self._track(d))
+        return defer.DeferredList(sent)
+
+    def sendBatch(self, batch):
+        """
+        Post the batch in one bulk request, or without `bulk` the events one
+        after the other over a single pooled connection.
+
+        Delivered events are popped off `batch`, so on failure it holds
+        exactly the events that still have to be sent. A batch holds either
+        event dicts, sent as MessagePack, or JSON strings.
+        """
+        if self.bulk:
+            return self.sendBulk(batch)
+
+        def sendNext(_=None):
+            if not batch:
+                return None
+            if isinstance(batch[0], dict):
+                d = self.post(wire.pack(batch[0]), contentType=wire.CONTENT_TYPE)
+            else:
+                d = self.post(batch[0].encode("utf-8"))
+            d.addCallback(lambda _: batch.popleft())
+            d.addCallback(sendNext)
+            return d
+
+        return sendNext()
+
+    def sendBulk(self, batch):
+        """
+        Post the whole batch as NDJSON. On success `batch` is left holding
+        only the events the webserver reported as failed to store.
+        """
+        if isinstance(batch[0], dict):
+            body, contentType = wire.packMany(batch), wire.CONTENT_TYPE
+        else:
+            body, contentType = (
+                "\n".join(batch).encode("utf-8"),
+                b"application/x-ndjson",
+            )
+        encoding = None
+        if self.compression == "gzip":
+            body, encoding = gzip(body), b"gzip"
+        elif self.compression == "zstd":
+            body, encoding = zstandard.ZstdCompressor().compress(body), b"zstd"
+
+        def cbResults(body):
+            results = loads(body).get("results", [])
+            retry = [r["index"] for r in results if r.get("status") == "error"]
+            events = list(batch)
+            batch.clear()
+            batch.extend(events[i] for i in retry if i < len(events))
+            if batch:
+                raise BulkRetry()
+
+        d = self.post(body, self.bulkurl, contentType, encoding)
+        return d.addCallback(cbResults)
+
+    def post(self, body, url=None, contentType=b"application/json", encoding=None):
+        headers = Headers({b"Content-Type": [contentType]})
+        if encoding is not None:
+            headers.addRawHeader(b"Content-Encoding", encoding)
+        d = self.agent.request(
+            b"POST", url or self.url, headers, FileBodyProducer(BytesIO(body))
+        )
+        d.addCallback(self._cbResponse)
+        d.addBoth(self._observeLatency, monotonic())
+        return d
+
+    @staticmethod
+    def _observeLatency(result, started):
+        outcome = "failure" if isinstance(result, Failure) else "success"
+        metrics.POST_LATENCY.observe(monotonic() - started, outcome)
+        return result
+
+    def _cbResponse(self, response):
+        d = readBody(response)
+        if 200 <= response.code < 300:
+            return d
+
+        def fail(body):
+            raise ShipperError(response.code, body)
+
+        return d.addCallback(fail)
+
+    def _cbSent(self, result):
+        self.inflight -= 1
+        self._reachable()
+        return result
+
+    def _reachable(self):
+        if self.failing:
+            self.failing = False
+            self.error("shipper: webserver reachable again")
+
+    def _ebSent(self, failure, batch):
+        self.inflight -= 1
+        if self.binary and failure.check(ShipperError) and failure.value.code == 415:
+            self.binary = False
+            self.error("shipper: webserver does not accept msgpack, using JSON")
+        if self.bulk and failure.check(ShipperError) and failure.value.code == 404:
+            self.bulk = False
+            self.error("shipper: webserver has no bulk endpoint, posting singly")
+        if self.spool is not None:
+            self.spool.append(self._asJSON(batch))
+        else:
+            self.dropped += len(batch)
+        if not self.failing:
+            self.failing = True
+            self.error(
+                "shipper: failed to post %d events (%s)"
+                % (len(batch), failure.getErrorMessage())
+            )
+        return None
+
+    @staticmethod
+    def _asJSON(events):
+        """The spool only holds JSON, whatever the wire format"""
+        return [e if isinstance(e, str) else dumps(e, sort_keys=True) for e in events]
+
+    def replay(self):
+        """Send the next rate-limited slice of spooled events, oldest first"""
+        if self._replaying or not self.spool.pending():
+            return None
+        budget = self.replay_rate
+        if not self.failing:
+            # keep pace with the events spooled behind the backlog
+            budget += self.arrived
+        self.arrived = 0
+        records = self.spool.read(budget)
+        if not records:
+            return None
+
+        self._replaying = True
+        batch = deque(jsondata for jsondata, _ in records)
+
+        def done(result):
+            self._replaying = False
+            if isinstance(result, Failure) and result.check(BulkRetry):
+                # the failed events are not a suffix of the slice any more
+                self.spool.commit(records[-1][1])
+                self.spool.append(batch)
+                return None
+            if not isinstance(result, Failure):
+                # while the spool drains no live batch is there to notice
+                self._reachable()
+            delivered = len(records) - len(batch)
+            if delivered:
+                self.spool.commit(records[delivered - 1][1])
+            return None
+
+        return self._track(self.sendBatch(batch).addBoth(done))
+
+    def error(self, msg):
+        if self.logger is not None:
+            self.logger.error(msg)
+        else:
+            print(msg, file=stderr)
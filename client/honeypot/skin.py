@@ -0,0 +1,233 @@
+"""
+Compiled HTTP skins.
+
+A skin directory holds index.html (the login page, its failed-login
+variant marked with <!--STARTERR-->/<!--ENDERR-->), the error pages
+403.html and 404.html, and a static/ tree. Compiling it loads everything
+into memory once: each static file with its gzip and, when the brotli
+package is installed, brotli encoding and a strong ETag per encoding, and
+each error page split around [[URL]]. Serving is then a dict lookup.
+
+Skins are compiled when the http module starts, or ahead of time with
+
+    python -m honeypot.skin <skindir> <bundle>
+
+and loaded from the bundle named by http.skin_bundle.
+"""
+
+import gzip
+import os
+import pickle
+import re
+import sys
+from email.utils import formatdate
+from hashlib import sha256
+
+from twisted.web import static
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUNDLE_VERSION = 1
+ERROR_CODES = ("403", "404")
+
+# compiled skins by real path of the skin directory, shared by every site
+_skins = {}
+
+
+class Asset(object):
+    """A response body with its precompressed encodings"""
+
+    __slots__ = ("body", "gzip", "br", "etag", "contentType", "lastModified")
+
+    def __init__(self, body, contentType, mtime=None):
+        self.body = body
+        self.contentType = contentType
+        self.lastModified = formatdate(mtime, usegmt=True).encode() if mtime else None
+        self.etag = ('"%s"' % sha256(body).hexdigest()[:24]).encode()
+
+        # only keep encodings that pay off, images are compressed already
+        self.gzip = gzip.compress(body, 9, mtime=0)
+        if len(self.gzip) > len(body) * 0.9:
+            self.gzip = None
+        self.br = brotli.compress(body) if brotli is not None else None
+        if self.br is not None and len(self.br) > len(body) * 0.9:
+            self.br = None
+
+    def etags(self):
+        yield self.etag
+        for encoding in (b"gzip", b"br"):
+            yield self.etag[:-1] + b"-" + encoding + b'"'
+
+    def variant(self, acceptEncoding):
+        """Return (body, content encoding or None, etag) for a request"""
+        accepted = _accepted(acceptEncoding)
+        for encoding, body in ((b"br", self.br), (b"gzip", self.gzip)):
+            if body is not None and encoding in accepted:
+                return body, encoding, self.etag[:-1] + b"-" + encoding + b'"'
+        return self.body, None, self.etag
+
+    def notModified(self, ifNoneMatch):
+        """Whether an If-None-Match header matches any encoding of this asset"""
+        if not ifNoneMatch:
+            return False
+        tags = set(t.strip() for t in ifNoneMatch.split(b","))
+        if b"*" in tags:
+            return True
+        tags |= set(t[2:] for t in tags if t.startswith(b"W/"))
+        return any(etag in tags for etag in self.etags())
+
+
+def _accepted(acceptEncoding):
+    accepted = set()
+    for item in (acceptEncoding or b"").split(b","):
+        coding, _, params = item.strip().partition(b";")
+        if params.strip().replace(b" ", b"") in (b"q=0", b"q=0.0", b"q=0.00"):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class Skin(object):
+    """A compiled skin, see compileSkin"""
+
+    def __init__(self, name, assets, login, loginFailed, errors, stamp=None):
+        self.name = name
+        # url path without the leading slash -> Asset
+        self.assets = assets
+        self.directories = set()
+        for path in assets:
+            parts = path.split(b"/")[:-1]
+            for i in range(1, len(parts) + 1):
+                self.directories.add(b"/".join(parts[:i]))
+        self.login = login
+        self.loginFailed = loginFailed
+        # error code -> page template
+        self.errors = errors
+        self.stamp = stamp
+
+    def errorParts(self, code, banner):
+        """The error page with the banner filled in, split around [[URL]]"""
+        page = self.errors[code].replace("[[BANNER]]", banner.decode("utf-8"))
+        return [part.encode("utf-8") for part in page.split("[[URL]]")]
+
+
+def _stamp(skindir):
+    """Changes whenever a file of the skin is added, removed or modified"""
+    files, newest = 0, 0
+    for root, dirs, names in os.walk(skindir):
+        for name in names:
+            files += 1
+            newest = max(newest, os.stat(os.path.join(root, name)).st_mtime)
+    return files, newest
+
+
+def compileSkin(skindir, name=None):
+    if not os.path.isdir(skindir):
+        raise Exception("Directory %s for http skin does not exist." % skindir)
+    name = name or os.path.basename(os.path.normpath(skindir))
+
+    assets = {}
+    staticdir = os.path.join(skindir, "static")
+    for root, dirs, names in os.walk(staticdir):
+        for filename in names:
+            full = os.path.join(root, filename)
+            path = os.path.relpath(full, staticdir).replace(os.sep, "/")
+            contentType, _ = static.getTypeAndEncoding(
+                filename,
+                static.File.contentTypes,
+                static.File.contentEncodings,
+                "text/html",
+            )
+            with open(full, "rb") as f:
+                body = f.read()
+            assets[path.encode("utf-8")] = Asset(
+                body, contentType.encode(), os.stat(full).st_mtime
+            )
+
+    with open(os.path.join(skindir, "index.html")) as f:
+        text = f.read()
+    login = re.sub(r"<!--STARTERR-->.*<!--ENDERR-->", "", text, flags=re.DOTALL)
+    loginFailed = re.sub(r"<!--STARTERR-->|<!--ENDERR-->", "", text)
+
+    errors = {}
+    for code in ERROR_CODES:
+        with open(os.path.join(skindir, code + ".html")) as f:
+            errors[code] = f.read()
+
+    return Skin(
+        name,
+        assets,
+        Asset(login.encode(), b"text/html"),
+        Asset(loginFailed.encode(), b"text/html"),
+        errors,
+        stamp=_stamp(skindir),
+    )
+
+
+def saveSkin(skin, path):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump((BUNDLE_VERSION, skin), f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def loadSkin(path):
+    with open(path, "rb") as f:
+        version, skin = pickle.load(f)
+    if version != BUNDLE_VERSION:
+        raise Exception(
+            "Skin bundle %s has version %s, expected %s"
+            % (path, version, BUNDLE_VERSION)
+        )
+    return skin
+
+
+def getSkin(skindir, bundle=None):
+    """
+    Return the compiled skin for skindir, from the bundle when given.
+    Compiled skins are kept for the life of the process and recompiled only
+    when a file of the skin changed.
+    """
+    if bundle:
+        key = os.path.realpath(bundle)
+        stamp = os.stat(key).st_mtime
+        skin = _skins.get(key)
+        if skin is None or skin.stamp != stamp:
+            skin = loadSkin(key)
+            skin.stamp = stamp
+            _skins[key] = skin
+        return skin
+
+    key = os.path.realpath(skindir)
+    skin = _skins.get(key)
+    if skin is None or skin.stamp != _stamp(key):
+        skin = _skins[key] = compileSkin(key)
+    return skin
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print("usage: python -m honeypot.skin <skindir> <bundle>", file=sys.stderr)
+        return 2
+    # through the package, so the bundle refers to honeypot.skin, not __main__
+    from honeypot import skin as module
+
+    skin = module.compileSkin(argv[0])
+    module.saveSkin(skin, argv[1])
+    size = sum(
+        len(a.body) + len(a.gzip or b"") + len(a.br or b"")
+        for a in skin.assets.values()
+    )
+    print(
+        "compiled %s: %d assets, %d bytes with encodings%s"
+        % (skin.name, len(skin.assets), size, "" if brotli else " (no brotli)")
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+Durable on-disk spool for events that could not be shipped.
+
+Events are appended, one JSON document per line, to numbered segment files
+in the spool directory. A cursor file records the segment and byte offset of
+the oldest event not yet delivered, so a restarted honeypotd resumes replay
+exactly where the previous one stopped. Writes go to the page cache from the
+reactor thread and are fsync'ed in batches from a worker thread.
+"""
+
+from __future__ import print_function
+
+import fcntl
+import json
+import os
+from sys import stderr
+
+from twisted.internet import reactor, threads
+from twisted.internet.task import LoopingCall
+
+SEGMENT_FMT = "segment-%012d.log"
+CURSOR_FILE = "cursor"
+LOCK_FILE = "lock"
+
+
+class EventSpool(object):
+    """
+    Append-only segmented event log with a persistent read cursor.
+
+    A new segment is started once the current one reaches `segment_bytes`.
+    When the spool as a whole grows beyond `max_bytes` the oldest segments
+    are evicted, even if they were never replayed.
+    """
+
+    def __init__(
+        self,
+        path,
+        segment_bytes=4 * 1024 * 1024,
+        max_bytes=256 * 1024 * 1024,
+        fsync_interval=1.0,
+        logger=None,
+    ):
+        self.path = path
+        self.segment_bytes = int(segment_bytes)
+        self.max_bytes = int(max_bytes)
+        self.logger = logger
+        self.evicted = 0
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        # a spool directory belongs to exactly one process
+        self.lock = open(os.path.join(self.path, LOCK_FILE), "w")
+        try:
+            fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            self.lock.close()
+            raise IOError("spool %s is in use by another process" % self.path)
+
+        # segment number -> size in bytes, oldest first
+        self.segments = {}
+        for name in sorted(os.listdir(self.path)):
+            seq = self._parseSegmentName(name)
+            if seq is not None:
+                self.segments[seq] = os.path.getsize(self._segmentPath(seq))
+
+        # never append behind a possibly torn line left by a crash
+        self.writeSeq = max(self.segments) if self.segments else 0
+        if self.segments.get(self.writeSeq):
+            self.writeSeq += 1
+        self.segments.setdefault(self.writeSeq, 0)
+        self.writer = open(self._segmentPath(self.writeSeq), "ab")
+        self.dirty = False
+        self._syncing = False
+
+        self.cursor = self._loadCursor()
+
+        self.syncer = LoopingCall(self.sync)
+        reactor.callWhenRunning(self.syncer.start, float(fsync_interval), False)
+
+    def _segmentPath(self, seq):
+        return os.path.join(self.path, SEGMENT_FMT % seq)
+
+    @staticmethod
+    def _parseSegmentName(name):
+        if not (name.startswith("segment-") and name.endswith(".log")):
+            return None
+        try:
+            return int(name[len("segment-") : -len(".log")])
+        except ValueError:
+            return None
+
+    def _loadCursor(self):
+        try:
+            with open(os.path.join(self.path, CURSOR_FILE)) as f:
+                cursor = json.load(f)
+            seq, offset = int(cursor["segment"]), int(cursor["offset"])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            seq, offset = min(self.segments), 0
+
+        if seq not in self.segments:
+            # the segment was evicted or removed while we were down
+            seq, offset = min(self.segments), 0
+        return seq, min(offset, self.segments[seq])
+
+    def _saveCursor(self):
+        cursorfile = os.path.join(self.path, CURSOR_FILE)
+        tmp = cursorfile + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"segment": self.cursor[0], "offset": self.cursor[1]}, f)
+        os.replace(tmp, cursorfile)
+
+    def size(self):
+        return sum(self.segments.values())
+
+    def pending(self):
+        """True if there are spooled events that have not been committed"""
+        seq, offset = self.cursor
+        return seq != self.writeSeq or offset < self.segments[self.writeSeq]
+
+    def append(self, events):
+        """Spool an iterable of JSON encoded events"""
+        data = b"".join(e.encode("utf-8") + b"\n" for e in events)
+        if not data:
+            return
+        self.writer.write(data)
+        self.segments[self.writeSeq] += len(data)
+        self.dirty = True
+
+        if self.segments[self.writeSeq] >= self.segment_bytes:
+            self._rotate()
+        if self.size() > self.max_bytes:
+            self._evict()
+
+    def _rotate(self):
+        self.writer.flush()
+        fd = os.dup(self.writer.fileno())
+        self.writer.close()
+        threads.deferToThread(self._fsyncAndClose, fd)
+
+        self.writeSeq += 1
+        self.segments[self.writeSeq] = 0
+        self.writer = open(self._segmentPath(self.writeSeq), "ab")
+
+    def _evict(self):
+        while self.size() > self.max_bytes and len(self.segments) > 1:
+            seq = min(self.segments)
+            self.evicted += self.segments.pop(seq)
+            self._remove(seq)
+            if self.cursor[0] == seq:
+                self.cursor = (min(self.segments), 0)
+                self._saveCursor()
+        self.error("spool: evicted oldest events, %d bytes lost so far" % self.evicted)
+
+    def _remove(self, seq):
+        try:
+            os.remove(self._segmentPath(seq))
+        except OSError:
+            pass
+
+    def read(self, maxEvents):
+        """
+        Return up to `maxEvents` spooled events from the cursor onwards as a
+        list of `(jsondata, position)` tuples. Pass the position of the last
+        delivered event to `commit`.
+        """
+        records = []
+        seq, offset = self.cursor
+        # the read may run on into the segment being written
+        self.writer.flush()
+
+        while len(records) < maxEvents:
+            if offset >= self.segments.get(seq, 0):
+                if seq >= self.writeSeq:
+                    break
+                seq, offset = min(s for s in self.segments if s > seq), 0
+                continue
+
+            with open(self._segmentPath(seq), "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # torn write from a crash, nothing follows it
+                        if seq < self.writeSeq:
+                            offset = self.segments[seq]
+                        break
+                    offset += len(line)
+                    records.append((line[:-1].decode("utf-8"), (seq, offset)))
+                    if len(records) >= maxEvents:
+                        break
+                else:
+                    offset = self.segments[seq]
+            if seq == self.writeSeq and offset < self.segments[seq]:
+                break
+        return records
+
+    def commit(self, position):
+        """Move the cursor past delivered events and drop finished segments"""
+        if position[0] not in self.segments or position < self.cursor:
+            # evicted while the events were in flight
+            return
+        seq, offset = position
+        if seq < self.writeSeq and offset >= self.segments[seq]:
+            position = (min(s for s in self.segments if s > seq), 0)
+        self.cursor = position
+        for seq in [s for s in self.segments if s < position[0]]:
+            del self.segments[seq]
+            self._remove(seq)
+        self._saveCursor()
+
+    def sync(self):
+        """Flush spooled events to disk without blocking the reactor"""
+        if not self.dirty or self._syncing:
+            return None
+        self.dirty = False
+        self._syncing = True
+        self.writer.flush()
+        d = threads.deferToThread(self._fsyncAndClose, os.dup(self.writer.fileno()))
+
+        def done(result):
+            self._syncing = False
+            return result
+
+        return d.addBoth(done)
+
+    @staticmethod
+    def _fsyncAndClose(fd):
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        """Flush and close the spool synchronously, used at shutdown"""
+        if self.syncer.running:
+            self.syncer.stop()
+        self.writer.flush()
+        os.fsync(self.writer.fileno())
+        self.writer.close()
+        self._saveCursor()
+        fcntl.flock(self.lock, fcntl.LOCK_UN)
+        self.lock.close()
+
+    def error(self, msg):
+        if self.logger is not None:
+            self.logger.error(msg)
+        else:
+            print(msg, file=stderr)
@@ -0,0 +1,62 @@
+from struct import Struct
+
+from honeypot.framing import PacketBuffer
+from twisted.trial import unittest
+
+HEADER = Struct("<HB")
+
+
+class PacketBufferTests(unittest.TestCase):
+    def test_unpack(self):
+        buf = PacketBuffer()
+        buf.feed(b"\x05")
+        self.assertIsNone(buf.unpack(HEADER))
+        buf.feed(b"\x00\x01")
+        self.assertEqual(buf.unpack(HEADER), (5, 1))
+        # unpack does not consume
+        self.assertEqual(len(buf), 3)
+
+    def test_take(self):
+        buf = PacketBuffer()
+        buf.feed(b"abcdef")
+        self.assertIsNone(buf.take(7))
+        with buf.take(2) as view:
+            self.assertIsInstance(view, memoryview)
+            self.assertEqual(view.tobytes(), b"ab")
+        self.assertEqual(len(buf), 4)
+        with buf.take(4) as view:
+            self.assertEqual(view.tobytes(), b"cdef")
+        self.assertEqual(len(buf), 0)
+
+    def test_skip(self):
+        buf = PacketBuffer()
+        buf.feed(b"\x01\x00\x02payload")
+        buf.skip(HEADER.size)
+        with buf.take(7) as view:
+            self.assertEqual(view.tobytes(), b"payload")
+
+    def test_packetsAcrossFeeds(self):
+        """Packets split over any number of writes come out whole"""
+        packets = [b"first", b"", b"the third packet"]
+        stream = b"".join(HEADER.pack(len(p), i) + p for i, p in enumerate(packets))
+        buf = PacketBuffer()
+        received = []
+        for i in range(len(stream)):
+            buf.feed(stream[i : i + 1])
+            while True:
+                header = buf.unpack(HEADER)
+                if header is None or len(buf) < HEADER.size + header[0]:
+                    break
+                buf.skip(HEADER.size)
+                with buf.take(header[0]) as view:
+                    received.append((header[1], view.tobytes()))
+        self.assertEqual(received, list(enumerate(packets)))
+        self.assertEqual(len(buf), 0)
+
+    def test_feedDropsReadData(self):
+        buf = PacketBuffer()
+        buf.feed(b"abcd")
+        buf.take(3).release()
+        buf.feed(b"ef")
+        self.assertEqual(buf.offset, 0)
+        self.assertEqual(bytes(buf.data), b"def")
@@ -0,0 +1,124 @@
+from honeypot.honeycred import HashVerifier, HoneyCredEngine, cryptcontext
+from twisted.internet import defer
+from twisted.trial import unittest
+
+SECRET = cryptcontext.hash("secret", scheme="pbkdf2_sha512")
+
+
+class Verifier(object):
+    """Runs nothing until told to, so tests decide when a hash is verified"""
+
+    def __init__(self, full=False):
+        self.full = full
+        self.jobs = []
+
+    def run(self, f, *args):
+        if self.full:
+            return None
+        d = defer.Deferred()
+        self.jobs.append((d, f, args))
+        return d
+
+    def finish(self):
+        jobs, self.jobs = self.jobs, []
+        for d, f, args in jobs:
+            d.callback(f(*args))
+
+
+class HoneyCredEngineTests(unittest.TestCase):
+    def setUp(self):
+        self.verifier = Verifier()
+
+    def engine(self, creds, **kwargs):
+        return HoneyCredEngine(creds, verifier=self.verifier, **kwargs)
+
+    def test_plaintext(self):
+        engine = self.engine([{"username": "admin", "password": "admin"}])
+        self.assertIs(engine.check("admin", "admin"), True)
+        self.assertIs(engine.check("admin", "wrong"), False)
+        self.assertIs(engine.check("root", "admin"), False)
+        self.assertEqual(self.verifier.jobs, [])
+
+    def test_anyUsername(self):
+        engine = self.engine([{"password": "letmein"}])
+        self.assertIs(engine.check("root", "letmein"), True)
+        self.assertIs(engine.check(None, "letmein"), True)
+
+    def test_anyPassword(self):
+        engine = self.engine([{"username": "oracle"}])
+        self.assertIs(engine.check("oracle", "whatever"), True)
+        self.assertIs(engine.check("root", "whatever"), False)
+
+    def test_hash(self):
+        engine = self.engine([{"username": "admin", "password": SECRET}])
+        d = engine.check("admin", "secret")
+        self.assertIsInstance(d, defer.Deferred)
+        self.verifier.finish()
+        self.assertIs(self.successResultOf(d), True)
+
+        # remembered, not verified again
+        self.assertIs(engine.check("admin", "secret"), True)
+        self.assertEqual(self.verifier.jobs, [])
+
+    def test_hashOnlyForItsUsername(self):
+        engine = self.engine([{"username": "admin", "password": SECRET}])
+        self.assertIs(engine.check("root", "secret"), False)
+        self.assertEqual(self.verifier.jobs, [])
+
+    def test_dedup(self):
+        """Concurrent attempts with the same credentials share one verification"""
+        engine = self.engine([{"password": SECRET}])
+        first = engine.check("root", "guess")
+        second = engine.check("root", "guess")
+        self.assertEqual(len(self.verifier.jobs), 1)
+        self.verifier.finish()
+        self.assertIs(self.successResultOf(first), False)
+        self.assertIs(self.successResultOf(second), False)
+        self.assertEqual(engine.pending, {})
+
+    def test_cacheSize(self):
+        engine = self.engine([{"username": "admin", "password": "admin"}], cacheSize=2)
+        for password in ("a", "b", "c"):
+            engine.check("admin", password)
+        self.assertEqual(list(engine.cache), [("admin", "b"), ("admin", "c")])
+        # a hit moves an entry to the back
+        engine.check("admin", "b")
+        engine.check("admin", "d")
+        self.assertEqual(list(engine.cache), [("admin", "b"), ("admin", "d")])
+
+    def test_busy(self):
+        self.verifier.full = True
+        engine = self.engine([{"password": SECRET}])
+        self.assertIsNone(engine.check("root", "secret"))
+        self.assertEqual(engine.pending, {})
+        self.assertEqual(engine.cache, {})
+
+        # tried again once the verifier has room
+        self.verifier.full = False
+        d = engine.check("root", "secret")
+        self.verifier.finish()
+        self.assertIs(self.successResultOf(d), True)
+
+    def test_failure(self):
+        engine = self.engine([{"password": SECRET}])
+        first = engine.check("root", "guess")
+        second = engine.check("root", "guess")
+        d, f, args = self.verifier.jobs.pop()
+        d.errback(RuntimeError("boom"))
+        self.failureResultOf(first, RuntimeError)
+        self.failureResultOf(second, RuntimeError)
+        self.assertEqual(engine.cache, {})
+
+
+class HashVerifierTests(unittest.TestCase):
+    def test_maxQueued(self):
+        verifier = HashVerifier(workers=1, maxQueued=1)
+        self.addCleanup(verifier.stop)
+        d = verifier.run(HoneyCredEngine.verifyHashes, "secret", [SECRET])
+        self.assertIsNone(verifier.run(HoneyCredEngine.verifyHashes, "x", [SECRET]))
+
+        def done(result):
+            self.assertIs(result, True)
+            self.assertEqual(verifier.queued, 0)
+
+        return d.addCallback(done)
@@ -0,0 +1,120 @@
+from honeypot.modules.http import ABORT_TIMEOUT, GuardedSite
+from honeypot.ratelimit import ConnectionAdmission
+from twisted.internet.address import IPv4Address
+from twisted.internet.task import Clock
+from twisted.internet.testing import StringTransport
+from twisted.trial import unittest
+from twisted.web.resource import Resource
+
+
+class Page(Resource):
+    isLeaf = True
+
+    def render(self, request):
+        request.content.read()
+        return b"ok"
+
+
+class GuardedSiteTests(unittest.TestCase):
+    def setUp(self):
+        self.reported = []
+        self.admission = ConnectionAdmission(
+            lambda *args: self.reported.append(args),
+            max_per_source=2,
+            max_total=3,
+            subnet_rate=0,
+        )
+        self.clock = Clock()
+        self.site = GuardedSite(
+            Page(),
+            self.admission,
+            b"Apache",
+            readTimeout=10,
+            maxHeaderSize=256,
+            maxBodySize=64,
+        )
+        self.site.reactor = self.clock
+
+    def connect(self, host="192.0.2.1"):
+        address = IPv4Address("TCP", host, 40000)
+        channel = self.site.buildProtocol(address)
+        transport = StringTransport(peerAddress=address)
+        channel.makeConnection(transport)
+        return channel, transport
+
+    def assertRejected(self, transport, status, reason, host="192.0.2.1"):
+        self.assertTrue(transport.value().startswith(b"HTTP/1.1 %d " % status))
+        self.assertTrue(transport.disconnecting)
+        self.assertEqual(self.admission.rejected[host].get(reason), 1)
+
+    def test_request(self):
+        channel, transport = self.connect()
+        channel.dataReceived(b"GET / HTTP/1.1\r\nHost: example\r\n\r\n")
+        self.assertTrue(transport.value().startswith(b"HTTP/1.1 200 "))
+        self.assertEqual(self.admission.rejected, {})
+
+    def test_slowRequest(self):
+        channel, transport = self.connect()
+        channel.dataReceived(b"GET / HTTP/1.1\r\n")
+        self.clock.advance(5)
+        channel.dataReceived(b"Host: example\r\n")
+        self.clock.advance(5)
+        self.assertRejected(transport, 408, "timeout")
+
+    def test_manyHeaders(self):
+        channel, transport = self.connect()
+        channel.dataReceived(b"GET / HTTP/1.1\r\n")
+        for i in range(20):
+            channel.dataReceived(b"X-Header-%d: %s\r\n" % (i, b"a" * 20))
+        self.assertRejected(transport, 431, "header")
+
+    def test_longHeaderLine(self):
+        channel, transport = self.connect()
+        channel.dataReceived(b"GET / HTTP/1.1\r\nCookie: " + b"a" * 300)
+        self.assertRejected(transport, 431, "header")
+
+    def test_headerSizePerRequest(self):
+        """Keep-alive requests each get the full header size"""
+        channel, transport = self.connect()
+        request = b"GET / HTTP/1.1\r\nHost: example\r\nX-Pad: %s\r\n\r\n" % (b"a" * 150)
+        channel.dataReceived(request)
+        channel.dataReceived(request)
+        self.assertEqual(transport.value().count(b"HTTP/1.1 200 "), 2)
+
+    def test_largeBody(self):
+        channel, transport = self.connect()
+        channel.dataReceived(b"POST / HTTP/1.1\r\nContent-Length: 65\r\n\r\n")
+        self.assertRejected(transport, 413, "body")
+
+    def test_largeChunkedBody(self):
+        channel, transport = self.connect()
+        channel.dataReceived(b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n")
+        for _ in range(3):
+            channel.dataReceived(b"20\r\n" + b"a" * 32 + b"\r\n")
+        self.assertRejected(transport, 413, "body")
+
+    def test_tooManyFromSource(self):
+        self.connect()
+        self.connect()
+        channel, transport = self.connect()
+        self.assertRejected(transport, 503, "source")
+
+    def test_tooManyInTotal(self):
+        self.connect("192.0.2.1")
+        self.connect("192.0.2.2")
+        self.connect("192.0.2.3")
+        channel, transport = self.connect("192.0.2.4")
+        self.assertRejected(transport, 503, "total", host="192.0.2.4")
+
+    def test_slotReleased(self):
+        channel, transport = self.connect()
+        channel.connectionLost(None)
+        self.assertEqual(self.admission.total, 0)
+        self.assertEqual(self.admission.active, {})
+
+    def test_abortUnreadResponse(self):
+        channel, transport = self.connect()
+        channel.dataReceived(b"POST / HTTP/1.1\r\nContent-Length: 65\r\n\r\n")
+        self.assertFalse(transport.disconnected)
+        self.clock.advance(ABORT_TIMEOUT)
+        self.assertTrue(transport.disconnected)
@@ -0,0 +1,53 @@
+from honeypot.iphelper import IPMatcher
+from twisted.trial import unittest
+
+
+class IPMatcherTests(unittest.TestCase):
+    def test_ipv4(self):
+        matcher = IPMatcher(["10.0.0.0/8", "192.168.1.7", "172.16.0.0/12"])
+        self.assertIn("10.255.1.2", matcher)
+        self.assertIn("192.168.1.7", matcher)
+        self.assertIn("172.31.255.255", matcher)
+        self.assertNotIn("192.168.1.8", matcher)
+        self.assertNotIn("172.32.0.0", matcher)
+        self.assertNotIn("11.0.0.1", matcher)
+
+    def test_ipv6(self):
+        matcher = IPMatcher(["2001:db8::/32", "fe80::1"])
+        self.assertIn("2001:db8:1::5", matcher)
+        self.assertIn("fe80::1", matcher)
+        self.assertNotIn("fe80::2", matcher)
+        self.assertNotIn("2001:db9::1", matcher)
+
+    def test_familiesApart(self):
+        """An IPv6 network never matches IPv4 addresses, and the other way round"""
+        matcher = IPMatcher(["::/0"])
+        self.assertIn("::1", matcher)
+        self.assertNotIn("127.0.0.1", matcher)
+        self.assertNotIn("::1", IPMatcher(["0.0.0.0/0"]))
+
+    def test_ipv4Mapped(self):
+        matcher = IPMatcher(["10.0.0.0/8"])
+        self.assertIn("::ffff:10.1.2.3", matcher)
+        self.assertNotIn("::ffff:11.1.2.3", matcher)
+
+    def test_everything(self):
+        matcher = IPMatcher(["0.0.0.0/0"])
+        self.assertIn("1.2.3.4", matcher)
+        self.assertIn("255.255.255.255", matcher)
+
+    def test_hostBitsSet(self):
+        """A network written with host bits set still covers the whole network"""
+        self.assertIn("10.1.9.9", IPMatcher(["10.1.2.3/16"]))
+
+    def test_invalid(self):
+        matcher = IPMatcher(["not a network", "10.0.0.0/33", "10.0.0.0/8"])
+        self.assertEqual(len(matcher), 1)
+        self.assertNotIn("", matcher)
+        self.assertNotIn("not an address", matcher)
+        self.assertNotIn(None, matcher)
+
+    def test_empty(self):
+        matcher = IPMatcher()
+        self.assertFalse(matcher)
+        self.assertNotIn("10.0.0.1", matcher)
@@ -0,0 +1,102 @@
+import os
+
+from honeypot.spool import EventSpool
+from twisted.trial import unittest
+
+
+class EventSpoolTests(unittest.TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+        self.spools = []
+
+    def tearDown(self):
+        for spool in self.spools:
+            if not spool.writer.closed:
+                spool.close()
+
+    def open(self, **kwargs):
+        kwargs.setdefault("logger", self)
+        spool = EventSpool(self.path, **kwargs)
+        self.spools.append(spool)
+        return spool
+
+    def error(self, msg):
+        self.errors = getattr(self, "errors", []) + [msg]
+
+    def events(self, records):
+        return [jsondata for jsondata, _ in records]
+
+    def test_appendRead(self):
+        spool = self.open()
+        self.assertFalse(spool.pending())
+        spool.append(['{"a": 1}', '{"a": 2}'])
+        spool.append(['{"a": 3}'])
+        self.assertTrue(spool.pending())
+        self.assertEqual(
+            self.events(spool.read(10)), ['{"a": 1}', '{"a": 2}', '{"a": 3}']
+        )
+        self.assertEqual(self.events(spool.read(2)), ['{"a": 1}', '{"a": 2}'])
+
+    def test_commit(self):
+        spool = self.open()
+        spool.append(["1", "2", "3"])
+        records = spool.read(2)
+        spool.commit(records[-1][1])
+        self.assertEqual(self.events(spool.read(10)), ["3"])
+        spool.commit(spool.read(10)[-1][1])
+        self.assertFalse(spool.pending())
+        self.assertEqual(spool.read(10), [])
+
+    def test_resume(self):
+        """A reopened spool replays from the committed cursor"""
+        spool = self.open()
+        spool.append(["1", "2", "3"])
+        spool.commit(spool.read(1)[-1][1])
+        spool.close()
+
+        spool = self.open()
+        self.assertEqual(self.events(spool.read(10)), ["2", "3"])
+        spool.append(["4"])
+        self.assertEqual(self.events(spool.read(10)), ["2", "3", "4"])
+
+    def test_segments(self):
+        spool = self.open(segment_bytes=16)
+        for i in range(6):
+            spool.append(["event-%d" % i])
+        # two events of 8 bytes fill a segment
+        self.assertEqual(len(spool.segments), 4)
+        records = spool.read(10)
+        self.assertEqual(self.events(records), ["event-%d" % i for i in range(6)])
+
+        # committing past a segment removes its file
+        spool.commit(records[-1][1])
+        self.assertEqual(len(spool.segments), 1)
+        self.assertEqual(len(os.listdir(self.path)), 3)
+
+    def test_tornWrite(self):
+        """A line cut short by a crash is skipped and never appended to"""
+        spool = self.open()
+        spool.append(["1", "2"])
+        spool.close()
+        segment = spool._segmentPath(spool.writeSeq)
+        with open(segment, "ab") as f:
+            f.write(b'{"torn')
+
+        spool = self.open()
+        spool.append(["3"])
+        self.assertNotEqual(spool._segmentPath(spool.writeSeq), segment)
+        self.assertEqual(self.events(spool.read(10)), ["1", "2", "3"])
+
+    def test_evict(self):
+        spool = self.open(segment_bytes=16, max_bytes=32)
+        for i in range(10):
+            spool.append(["event-%d" % i])
+        self.assertLessEqual(spool.size(), 32)
+        self.assertTrue(spool.evicted)
+        self.assertTrue(self.errors)
+        events = self.events(spool.read(100))
+        self.assertEqual(events, ["event-%d" % i for i in range(10 - len(events), 10)])
+
+    def test_locked(self):
+        self.open()
+        self.assertRaises(IOError, EventSpool, self.path)
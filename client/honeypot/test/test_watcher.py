@@ -0,0 +1,69 @@
+from twisted.trial import unittest
+
+try:
+    from honeypot.modules import FileSystemWatcher
+except ImportError:
+    FileSystemWatcher = None
+
+
+class Watcher(FileSystemWatcher or object):
+    READ_SIZE = 4
+    MAX_LINE = 10
+    BATCH_LINES = 2
+
+    def handleLines(self, lines=None):
+        self.batches.append(lines)
+
+
+class ReadLinesTests(unittest.TestCase):
+    if FileSystemWatcher is None:
+        skip = "FileSystemWatcher needs inotify"
+
+    def setUp(self):
+        self.path = self.mktemp()
+        self.out = open(self.path, "wb")
+        self.addCleanup(self.out.close)
+        self.watcher = Watcher(self.path)
+        self.watcher.batches = []
+        self.watcher.f = open(self.path, "rb")
+        self.addCleanup(self.watcher.f.close)
+
+    def write(self, data):
+        self.out.write(data)
+        self.out.flush()
+        return list(self.watcher.readLines())
+
+    def test_lines(self):
+        self.assertEqual(self.write(b"one\ntwo\r\n\nthree\n"), ["one", "two", "three"])
+        self.assertEqual(self.write(b""), [])
+
+    def test_partialLine(self):
+        """A line is handed out only once its newline was written"""
+        self.assertEqual(self.write(b"one\ntw"), ["one"])
+        self.assertEqual(self.write(b"o and"), [])
+        self.assertEqual(self.write(b"\n"), ["two and"])
+
+    def test_longLine(self):
+        self.assertEqual(
+            self.write(b"a" * 10 + b"\n" + b"b" * 11 + b"\nc\n"), ["a" * 10, "c"]
+        )
+
+    def test_longPartialLine(self):
+        """A line too long to hold is dropped up to its newline, however late that comes"""
+        self.assertEqual(self.write(b"one\n" + b"x" * 30), ["one"])
+        self.assertTrue(self.watcher.discarding)
+        self.assertEqual(self.write(b"x" * 30), [])
+        self.assertEqual(self.write(b"xx\ntwo\n"), ["two"])
+        self.assertFalse(self.watcher.discarding)
+
+    def test_truncated(self):
+        self.assertEqual(self.write(b"one\ntwo\n"), ["one", "two"])
+        self.out.seek(0)
+        self.out.truncate()
+        self.assertEqual(self.write(b"new\n"), ["new"])
+
+    def test_batches(self):
+        self.out.write(b"1\n2\n3\n4\n5\n")
+        self.out.flush()
+        self.watcher.processAuditLines()
+        self.assertEqual(self.watcher.batches, [["1", "2"], ["3", "4"], ["5"]])
@@ -0,0 +1,71 @@
+"""
+Compact binary encoding of events for the webserver.
+
+Events are packed with MessagePack, and the field names every event carries
+are replaced by small integers from a fixed dictionary shared with the
+webserver (webserver/util/wire.py). JSON remains the default and the
+fallback when msgpack is not installed.
+"""
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+CONTENT_TYPE = b"application/x-msgpack"
+
+# Key ids are part of the wire format: only ever append to this list, and
+# keep it identical to the copy in webserver/util/wire.py.
+KEYS = [
+    "dst_host",
+    "dst_port",
+    "honeycred",
+    "local_time",
+    "local_time_adjusted",
+    "logdata",
+    "logtype",
+    "node_id",
+    "src_host",
+    "src_port",
+    "utc_time",
+    "USERNAME",
+    "PASSWORD",
+    "LOCALVERSION",
+    "REMOTEVERSION",
+    "SESSION",
+    "SKIN",
+    "HOSTNAME",
+    "PATH",
+    "USERAGENT",
+    "CMD",
+    "ARGS",
+    "REPO",
+    "HOST",
+    "NTP CMD",
+    "INPUT",
+    "msg",
+]
+KEY_IDS = dict((k, i) for i, k in enumerate(KEYS))
+
+
+def available():
+    return msgpack is not None
+
+
+def compact(obj):
+    """Replace known dict keys with their ids, recursively"""
+    if isinstance(obj, dict):
+        return dict((KEY_IDS.get(k, k), compact(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return [compact(v) for v in obj]
+    return obj
+
+
+def pack(event):
+    return msgpack.packb(compact(event), use_bin_type=True, default=str)
+
+
+def packMany(events):
+    """Pack events back to back, the webserver reads them as a stream"""
+    packer = msgpack.Packer(use_bin_type=True, default=str)
+    return b"".join(packer.pack(compact(e)) for e in events)
@@ -19,6 +19,14 @@ requirements = [
     "hpfeeds==3.0.0",
 ]
 
+# optional, each one enables the settings noted in README.md
+extras = {
+    "zstd": ["zstandard>=0.15"],
+    "msgpack": ["msgpack>=1.0"],
+    "brotli": ["Brotli>=1.0"],
+}
+extras["all"] = sorted(set(sum(extras.values(), [])))
+
 
 setup(
     name="honeypot",
@@ -29,6 +37,7 @@ setup(
     description="Honeypot daemon",
     long_description="A low interaction honeypot intended to be run on internal networks.",
     install_requires=requirements,
+    extras_require=extras,
     license="BSD",
     packages=find_packages(exclude="test"),
     scripts=["bin/honeypotd", "bin/honeypot.tac"],
@@ -153,8 +153,8 @@ class LogOp:
                 print(e)
             finally:
                 self.session.close()
-        else:
-            return False
+        # 入库失败时调用方需要知道, 以便客户端重传
+        return False
 
     # 查询日志表攻击列表数据
     def page_select_attack(self, page_index):
@@ -6,7 +6,16 @@ from json import loads
 # from service.emailservice import send_mail
 # from service.paginationlog import listpage
 # from util.auth import jwtauth
-from service.splitjsonlog import parserlog
+from service.splitjsonlog import LogStoreError, parserlog
+from util.wire import (
+    BodyTooLarge,
+    UnsupportedEncoding,
+    decompress,
+    is_msgpack,
+    iterevents,
+    unpackevent,
+    unpackevents,
+)
 
 from handlers.base import BaseHandler
 
@@ -23,8 +32,17 @@ class ReceiveJsonHandler(BaseHandler):
 
     def prepare(self):
         self.set_header("Server", "Apache-Coyote/1.1")
-        if self.request.headers["Content-Type"].startswith("application/json"):
+        content_type = self.request.headers.get("Content-Type", "")
+        if content_type.startswith("application/json"):
             self.json_args = loads(self.request.body)
+        elif is_msgpack(content_type):
+            # 紧凑二进制格式, 字段名已编码为整数
+            try:
+                self.json_args = unpackevent(self.request.body)
+            except UnsupportedEncoding:
+                self.send_error(status_code=415)
+            except ValueError:
+                self.send_error(status_code=400)
         else:
             self.json_args = None
             message = "Unable to parse JSON."
@@ -32,14 +50,91 @@ class ReceiveJsonHandler(BaseHandler):
 
     def post(self):
         # 接收post json客户端蜜罐日志
-        parambytes = self.request.body
-        paramstr = loads(parambytes.decode("utf-8"))
-        paramdict = loads(paramstr)
+        # 旧客户端会把日志二次编码成 JSON 字符串
+        paramdict = self.json_args
+        if isinstance(paramdict, str):
+            paramdict = loads(paramdict)
         # print param
         # print(type(param))
-        parserlog(paramdict)
+        try:
+            parserlog(paramdict)
+        except LogStoreError as e:
+            self.set_status(500)
+            self.write({"error": str(e)})
+            return
 
         self.write(paramdict)
 
     def get(self):
         self.write("get ok")
+
+
+# @jwtauth
+class ReceiveBulkHandler(BaseHandler):
+    """
+    接收客户端批量提交的日志, 请求体为 NDJSON 或首尾相接的 MessagePack,
+    可用 gzip 或 zstd 压缩
+    """
+
+    # ----------------------------------------------------------------------
+
+    def prepare(self):
+        self.set_header("Server", "Apache-Coyote/1.1")
+
+    def post(self):
+        # 逐条入库, 并返回每条日志的处理结果, 客户端只需重传 status 为 error 的日志
+        try:
+            body = decompress(
+                self.request.body, self.request.headers.get("Content-Encoding")
+            )
+        except UnsupportedEncoding as e:
+            self.set_status(415)
+            self.write({"error": "unsupported content encoding: %s" % e})
+            return
+        except BodyTooLarge as e:
+            self.set_status(413)
+            self.write({"error": "decompressed body exceeds %s bytes" % e})
+            return
+        except (OSError, EOFError, ValueError) as e:
+            self.set_status(400)
+            self.write({"error": "unable to decompress body: %s" % e})
+            return
+
+        if is_msgpack(self.request.headers.get("Content-Type")):
+            try:
+                events = list(unpackevents(body))
+            except UnsupportedEncoding as e:
+                self.set_status(415)
+                self.write({"error": "unsupported content type: %s" % e})
+                return
+        else:
+            events = iterevents(body)
+
+        results = []
+        accepted = 0
+        for index, (event, reason) in enumerate(events):
+            if event is None:
+                results.append({"index": index, "status": "invalid", "reason": reason})
+                continue
+            try:
+                ok = parserlog(event)
+            except Exception as e:
+                results.append({"index": index, "status": "error", "reason": str(e)})
+                continue
+            if ok is False:
+                reason = "missing src_host or dst_host"
+                results.append({"index": index, "status": "invalid", "reason": reason})
+            elif ok is not True:
+                reason = "event was not stored"
+                results.append({"index": index, "status": "error", "reason": reason})
+            else:
+                accepted += 1
+                results.append({"index": index, "status": "ok"})
+
+        self.write(
+            {
+                "accepted": accepted,
+                "rejected": len(results) - accepted,
+                "results": results,
+            }
+        )
@@ -14,6 +14,10 @@ from service.whiteportservice import whiteports
 loginst = LogOp()
 
 
+class LogStoreError(Exception):
+    """日志未能写入数据库"""
+
+
 def parserlog(jsonlog):
     # 接收客户端post过来的数据格式化
     if jsonlog:
@@ -467,8 +471,10 @@ def parserlog(jsonlog):
                         servername,
                         domainname,
                     )
+                    if not logbool:
+                        raise LogStoreError("failed to store event")
 
-                    if logbool and white == 2:
+                    if white == 2:
                         # 发送邮件功能
                         if switches() == "on":
                             if str(logtype) == "2000":
@@ -536,7 +542,7 @@ def parserlog(jsonlog):
                                 id=str(uuid1()),
                             )
                             # send_mail("蜜罐告警："+logtype,content)
-                            return True
+                    return True
             else:
                 return False
         else:
@@ -0,0 +1,118 @@
+# -*- coding:utf-8 -*-
+"""批量日志接口 /log/bulk/ 的测试, 在 webserver 目录下运行: python -m unittest discover tests"""
+
+import sys
+import types
+from gzip import compress as gzip
+from json import dumps, loads
+from unittest import mock
+
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+# 入库依赖数据库, 测试中以 parserlog 的替身代替 service.splitjsonlog
+splitjsonlog = types.ModuleType("service.splitjsonlog")
+
+
+class LogStoreError(Exception):
+    pass
+
+
+splitjsonlog.LogStoreError = LogStoreError
+splitjsonlog.parserlog = None
+sys.modules.setdefault("service.splitjsonlog", splitjsonlog)
+
+from handlers.logcollection import ReceiveBulkHandler  # noqa: E402
+from util import wire  # noqa: E402
+
+
+def ndjson(*events):
+    return "\n".join(dumps(e) for e in events).encode("utf-8")
+
+
+def event(i):
+    return {"src_host": "192.0.2.1", "dst_host": "192.0.2.2", "i": i}
+
+
+class ReceiveBulkHandlerTest(AsyncHTTPTestCase):
+    def get_app(self):
+        return Application([(r"/log/bulk/*", ReceiveBulkHandler)])
+
+    def setUp(self):
+        super(ReceiveBulkHandlerTest, self).setUp()
+        self.stored = []
+        patcher = mock.patch("handlers.logcollection.parserlog", self.parserlog)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def parserlog(self, event):
+        if event.get("fail"):
+            return None
+        if event.get("invalid"):
+            return False
+        self.stored.append(event)
+        return True
+
+    def post(self, body, **headers):
+        headers.setdefault("Content-Type", "application/x-ndjson")
+        response = self.fetch("/log/bulk/", method="POST", body=body, headers=headers)
+        return response.code, loads(response.body)
+
+    def test_ndjson(self):
+        code, result = self.post(ndjson(event(0), event(1), event(2)))
+        self.assertEqual(code, 200)
+        self.assertEqual(result["accepted"], 3)
+        self.assertEqual([e["i"] for e in self.stored], [0, 1, 2])
+
+    def test_results(self):
+        """每条日志单独报告结果, 只有 error 需要客户端重传"""
+        body = ndjson(event(0), dict(event(1), fail=True), dict(event(2), invalid=True))
+        body += b"\nnot json\n"
+        code, result = self.post(body)
+        self.assertEqual(code, 200)
+        self.assertEqual(result["accepted"], 1)
+        self.assertEqual(
+            [r["status"] for r in result["results"]],
+            ["ok", "error", "invalid", "invalid"],
+        )
+
+    def test_doubleEncoded(self):
+        """旧客户端把日志二次编码成 JSON 字符串"""
+        code, result = self.post(dumps(dumps(event(0))).encode("utf-8"))
+        self.assertEqual(result["accepted"], 1)
+
+    def test_gzip(self):
+        code, result = self.post(
+            gzip(ndjson(event(0), event(1))), **{"Content-Encoding": "gzip"}
+        )
+        self.assertEqual(code, 200)
+        self.assertEqual(result["accepted"], 2)
+
+    def test_zstd(self):
+        if wire.zstandard is None:
+            self.skipTest("zstandard is not installed")
+        body = wire.zstandard.ZstdCompressor().compress(ndjson(event(0)))
+        code, result = self.post(body, **{"Content-Encoding": "zstd"})
+        self.assertEqual(result["accepted"], 1)
+
+    def test_msgpack(self):
+        if wire.msgpack is None:
+            self.skipTest("msgpack is not installed")
+        body = wire.msgpack.packb(event(0)) + wire.msgpack.packb(event(1))
+        code, result = self.post(body, **{"Content-Type": wire.MSGPACK_CONTENT_TYPE})
+        self.assertEqual(result["accepted"], 2)
+
+    def test_unsupportedEncoding(self):
+        code, result = self.post(ndjson(event(0)), **{"Content-Encoding": "br"})
+        self.assertEqual(code, 415)
+        self.assertEqual(self.stored, [])
+
+    def test_corruptBody(self):
+        code, result = self.post(b"not gzip", **{"Content-Encoding": "gzip"})
+        self.assertEqual(code, 400)
+
+    def test_decompressionBomb(self):
+        body = gzip(b"\n" * (wire.MAX_DECOMPRESSED_SIZE + 1))
+        code, result = self.post(body, **{"Content-Encoding": "gzip"})
+        self.assertEqual(code, 413)
+        self.assertEqual(self.stored, [])
@@ -11,6 +11,7 @@ url = [
     (r"/", index.IndexHandler),
     (r"/auth/*", login.AuthHandler),
     (r"/log/*", logcollection.ReceiveJsonHandler),
+    (r"/log/bulk/*", logcollection.ReceiveBulkHandler),
     (r"/log/list/*", paginationlog.GetlistJsonHandler),
     (r"/mail/*", email.EmailModifyHandler),
     (r"/chart/*", chart.ChartHandler),
@@ -0,0 +1,161 @@
+# -*- coding:utf-8 -*-
+""" 客户端日志请求体的解压与解析 (JSON / NDJSON / MessagePack) """
+
+from gzip import GzipFile
+from io import BytesIO
+from json import loads
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_CONTENT_TYPE = "application/x-msgpack"
+
+# 解压后请求体的上限, 防止压缩炸弹耗尽内存
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+# 每次最多解压的字节数
+CHUNK_SIZE = 64 * 1024
+
+# MessagePack 日志中的字段名被编码为整数, 与客户端 honeypot/wire.py 保持一致, 只能追加
+KEYS = [
+    "dst_host",
+    "dst_port",
+    "honeycred",
+    "local_time",
+    "local_time_adjusted",
+    "logdata",
+    "logtype",
+    "node_id",
+    "src_host",
+    "src_port",
+    "utc_time",
+    "USERNAME",
+    "PASSWORD",
+    "LOCALVERSION",
+    "REMOTEVERSION",
+    "SESSION",
+    "SKIN",
+    "HOSTNAME",
+    "PATH",
+    "USERAGENT",
+    "CMD",
+    "ARGS",
+    "REPO",
+    "HOST",
+    "NTP CMD",
+    "INPUT",
+    "msg",
+]
+
+
+class UnsupportedEncoding(Exception):
+    """请求体使用了服务端不支持的 Content-Encoding"""
+
+
+class BodyTooLarge(Exception):
+    """解压后的请求体超过 MAX_DECOMPRESSED_SIZE"""
+
+
+def readlimited(reader, limit):
+    """分块读取解压流, 超过 limit 字节即停止"""
+    chunks = []
+    size = 0
+    while True:
+        chunk = reader.read(CHUNK_SIZE)
+        if not chunk:
+            return b"".join(chunks)
+        size += len(chunk)
+        if size > limit:
+            raise BodyTooLarge(limit)
+        chunks.append(chunk)
+
+
+def decompress(body, encoding, limit=MAX_DECOMPRESSED_SIZE):
+    """按 Content-Encoding 解压请求体, 支持 gzip 与 zstd, 解压后最多 limit 字节"""
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return body
+    if encoding in ("gzip", "x-gzip"):
+        with GzipFile(fileobj=BytesIO(body)) as reader:
+            return readlimited(reader, limit)
+    if encoding == "zstd" and zstandard is not None:
+        try:
+            with zstandard.ZstdDecompressor().stream_reader(body) as reader:
+                return readlimited(reader, limit)
+        except zstandard.ZstdError as e:
+            raise ValueError(str(e))
+    raise UnsupportedEncoding(encoding)
+
+
+def iterevents(body):
+    """
+    逐行解析 NDJSON, 每行可以是一条日志、一个日志数组,
+    或旧客户端二次编码的 JSON 字符串。
+    解析失败的行产生 (None, 错误原因)。
+    """
+    for line in body.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = loads(line.decode("utf-8"))
+            if isinstance(item, str):
+                item = loads(item)
+        except ValueError as e:
+            yield None, "invalid json: %s" % e
+            continue
+
+        for event in item if isinstance(item, list) else [item]:
+            if isinstance(event, dict):
+                yield event, None
+            else:
+                yield None, "event is not an object"
+
+
+def is_msgpack(content_type):
+    return (content_type or "").startswith(MSGPACK_CONTENT_TYPE)
+
+
+def expand(obj):
+    """还原整数字段名, 二进制串按 utf-8 解码以便入库"""
+    if isinstance(obj, dict):
+        return dict(
+            (KEYS[k] if isinstance(k, int) and k < len(KEYS) else k, expand(v))
+            for k, v in obj.items()
+        )
+    if isinstance(obj, list):
+        return [expand(v) for v in obj]
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", "replace")
+    return obj
+
+
+def unpackevent(body):
+    """解析单条 MessagePack 日志"""
+    if msgpack is None:
+        raise UnsupportedEncoding(MSGPACK_CONTENT_TYPE)
+    return expand(msgpack.unpackb(body, raw=False, strict_map_key=False))
+
+
+def unpackevents(body):
+    """逐条解析首尾相接的 MessagePack 日志, 产生 (日志, 错误原因)"""
+    if msgpack is None:
+        raise UnsupportedEncoding(MSGPACK_CONTENT_TYPE)
+    unpacker = msgpack.Unpacker(raw=False, strict_map_key=False)
+    unpacker.feed(body)
+    try:
+        for item in unpacker:
+            event = expand(item)
+            if isinstance(event, dict):
+                yield event, None
+            else:
+                yield None, "event is not an object"
+    except ValueError as e:
+        yield None, "invalid msgpack: %s" % e